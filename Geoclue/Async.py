@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Helpers for asynchronous D-Bus calls.
+
+The replies of the calls are delivered by the GLib main loop, so waiting
+for a L{Pending} call iterates the default main context until the reply
+arrives.
+"""
+
+import collections
+
+import gobject
+
+def iterate(may_block=True):
+    """Runs one iteration of the default main context.
+
+    @param may_block: C{True} to wait for an event if none is pending.
+    @return: C{True} if an event was dispatched.
+    """
+    return gobject.main_context_default().iteration(may_block)
+
+class Timeout(Exception):
+    """Raised when a L{Pending} call does not finish in time."""
+    pass
+
+class Pending:
+    """The result of an asynchronous call.
+
+    C{set_result} and C{set_error} are meant to be used as the
+    C{reply_handler} and C{error_handler} of a D-Bus method call.
+    """
+
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.error = None
+        self.__callbacks = []
+
+    def set_result(self, *args):
+        if self.done:
+            return
+        if len(args) == 1:
+            self.result = args[0]
+        elif len(args) > 1:
+            self.result = args
+        self.__finish()
+
+    def set_error(self, error):
+        if self.done:
+            return
+        self.error = error
+        self.__finish()
+
+    def __finish(self):
+        self.done = True
+        callbacks = self.__callbacks
+        self.__callbacks = []
+        for func in callbacks:
+            func(self)
+
+    def add_callback(self, func):
+        """Calls C{func} with this object when the call finishes."""
+        if self.done:
+            func(self)
+        else:
+            self.__callbacks.append(func)
+
+    def wait(self, timeout=None):
+        """Waits for the call to finish.
+
+        @param timeout: The maximum time to wait, in seconds, or C{None}.
+        @return: The result of the call.
+        @raise Timeout: If the call did not finish in time.
+        @raise Exception: The error of the call, if it failed.
+        """
+        if not self.done:
+            expired = []
+            source = None
+            if timeout is not None:
+                def on_timeout():
+                    expired.append(True)
+                    return False
+                source = gobject.timeout_add(int(timeout * 1000), on_timeout)
+
+            while not self.done and not expired:
+                iterate(True)
+
+            if source is not None and not expired:
+                gobject.source_remove(source)
+            if not self.done:
+                raise Timeout("the call did not finish in %s seconds" % timeout)
+
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+def call(method, *args, **kwargs):
+    """Calls a D-Bus method asynchronously.
+
+    @param method: The method of a proxy or interface, ie. C{obj.GetStatus}.
+    @return: A L{Pending} object.
+    """
+    pending = Pending()
+    kwargs['reply_handler'] = pending.set_result
+    kwargs['error_handler'] = pending.set_error
+    try:
+        method(*args, **kwargs)
+    except Exception, e:
+        pending.set_error(e)
+    return pending
+
+def gather(pendings):
+    """Combines several L{Pending} objects.
+
+    @param pendings: A sequence of L{Pending} objects.
+    @return: A L{Pending} object with the list of results, in the same
+    order, or the first error.
+    """
+    pendings = list(pendings)
+    combined = Pending()
+    remaining = [len(pendings)]
+
+    def on_done(pending):
+        if pending.error is not None:
+            combined.set_error(pending.error)
+            return
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            combined.set_result([p.result for p in pendings])
+
+    if not pendings:
+        combined.set_result([])
+    for pending in pendings:
+        pending.add_callback(on_done)
+    return combined
+
+def windowed(items, start, finish, window=32, ordered=True):
+    """Runs an asynchronous call per item, with a bounded number of calls
+    in flight.
+
+    The replies are collected by iterating the main loop. The results
+    waiting for the result of an earlier item count against the window.
+
+    @param items: An iterable of items.
+    @param start: Called with each item, returns the L{Pending} object of
+    its call or, without a call, the result itself.
+    @param finish: Called with an item and its finished L{Pending} object,
+    returns the result. The exception it raises is the result.
+    @param window: The maximum number of calls in flight.
+    @param ordered: C{True} to yield the results in the order of the items
+    or C{False} to yield them as soon as they arrive.
+    @return: A generator of C{(item, result)} tuples.
+    """
+    items = iter(items)
+    exhausted = False
+    in_flight = {}
+    finished = collections.deque()
+    results = {}
+    index = 0
+    next_index = 0
+
+    def on_finished(item_index):
+        def callback(pending):
+            finished.append(item_index)
+        return callback
+
+    while True:
+        while not exhausted and len(in_flight) + len(results) < window:
+            try:
+                item = items.next()
+            except StopIteration:
+                exhausted = True
+                break
+
+            outcome = start(item)
+            if isinstance(outcome, Pending):
+                in_flight[index] = (item, outcome)
+                outcome.add_callback(on_finished(index))
+            else:
+                results[index] = (item, outcome)
+            index += 1
+
+        while finished:
+            done = finished.popleft()
+            if not in_flight.has_key(done):
+                continue
+            (item, pending) = in_flight.pop(done)
+            try:
+                results[done] = (item, finish(item, pending))
+            except Exception, e:
+                results[done] = (item, e)
+
+        if ordered:
+            while results.has_key(next_index):
+                yield results.pop(next_index)
+                next_index += 1
+        else:
+            for done in sorted(results.keys()):
+                yield results.pop(done)
+
+        if exhausted and not in_flight and not results:
+            break
+        if in_flight and not finished:
+            iterate(True)
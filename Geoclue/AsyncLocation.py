@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+
+import geoclue
+import Async
+import Metrics
+from Base import DiscoverLocation
+
+class SignalQueue:
+    """Queues the emissions of a D-Bus signal.
+
+    The queue is an iterator, every item is the tuple of the signal's
+    arguments. Waiting for an item iterates the main loop.
+    """
+
+    def __init__(self, maxsize=None):
+        """Construct a L{SignalQueue} object.
+
+        @param maxsize: The maximum number of queued emissions, the oldest
+        ones are dropped when the queue is full. C{None} for no limit.
+        """
+        self.match = None
+        self.dropped = 0
+        self.__maxsize = maxsize
+        self.__items = collections.deque()
+        self.__waiter = None
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __call__(self, *args):
+        if self.__maxsize is not None and len(self.__items) >= self.__maxsize:
+            self.__items.popleft()
+            self.dropped += 1
+        self.__items.append(args)
+        if self.__waiter is not None:
+            self.__waiter.set_result()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.get()
+
+    def get(self, timeout=None):
+        """Returns the oldest emission, waiting for one if needed.
+
+        @param timeout: The maximum time to wait, in seconds, or C{None}.
+        @raise Async.Timeout: If nothing was emitted in time.
+        """
+        if not self.__items:
+            self.__waiter = Async.Pending()
+            try:
+                self.__waiter.wait(timeout)
+            finally:
+                self.__waiter = None
+        return self.__items.popleft()
+
+    def close(self):
+        """Stops listening to the signal."""
+        if self.match is not None:
+            self.match.remove()
+            self.match = None
+
+class AsyncDiscoverLocation(DiscoverLocation):
+    """Non blocking version of L{DiscoverLocation}.
+
+    The D-Bus calls are made asynchronously and every method returns a
+    L{Async.Pending} object, so a slow provider never stalls the main
+    loop. Address and position changes can be consumed as iterators with
+    L{address_changes} and L{position_changes}.
+    """
+
+    def init(self, accuracy=geoclue.ACCURACY_LEVEL_COUNTRY, resource=geoclue.RESOURCE_NETWORK,
+             timeout=None):
+        """Initializes Geoclue.
+
+        @param accuracy: The desired accuracy.
+        @param resource: The resource to be used.
+        @param timeout: The maximum time to wait for the first fix, in
+        seconds, or C{None}.
+        @return: A L{Async.Pending} object, its result is C{True} once the
+        client is set up and the first usable address or position arrived.
+        @see: L{DiscoverLocation.init_async}
+        """
+        return self.init_async(accuracy, resource, timeout)
+
+    def get_address(self):
+        """Reads the current address.
+
+        The location info dictionary is updated when the reply arrives.
+
+        @return: A L{Async.Pending} object with the C{(timestamp, address,
+        accuracy)} tuple.
+        """
+        pending = Metrics.get_metrics().track("GetAddress", "master",
+                                              Async.call(self.address.GetAddress))
+        def on_reply(pending):
+            if pending.error is None:
+                self.on_address_changed(*pending.result)
+        pending.add_callback(on_reply)
+        return pending
+
+    def get_position(self):
+        """Reads the current position.
+
+        The location info dictionary is updated when the reply arrives.
+
+        @return: A L{Async.Pending} object with the C{(fields, timestamp,
+        latitude, longitude, altitude, accuracy)} tuple.
+        """
+        pending = Metrics.get_metrics().track("GetPosition", "master",
+                                              Async.call(self.position.GetPosition))
+        def on_reply(pending):
+            if pending.error is None:
+                self.on_master_position_changed(*pending.result)
+        pending.add_callback(on_reply)
+        return pending
+
+    def get_status(self, provider):
+        """Checks a provider's status.
+
+        @param provider: A provider instance.
+        @return: A L{Async.Pending} object, its result is the status name.
+        """
+        result = Async.Pending()
+        try:
+            obj = provider.get_interface(geoclue.GEOCLUE_IFACE, introspect=False)
+        except Exception, e:
+            result.set_error(e)
+            return result
+
+        def on_reply(pending):
+            if pending.error is not None:
+                result.set_error(pending.error)
+            else:
+                result.set_result(geoclue.STATUS_NAMES.get(pending.result, "error"))
+        Metrics.get_metrics().track("GetStatus", provider.name,
+                                    Async.call(obj.GetStatus)).add_callback(on_reply)
+        return result
+
+    def address_changes(self, maxsize=None):
+        """Returns an iterator over the C{AddressChanged} emissions.
+
+        @param maxsize: The maximum number of queued emissions.
+        @return: A L{SignalQueue} of C{(timestamp, address, accuracy)} tuples.
+        """
+        queue = SignalQueue(maxsize)
+        queue.match = self.address.connect_to_signal("AddressChanged", queue)
+        return queue
+
+    def position_changes(self, maxsize=None):
+        """Returns an iterator over the C{PositionChanged} emissions.
+
+        @param maxsize: The maximum number of queued emissions.
+        @return: A L{SignalQueue} of C{(fields, timestamp, latitude,
+        longitude, altitude, accuracy)} tuples.
+        """
+        queue = SignalQueue(maxsize)
+        queue.match = self.position.connect_to_signal("PositionChanged", queue)
+        return queue
@@ -14,17 +14,44 @@
 # You should have received a copy of the GNU General Public License along with
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import os
 import math
+import time
+
+import gobject
 
 import dbus
 from dbus.mainloop.glib import DBusGMainLoop
 
 import geoclue
+import Async
+import Catalog
+import Health
+import Metrics
+import Multiplex
+import Registry
 from Signal import Signal
+from Location import LocationFix, FixHistory
 
 DBusGMainLoop(set_as_default=True)
 
+_metrics = Metrics.get_metrics()
+
+# the provider used for reverse geocoding
+REVERSE_PROVIDER = "Geonames Provider"
+
+class InitError(Exception):
+    """Raised when L{DiscoverLocation.init_async} fails.
+    
+    @ivar phase: The phase that failed: "bus", "master", "create", "start",
+    "fix" or "timeout".
+    @ivar error: The underlying exception, if any.
+    """
+    
+    def __init__(self, phase, error=None):
+        Exception.__init__(self, "%s failed: %s" % (phase, error))
+        self.phase = phase
+        self.error = error
+
 class DiscoverLocation:
     """ Discovers the location form the best available provider
 
@@ -32,41 +59,95 @@ class DiscoverLocation:
     for Geoclue.
     """
     
-    def __init__(self, providers_path="/usr/share/geoclue-providers"):
+    def __init__(self, providers_path=Registry.DEFAULT_PROVIDERS_PATH):
         """Construct a L{DiscoverLocation} object.
         
         @param providers_path: The path to the providers. The default
         path to the providers is /usr/share/geoclue-providers.
         """
-        self.bus = dbus.SessionBus()
+        # the session bus is only opened when it is needed, see L{init}
+        self.bus = None
+        
+        # the Master client and its interfaces, see L{init} and L{init_shared}
+        self.client = None
+        self.address = None
+        self.position = None
+        
+        # the handle of the shared Master client, see L{init_shared}
+        self.handle = None
         
         self.signal = Signal()
         
+        # emitted with the arguments of every position update
+        self.position_signal = Signal()
+        
         # stores the location info
         self.location_info = {}
         
+        # the last position fix and, if recording, every previous one
+        self.fix = None
+        self.history = None
+        
+        # optional recorder of the incoming signals, see L{record_signals}
+        self.recorder = None
+        
+        # optional multi-provider fusion, see L{enable_fusion}
+        self.fusion = None
+        self.fusion_connection = None
+        
+        # the last position of the Master client, kept while fusing
+        self.master_position = None
+        
+        # filters applied to the position updates, see L{Filter}
+        self.filters = []
+        
+        # optional cache for the reverse geocoded addresses
+        self.reverse_cache = None
+        
+        # optional offline reverse geocoder, see L{set_gazetteer}
+        self.gazetteer = None
+        self.offline_first = False
+        
+        # the positions of the geocoded addresses, the geocode_cache is
+        # created on first use, see L{__getattr__}
+        
+        # optional provider health monitor, see L{start_health_monitor}
+        self.health = None
+        
         # Insipered by Pierre-Luc Beaudoin - geoclue_properties.py
         # TODO: add an exception to this part of the code in case of the wrong 
         # or nonexisting dir
+        # The .provider files are parsed once per process, see L{Registry},
+        # and only when the catalog or the providers are first used
+        self.registry = Registry.get_registry(providers_path)
+    
+    def __getattr__(self, name):
+        # the attributes that are only set up on first use, the modules of
+        # the optional features are not even imported before
+        if name in ('catalog', 'providers'):
+            self.refresh_providers()
+            return self.__dict__[name]
+        if name == 'geocode_cache':
+            import Cache
+            self.geocode_cache = Cache.LRUCache(4096)
+            return self.geocode_cache
+        raise AttributeError(name)
+    
+    def refresh_providers(self):
+        """Updates the providers list with the changes in the providers path."""
+        self.catalog = self.registry.get_catalog()
         self.providers = []
         
-        dir = os.listdir(providers_path)
-        
-        for filename in dir:
-            (name, ext) = os.path.splitext(filename)
-
-            if ext == ".provider":
-                complete = os.path.join(providers_path, filename)
-                provider = geoclue.GeoclueProvider (complete)
-                self.providers.append([provider,
-                  provider.name,
-                  provider.interfaces & geoclue.INTERFACE_ADDRESS,
-                  provider.interfaces & geoclue.INTERFACE_POSITION,
-                  provider.interfaces & geoclue.INTERFACE_GEOCODE,
-                  provider.interfaces & geoclue.INTERFACE_REVERSE_GEOCODE,
-                  provider.service,
-                  provider.path
-                  ])
+        for provider in self.catalog.providers:
+            self.providers.append([provider,
+              provider.name,
+              provider.interfaces & geoclue.INTERFACE_ADDRESS,
+              provider.interfaces & geoclue.INTERFACE_POSITION,
+              provider.interfaces & geoclue.INTERFACE_GEOCODE,
+              provider.interfaces & geoclue.INTERFACE_REVERSE_GEOCODE,
+              provider.service,
+              provider.path
+              ])
     
     def init(self, accuracy=geoclue.ACCURACY_LEVEL_COUNTRY, resource=geoclue.RESOURCE_NETWORK):
         """Initializes Geoclue.
@@ -78,6 +159,8 @@ class DiscoverLocation:
         self.resource = resource
         
         try:
+            if self.bus is None:
+                self.bus = geoclue.get_pool().get_bus()
             self.master = self.bus.get_object(geoclue.MASTER_IFACE, geoclue.MASTER_PATH)
             self.client = self.bus.get_object(geoclue.MASTER_IFACE, self.master.Create())
             
@@ -90,58 +173,267 @@ class DiscoverLocation:
             self.client.AddressStart()
             
             self.position = dbus.Interface(self.client, dbus_interface=geoclue.POSITION_IFACE)
-            self.position.connect_to_signal("PositionChanged", self.on_position_changed)
+            self.position.connect_to_signal("PositionChanged", self.on_master_position_changed)
             self.client.PositionStart()
             
             self.client.SetRequirements(self.accuracy, 0, True, self.resource)
         
             try:
-                self.on_address_changed(*self.address.GetAddress())
+                self.on_address_changed(*_metrics.call("GetAddress", "master", self.address.GetAddress))
             except Exception, e:
                 return False
                 
             try:
-                self.on_position_changed(*self.position.GetPosition())
+                self.on_master_position_changed(*_metrics.call("GetPosition", "master", self.position.GetPosition))
             except Exception, e:
                 return False
             
             return True
         except Exception, e:
-            print "Error: %s" % e
+            _metrics.count_error("Init", "master")
             return False
        
+    def init_async(self, accuracy=geoclue.ACCURACY_LEVEL_COUNTRY,
+                   resource=geoclue.RESOURCE_NETWORK, timeout=None):
+        """Initializes Geoclue without blocking.
+        
+        The client is created asynchronously and then the start, requirements
+        and first address and position calls are all sent at once. The init
+        finishes as soon as the first usable address or position arrives,
+        the other one updates the location info when it arrives.
+        
+        The time of each phase, in seconds since the start of the init, is
+        kept in the C{init_timings} dictionary: 'bus_connect',
+        'client_create', 'first_address', 'first_position' and 'first_fix'.
+        
+        @param accuracy: The desired accuracy.
+        @param resource: The resource to be used.
+        @param timeout: The maximum time to wait for the first fix, in
+        seconds, or C{None}.
+        @return: A L{Async.Pending} object, its result is C{True} or its
+        error an L{InitError}.
+        """
+        self.accuracy = accuracy
+        self.resource = resource
+        self.init_timings = {}
+        timings = self.init_timings
+        result = Async.Pending()
+        started = time.time()
+        state = {'failed': 0, 'timer': None}
+        
+        def finish(error=None):
+            if result.done:
+                return
+            if state['timer'] is not None:
+                gobject.source_remove(state['timer'])
+                state['timer'] = None
+            if error is None:
+                timings['first_fix'] = time.time() - started
+                result.set_result(True)
+            else:
+                result.set_error(error)
+        
+        try:
+            if self.bus is None:
+                self.bus = geoclue.get_pool().get_bus()
+        except Exception, e:
+            finish(InitError("bus", e))
+            return result
+        timings['bus_connect'] = time.time() - started
+        
+        try:
+            self.master = self.bus.get_object(geoclue.MASTER_IFACE, geoclue.MASTER_PATH)
+        except Exception, e:
+            finish(InitError("master", e))
+            return result
+        
+        if timeout is not None:
+            def on_timeout():
+                state['timer'] = None
+                finish(InitError("timeout", Async.Timeout("no fix in %s seconds" % timeout)))
+                return False
+            state['timer'] = gobject.timeout_add(int(timeout * 1000), on_timeout)
+        
+        def on_fix_reply(name, handler, usable):
+            def callback(pending):
+                if pending.error is None:
+                    handler(*pending.result)
+                    timings.setdefault(name, time.time() - started)
+                    if usable(pending.result):
+                        finish()
+                        return
+                # both reads done and none of them usable
+                state['failed'] += 1
+                if state['failed'] == 2:
+                    finish(InitError("fix", pending.error))
+            return callback
+        
+        def usable_address(reply):
+            return len(reply[1]) > 0
+        
+        def usable_position(reply):
+            return LocationFix(*reply).has_position()
+        
+        def on_start_reply(pending):
+            if pending.error is not None:
+                finish(InitError("start", pending.error))
+        
+        def on_created(pending):
+            if pending.error is not None:
+                finish(InitError("create", pending.error))
+                return
+            timings['client_create'] = time.time() - started
+            
+            try:
+                # the calls below take no arguments or only plain integers and
+                # booleans, so the client does not need to be introspected
+                self.client = self.bus.get_object(geoclue.MASTER_IFACE, pending.result,
+                                                  introspect=False)
+                self.client.connect_to_signal("AddressProviderChanged", self.on_address_provider_changed)
+                self.client.connect_to_signal("PositionProviderChanged", self.on_position_provider_changed)
+                self.address = dbus.Interface(self.client, dbus_interface=geoclue.ADDRESS_IFACE)
+                self.address.connect_to_signal("AddressChanged", self.on_address_changed)
+                self.position = dbus.Interface(self.client, dbus_interface=geoclue.POSITION_IFACE)
+                self.position.connect_to_signal("PositionChanged", self.on_master_position_changed)
+            except Exception, e:
+                finish(InitError("create", e))
+                return
+            
+            # the messages are delivered in order, the reads are only handled
+            # after the client was started
+            Async.gather([
+                Async.call(self.client.AddressStart, dbus_interface=geoclue.MASTER_CLIENT_IFACE),
+                Async.call(self.client.PositionStart, dbus_interface=geoclue.MASTER_CLIENT_IFACE),
+                Async.call(self.client.SetRequirements, self.accuracy, 0, True, self.resource,
+                           dbus_interface=geoclue.MASTER_CLIENT_IFACE),
+            ]).add_callback(on_start_reply)
+            _metrics.track("GetAddress", "master", Async.call(self.address.GetAddress)).add_callback(
+                on_fix_reply('first_address', self.on_address_changed, usable_address))
+            _metrics.track("GetPosition", "master", Async.call(self.position.GetPosition)).add_callback(
+                on_fix_reply('first_position', self.on_master_position_changed, usable_position))
+        
+        Async.call(self.master.Create, dbus_interface=geoclue.MASTER_IFACE).add_callback(on_created)
+        return result
+    
+    def init_shared(self, accuracy=geoclue.ACCURACY_LEVEL_COUNTRY,
+                    resource=geoclue.RESOURCE_NETWORK, multiplexer=None):
+        """Initializes Geoclue with a shared Master client.
+        
+        Unlike L{init} no client of its own is created, the client with the
+        same accuracy and resource is shared by every L{DiscoverLocation} of
+        the process, see L{Multiplex}. Call L{release_shared} when done.
+        
+        The client and its interfaces are set once the shared client is
+        ready, L{set_requirements} moves to the shared client of the new
+        requirements.
+        
+        @param accuracy: The desired accuracy.
+        @param resource: The resource to be used.
+        @param multiplexer: The L{Multiplex.ClientMultiplexer}, by default
+        the process wide one.
+        @return: A L{Async.Pending} object, finished when the shared client
+        has its address and position.
+        """
+        if multiplexer is None:
+            multiplexer = Multiplex.get_multiplexer()
+        return self.__share(multiplexer, accuracy, 0, True, resource)
+    
+    def __share(self, multiplexer, accuracy, time, require_updates, resource):
+        # acquired before the release, a client of the same requirements is
+        # kept instead of being dropped and created again
+        handle = multiplexer.acquire(accuracy, resource, time, require_updates)
+        self.release_shared()
+        self.handle = handle
+        self.accuracy = accuracy
+        self.resource = resource
+        
+        handle.address_signal.connect(self.on_address_changed)
+        handle.position_signal.connect(self.on_master_position_changed)
+        
+        # the client is used even when its first reads failed, its
+        # signals may still come
+        def on_ready(pending):
+            if self.handle is not handle or handle.shared.client is None:
+                return
+            self.client = handle.shared.client
+            self.address = dbus.Interface(self.client, dbus_interface=geoclue.ADDRESS_IFACE)
+            self.position = dbus.Interface(self.client, dbus_interface=geoclue.POSITION_IFACE)
+        
+        ready = handle.get_ready()
+        if ready.done:
+            # the client was already running, start from its last values
+            if handle.get_address() is not None:
+                self.on_address_changed(*handle.get_address())
+            if handle.get_position() is not None:
+                self.on_master_position_changed(*handle.get_position())
+        ready.add_callback(on_ready)
+        return ready
+    
+    def release_shared(self):
+        """Stops using the shared Master client of L{init_shared}."""
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+            self.client = None
+            self.address = None
+            self.position = None
+    
+    def __get_client(self):
+        if self.client is None:
+            raise RuntimeError("there is no Master client, see init and init_shared")
+        return self.client
+    
+    def get_init_timings(self):
+        """Returns the phase timings of the last L{init_async}.
+        
+        @return: A dictionary of phase names and seconds since the start.
+        """
+        return dict(getattr(self, 'init_timings', {}))
+    
     def provider_status(self, provider):
         """Checks a provider's status.
         
         @param provider: A provider instance.
         @return: The status.
         """
-        obj = dbus.Interface(provider.get_proxy(), dbus_interface=geoclue.GEOCLUE_IFACE)
-        status = obj.GetStatus()
-        
-        if status == geoclue.STATUS_ERROR:
-            return "error"
-        elif status == geoclue.STATUS_UNAVAILABLE:
-            return "unavailable"
-        elif status == geoclue.STATUS_ACQUIRING:
-            return "acquiring"
-        elif status == geoclue.STATUS_AVAILABLE:
-            return "available"
-        else:
-            return "error"
+        obj = provider.get_interface(geoclue.GEOCLUE_IFACE, introspect=False)
+        status = _metrics.call("GetStatus", provider.name, obj.GetStatus)
+        
+        return geoclue.STATUS_NAMES.get(status, "error")
     
     def provider_info(self, provider):
         """Returns the provider's Info.
         
         @return: A dictionary with the provider's name and descripiton.
         """
-        obj = dbus.Interface(provider.get_proxy(), dbus_interface=geoclue.GEOCLUE_IFACE)
-        info = obj.GetProviderInfo()
+        obj = provider.get_interface(geoclue.GEOCLUE_IFACE, introspect=False)
+        info = _metrics.call("GetProviderInfo", provider.name, obj.GetProviderInfo)
         tmp = {}
         tmp['name'] = str(info[0])
         tmp['description'] = str(info[1])
         return tmp
 
+    def start_health_monitor(self, interval=30):
+        """Starts polling the status of every provider in the background.
+        
+        While the monitor runs L{get_available_providers} reports the
+        cached health of each provider, without any D-Bus call.
+        
+        @param interval: The time between polls, in seconds.
+        @return: The L{Health.ProviderHealthMonitor} instance.
+        """
+        if self.health is not None:
+            self.health.stop()
+        self.health = Health.ProviderHealthMonitor(self.catalog.providers, interval)
+        self.health.start()
+        return self.health
+    
+    def stop_health_monitor(self):
+        """Stops the provider health monitor."""
+        if self.health is not None:
+            self.health.stop()
+            self.health = None
+    
     def set_requirements(self, accuracy, time, require_updates, resource):
         """Set the client requirements.
         
@@ -150,10 +442,18 @@ class DiscoverLocation:
         @param require_updates: C{True} if updates are required or C{False} if updates 
         are not required.
         @param resource: The resources that are allowed to be used.
+        
+        With a shared client, see L{init_shared}, the client of the new
+        requirements is used instead.
         """
+        if self.handle is not None:
+            # the shared client has the requirements of every user
+            self.__share(self.handle.shared.multiplexer, accuracy, time,
+                         require_updates, resource)
+            return
         self.accuracy = accuracy
         self.resource = resource
-        self.client.SetRequirements(accuracy, time, require_updates, resource)
+        self.__get_client().SetRequirements(accuracy, time, require_updates, resource)
             
     # provider changed methods, not really being used but it's useful to have 
     # them here just in case
@@ -176,7 +476,7 @@ class DiscoverLocation:
         # TODO: postalcode ?
         
         if address.has_key('area'):
-            self.locatio_info['area'] = address['area']
+            self.location_info['area'] = address['area']
 
         if address.has_key('locality'):
             self.location_info['locality'] = address['locality']
@@ -197,9 +497,14 @@ class DiscoverLocation:
         @param address: The new address.
         @accuracy: The accuracy.
         """
+        start = _metrics.enabled and time.time()
+        if self.recorder is not None:
+            self.recorder.record("AddressChanged", (timestamp, address, accuracy))
         self.location_info['address_timestamp'] = timestamp
         self.update_location_address(address)
         self.signal()
+        if start:
+            _metrics.observe_handler("AddressChanged", time.time() - start)
         
     def on_position_changed(self, fields, timestamp, latitude, longitude, altitude, accuracy):
         """When the position changes the location info dictionary is updated.
@@ -212,12 +517,57 @@ class DiscoverLocation:
         @param accuracy: The accuracy.
         """
         #print accuracy # I used this print to check the accuracy format
-        self.location_info['position_timestamp'] = timestamp
-        self.location_info['latitude'] = latitude
-        self.location_info['longitude'] = longitude
-        self.location_info['altitude'] = altitude
+        start = _metrics.enabled and time.time()
+        fix = LocationFix(fields, timestamp, latitude, longitude, altitude, accuracy)
+        for position_filter in self.filters:
+            fix = position_filter.process(fix)
+            if fix is None:
+                return
+        
+        self.fix = fix
+        self.location_info['position_timestamp'] = fix.timestamp
+        self.location_info['latitude'] = fix.latitude
+        self.location_info['longitude'] = fix.longitude
+        self.location_info['altitude'] = fix.altitude
+        if self.history is not None:
+            self.history.append(fix)
         self.signal()
+        self.position_signal(*fix)
+        if start:
+            _metrics.observe_handler("PositionChanged", time.time() - start)
 
+    def on_master_position_changed(self, fields, timestamp, latitude, longitude, altitude, accuracy):
+        """Handles the positions of the Master client.
+        
+        They are recorded, if recording, and passed to
+        L{on_position_changed}, except while fusing, then only the fused
+        positions are, see L{enable_fusion}.
+        """
+        if self.recorder is not None:
+            self.recorder.record("PositionChanged",
+                                 (fields, timestamp, latitude, longitude, altitude, accuracy))
+        self.master_position = (fields, timestamp, latitude, longitude, altitude, accuracy)
+        if self.fusion is None:
+            self.on_position_changed(*self.master_position)
+    
+    def add_position_filter(self, position_filter):
+        """Adds a filter to the position updates.
+        
+        The filters run in the order they were added, before the location
+        info is updated and the signals are emitted.
+        
+        @param position_filter: A L{Filter.PositionFilter} instance.
+        """
+        self.filters.append(position_filter)
+    
+    def remove_position_filter(self, position_filter):
+        """Removes a filter from the position updates.
+        
+        @param position_filter: A L{Filter.PositionFilter} instance.
+        """
+        if position_filter in self.filters:
+            self.filters.remove(position_filter)
+    
     # returns the current values for location and position
     def get_location_info(self):
         """Returns the location info dictionary.
@@ -226,44 +576,72 @@ class DiscoverLocation:
         """
         return self.location_info
     
+    def get_location_fix(self):
+        """Returns the last position fix.
+        
+        Unlike the location info dictionary the fix is immutable, so it can
+        be kept without copying it.
+        
+        @return: A L{Location.LocationFix} or C{None} before the first fix.
+        """
+        return self.fix
+    
+    def record_history(self, history=None):
+        """Starts keeping every position fix.
+        
+        @param history: The history to append the fixes to, by default a
+        new L{Location.FixHistory}. A L{History.HistoryRecorder} keeps
+        them on disk.
+        @return: The history.
+        """
+        if history is None:
+            history = FixHistory()
+        self.history = history
+        return history
+    
+    def stop_history(self):
+        """Stops keeping the position fixes."""
+        self.history = None
+    
+    def record_signals(self, recorder):
+        """Starts recording the incoming address and position signals.
+        
+        The signals are recorded as received, before the fusion and the
+        position filters, with the positions of every provider while
+        fusing and the start and end of the fusion, so a
+        L{Replay.Replayer} can feed them back to the handlers.
+        
+        @param recorder: A L{Replay.SignalRecorder} instance.
+        """
+        self.recorder = recorder
+        if self.fusion is not None:
+            self.fusion.recorder = recorder
+            recorder.record("EnableFusion", (self.fusion.max_age,))
+    
+    def stop_recording(self):
+        """Stops recording the signals, the recorder is not closed."""
+        self.recorder = None
+        if self.fusion is not None:
+            self.fusion.recorder = None
+    
     def get_available_providers(self):
         """Returns the available providers.
          
-        @return: A list of dictionarys,
+        @return: A tuple of read only dictionarys,
         [PROVIDER, ADDRESS, POSITION, GEOCODING, REVERSE GEOCODING],
-        with the name and True of False for supporting each of them
+        with the name and True of False for supporting each of them.
+        When the health monitor runs, 'health' has the provider's last
+        known status and polling latencies.
         """ 
-        current_providers = []
-        for provider in self.providers:
-            tmp = {}
-            tmp['name'] = provider[1]
-            if provider[2] != 0:
-                tmp['address'] = True
-            else:
-                tmp['address'] = False
-                
-            if provider[3] != 0:
-                tmp['position'] = True
-            else:
-                tmp['position'] = False
-                
-            if provider[4] != 0:
-                tmp['geocoding'] = True
-            else:
-                tmp['geocoding'] = False
-                
-            if provider[5] != 0:
-                tmp['revgeocoding'] = True
-            else:
-                tmp['revgeocoding'] = False
-            
-            tmp['object'] = provider[0]
-            tmp['service'] = provider[6]
-            tmp['path'] = provider[7]
-                
-            current_providers.append(tmp)    
+        if self.health is None:
+            return self.catalog.get_info()
         
-        return current_providers
+        current_providers = []
+        for info in self.catalog.get_info():
+            tmp = dict(info)
+            tmp['health'] = self.health.get_health(info['name'])
+            current_providers.append(Catalog.ProviderInfo(tmp))
+        return tuple(current_providers)
     
     def set_position_provider(self, provider_name):
         """Set the position provider to a given C{provider_name} (if exists).
@@ -272,27 +650,21 @@ class DiscoverLocation:
         @return: C{True} if the provider exists or C{False} if a provider
         does not exist.
         """
-        provider_exists = False
-        for provider in self.providers:
-            if provider[1].lower() == provider_name.lower() and provider[3] != 0:
-                current_provider = provider
-                provider_exists = True
-                break
-        
-        if not provider_exists:
+        current_provider = self.catalog.find(provider_name, geoclue.INTERFACE_POSITION)
+        if current_provider is None:
             return False
         
         try:
-            tmp_provider = current_provider[0].get_proxy()
-            self.position = dbus.Interface(tmp_provider, dbus_interface=geoclue.POSITION_IFACE)
+            self.position = current_provider.get_interface(geoclue.POSITION_IFACE)
         except Exception, e:
-            print "D-Bus error: %s" % e
+            _metrics.count_error("Proxy", current_provider.name)
             return False
             
         try:
-            self.on_position_changed(*self.position.GetPosition())
+            self.on_master_position_changed(*_metrics.call("GetPosition", current_provider.name, self.position.GetPosition))
         except Exception, e:
-            print e
+            # counted by the metrics, the position comes with the next update
+            pass
             
         return True
     
@@ -346,49 +718,88 @@ class DiscoverLocation:
         @returns:  C{True} if the provider exists or C{False} if a provider
         does not exist.
         """
-        provider_exists = False
-        for provider in self.providers:
-            if provider[1].lower() == provider_name.lower() and provider[2] != 0:
-                current_provider = provider
-                provider_exists = True
-                break
-            
-        if not provider_exists:
+        current_provider = self.catalog.find(provider_name, geoclue.INTERFACE_ADDRESS)
+        if current_provider is None:
             return False
         
         try:
             if (provider_name.lower() == "manual" or provider_name.lower() == "localnet") and address != None:
-                tmp_provider = current_provider[0].get_proxy()
+                tmp_provider = current_provider.get_proxy()
                 tmp_provider.SetAddress(0, self.validate_address(address))
-                self.address = dbus.Interface(tmp_provider, dbus_interface=geoclue.ADDRESS_IFACE)
+                self.address = current_provider.get_interface(geoclue.ADDRESS_IFACE)
             elif (provider_name.lower() == "manual" or provider_name.lower() == "localnet") and address == None:
                 return False
             else:
-                self.address = dbus.Interface(current_provider[0].get_proxy(), dbus_interface=geoclue.ADDRESS_IFACE)
+                self.address = current_provider.get_interface(geoclue.ADDRESS_IFACE)
         except Exception, e:
-            print "D-Bus error: %s" % e
+            _metrics.count_error("Proxy", current_provider.name)
             return False
             
         try:
-            self.on_address_changed(*self.address.GetAddress())
+            self.on_address_changed(*_metrics.call("GetAddress", current_provider.name, self.address.GetAddress))
         except Exception, e:
-            print e
+            # counted by the metrics, the address comes with the next update
+            pass
             
         return True
     
+    def enable_fusion(self, max_age=120, subscribe=True):
+        """Fuses the positions of every position provider.
+        
+        Instead of the single provider chosen by the Master, every provider
+        with the position interface is followed at the same time and their
+        fixes are fused by accuracy and age into the position updates. The
+        Master client's own positions are ignored until L{disable_fusion}.
+        
+        @param max_age: Fixes older than this, in seconds, are not fused.
+        @param subscribe: C{False} to only fuse the fixes given to the
+        fusion, ie. by a L{Replay.Replayer}, without following the
+        providers.
+        @return: The L{Fusion.PositionFusion} instance.
+        """
+        import Fusion
+        self.disable_fusion()
+        self.fusion = Fusion.PositionFusion(self.catalog.providers, max_age)
+        self.fusion_connection = self.fusion.connect(self.__on_fused_position)
+        if self.recorder is not None:
+            self.fusion.recorder = self.recorder
+            self.recorder.record("EnableFusion", (max_age,))
+        if subscribe:
+            self.fusion.start()
+        return self.fusion
+    
+    def disable_fusion(self):
+        """Stops fusing the positions of every provider.
+        
+        The Master client's positions are followed again, starting from
+        its last one.
+        """
+        if self.fusion is not None:
+            if self.recorder is not None:
+                self.recorder.record("DisableFusion", ())
+            self.fusion.stop()
+            self.fusion.signal.disconnect(self.fusion_connection)
+            self.fusion = None
+            self.fusion_connection = None
+            if self.master_position is not None:
+                self.on_position_changed(*self.master_position)
+    
+    def __on_fused_position(self, fix):
+        self.on_position_changed(*fix)
+    
     def get_position_provider(self):
         """Returns the name of the current position provider.
         
         @return: The name of the current position provider.
         """
-        return self.client.GetPositionProvider()[0]
+        return self.__get_client().GetPositionProvider()[0]
     
     def get_address_provider(self):
         """Returns the name of the current address provider.
         
         @return: The name of the current address provider.
         """
-        return self.client.GetAddressProvider()[0]
+        return self.__get_client().GetAddressProvider()[0]
     
     def compare_position(self, latitude, longitude, proximity_factor=None):
         """Compare the current position to a given position.
@@ -420,45 +831,365 @@ class DiscoverLocation:
         result =  math.fabs(d) < dis_max 
         return result
     
+    def compare_positions(self, latitudes, longitudes, proximity_factor=None,
+                          method=None, executor=None):
+        """Compare the current position to many positions at once.
+        
+        This is the batch version of L{compare_position}, all the distances
+        are computed in one vectorized pass (see L{Distance}).
+        
+        @param latitudes: the latitudes of the positions
+        @param longitudes: the longitudes of the positions
+        @param proximity_factor: the near by proximity factor. ie, 0.5 is 500 meters
+        @param method: the distance formula, haversine or vincenty, C{None}
+        for haversine
+        @param executor: a L{Bulk.BulkExecutor} to split the positions over
+        several processes, or C{None}. Its worker processes are forked, start
+        them with L{Bulk.BulkExecutor.start} before L{init} so they do not
+        inherit the D-Bus connection and the main loop.
+        @return: A C{(distances, mask)} tuple, the distances in km and
+        C{True} for every position that is near by.
+        """
+        import Distance
+        if proximity_factor == None:
+            # 500 meters
+            dis_max = 0.5
+        else:
+            dis_max = proximity_factor
+        if method is None:
+            method = Distance.METHOD_HAVERSINE
+        
+        if executor is not None:
+            return executor.proximity(self.location_info['latitude'],
+                                      self.location_info['longitude'],
+                                      latitudes, longitudes, dis_max, method)
+        return Distance.proximity(self.location_info['latitude'],
+                                  self.location_info['longitude'],
+                                  latitudes, longitudes, dis_max, method)
+    
     def reverse_position(self, latitude, longitude, accuracy):
         """Returns an address that corresponds to a given position.
         
+        Without a reverse geocoding provider, or when its call fails, the
+        gazetteer set with L{set_gazetteer} is used instead.
+        
         @param latitude: The position's latitude.  
         @param longitude: The position's longitude.
         @param accuracy: The accuracy.
         @return: An address.
         """
-        provider_exists = False
-        for provider in self.providers:
-            if provider[1].lower() == "Geonames Provider".lower():
-                current_provider = provider
-                provider_exists = True
-                break
-            
-        if not provider_exists:
+        if self.gazetteer is not None and self.offline_first:
+            address = self.gazetteer.reverse(latitude, longitude)
+            if address is not None:
+                return address
+        
+        if self.reverse_cache is not None:
+            address = self.reverse_cache.get(latitude, longitude, accuracy)
+            if address is not None:
+                return address
+        
+        try:
+            revgeocoder = self.get_reverse_geocoder()
+        except Exception, e:
+            revgeocoder = None
+        if revgeocoder is None:
+            return self.__offline_address(latitude, longitude)
+        
+        try:
+            revaddress = _metrics.call("PositionToAddress", REVERSE_PROVIDER, revgeocoder.PositionToAddress,
+                                       float(latitude), float(longitude), (accuracy, 0, 0))
+            address = self.__revaddress_to_address(revaddress)
+        except Exception, e:
+            return self.__offline_address(latitude, longitude)
+        
+        if self.reverse_cache is not None:
+            self.reverse_cache.put(latitude, longitude, accuracy, address)
+        return address
+    
+    def reverse_positions(self, positions, accuracy=geoclue.ACCURACY_LEVEL_LOCALITY,
+                          window=32, ordered=True):
+        """Reverse geocodes many positions with concurrent D-Bus calls.
+        
+        Up to C{window} C{PositionToAddress} calls are in flight at the same
+        time, the replies are collected by iterating the main loop.
+        
+        @param positions: An iterable of C{(latitude, longitude)} or
+        C{(latitude, longitude, accuracy)} tuples.
+        @param accuracy: The accuracy of the positions without one.
+        @param window: The maximum number of calls in flight.
+        @param ordered: C{True} to yield the results in input order or
+        C{False} to yield them as soon as they arrive.
+        @return: A generator of C{(position, address)} tuples, where address
+        is the address dictionary, the exception raised by the call or by
+        the creation of the provider's proxy, or C{None} if there is no
+        reverse geocoding provider. As in L{reverse_position} the
+        gazetteer, if any, replaces the missing provider and the failed
+        calls.
+        """
+        try:
+            revgeocoder = self.get_reverse_geocoder()
+            proxy_error = None
+        except Exception, e:
+            revgeocoder = None
+            proxy_error = e
+        
+        def split(position):
+            if len(position) > 2:
+                return position[:3]
+            return (position[0], position[1], accuracy)
+        
+        def start(position):
+            (latitude, longitude, position_accuracy) = split(position)
+            address = None
+            if self.gazetteer is not None and self.offline_first:
+                address = self.gazetteer.reverse(latitude, longitude)
+            if address is None and self.reverse_cache is not None:
+                address = self.reverse_cache.get(latitude, longitude, position_accuracy)
+            if address is None and revgeocoder is None:
+                address = self.__offline_address(latitude, longitude) or proxy_error
+            if address is not None or revgeocoder is None:
+                return address
+            return _metrics.track("PositionToAddress", REVERSE_PROVIDER,
+                                  Async.call(revgeocoder.PositionToAddress,
+                                             float(latitude), float(longitude),
+                                             (position_accuracy, 0, 0)))
+        
+        def finish(position, pending):
+            (latitude, longitude, position_accuracy) = split(position)
+            if pending.error is not None:
+                return self.__offline_address(latitude, longitude) or pending.error
+            address = self.__revaddress_to_address(pending.result)
+            if self.reverse_cache is not None:
+                self.reverse_cache.put(latitude, longitude, position_accuracy, address)
+            return address
+        
+        return Async.windowed(positions, start, finish, window, ordered)
+    
+    def get_reverse_geocoder(self):
+        """Returns the reverse geocoding interface of the Geonames provider.
+        
+        Without the Geonames provider the first provider with the reverse
+        geocoding interface is used.
+        
+        @return: A C{dbus.Interface} or C{None} if the provider does not exist.
+        @raise dbus.DBusException: If the provider's proxy can not be created.
+        """
+        current_provider = self.catalog.find(REVERSE_PROVIDER)
+        if current_provider is None:
+            current_provider = self.catalog.first(geoclue.INTERFACE_REVERSE_GEOCODE)
+        if current_provider is None:
             return None
         
         try:
-            revgeocoder = dbus.Interface(current_provider[0].get_proxy(), geoclue.REVERSE_IFACE)
-            revaddress = revgeocoder.PositionToAddress(float(latitude), float(longitude), (accuracy, 0, 0))
-            
-            #add the values to the address of the location variable
-            tmp_address = {}
-            for key, item in revaddress[0].items():
-                tmp_address[unicode(key)] = unicode(item)
-            
-            return self.validate_address(tmp_address)
+            return current_provider.get_interface(geoclue.REVERSE_IFACE)
         except Exception, e:
-            print "D-Bus error: %s" % e
+            _metrics.count_error("Proxy", current_provider.name)
+            raise
+    
+    def __revaddress_to_address(self, revaddress):
+        #add the values to the address of the location variable
+        tmp_address = {}
+        for key, item in revaddress[0].items():
+            tmp_address[unicode(key)] = unicode(item)
+        
+        return self.validate_address(tmp_address)
+    
+    def __geocoder(self):
+        provider = self.catalog.first(geoclue.INTERFACE_GEOCODE)
+        if provider is None:
+            return (None, None)
+        try:
+            return (provider.name, provider.get_interface(geoclue.GEOCODE_IFACE))
+        except Exception, e:
+            _metrics.count_error("Proxy", provider.name)
+            return (None, None)
+    
+    def get_geocoder(self):
+        """Returns the geocoding interface of the first geocoding provider.
+        
+        @return: A C{dbus.Interface} or C{None} if there is no provider.
+        """
+        return self.__geocoder()[1]
+    
+    def __geocode_key(self, address):
+        import Gazetteer
+        address = self.validate_address(address)
+        return u"\0".join([Gazetteer.fold(address[key]) for key in sorted(address.keys())])
+    
+    def __geocode_request(self, address):
+        # the provider only gets the fields that have a value
+        tmp_address = {}
+        for key, item in self.validate_address(address).items():
+            if item:
+                tmp_address[key] = item
+        return tmp_address
+    
+    def __geocode_reply(self, reply):
+        (fields, latitude, longitude, altitude, accuracy) = reply
+        fix = LocationFix(int(fields), int(time.time()), float(latitude),
+                          float(longitude), float(altitude), tuple(accuracy))
+        if not fix.has_position():
+            return None
+        return fix
+    
+    def __requested_level(self, address):
+        # the accuracy level of the most precise field of an address
+        import Gazetteer
+        for (key, level) in (('street', geoclue.ACCURACY_LEVEL_STREET),
+                             ('locality', geoclue.ACCURACY_LEVEL_LOCALITY),
+                             ('region', geoclue.ACCURACY_LEVEL_REGION)):
+            if Gazetteer.fold(address.get(key) or u""):
+                return level
+        return geoclue.ACCURACY_LEVEL_COUNTRY
+    
+    def __local_position(self, address):
+        if self.gazetteer is None:
+            return None
+        found = self.gazetteer.get_name_index().find(address)
+        if found is None:
+            return None
+        (place, level) = found
+        # a coarser match, ie. the country of an unknown locality, is left
+        # to the geocoding provider
+        if level < self.__requested_level(address):
+            return None
+        return LocationFix(geoclue.POSITION_FIELDS_LATITUDE | geoclue.POSITION_FIELDS_LONGITUDE,
+                           int(time.time()), place['latitude'], place['longitude'], 0.0,
+                           (level, 0.0, 0.0))
+    
+    def address_to_position(self, address):
+        """Returns the position of an address.
+        
+        The address is searched in the gazetteer's names first, see
+        L{set_gazetteer}, and then asked to the geocoding provider. A
+        gazetteer match is only used when it is as precise as the address,
+        ie. a locality for an address with a locality but no street. The
+        positions are kept in the C{geocode_cache}.
+        
+        @param address: The address dictionary.
+        @return: A L{Location.LocationFix}, its accuracy level tells how
+        much of the address was matched, or C{None} if the address was not
+        found.
+        """
+        key = self.__geocode_key(address)
+        fix = self.geocode_cache.get(key)
+        if fix is not None:
+            return fix
+        
+        fix = self.__local_position(address)
+        if fix is None:
+            (name, geocoder) = self.__geocoder()
+            if geocoder is None:
+                return None
+            try:
+                fix = self.__geocode_reply(_metrics.call("AddressToPosition", name, geocoder.AddressToPosition,
+                                                         self.__geocode_request(address)))
+            except Exception, e:
+                return None
+        
+        if fix is not None:
+            self.geocode_cache.put(key, fix)
+        return fix
+    
+    def addresses_to_positions(self, addresses, window=32, ordered=True):
+        """Geocodes many addresses with concurrent D-Bus calls.
+        
+        Like L{address_to_position} the cache and the gazetteer are tried
+        first. Up to C{window} C{AddressToPosition} calls are in flight at
+        the same time and equal addresses share a single call.
+        
+        @param addresses: An iterable of address dictionaries.
+        @param window: The maximum number of calls in flight.
+        @param ordered: C{True} to yield the results in input order or
+        C{False} to yield them as soon as they arrive.
+        @return: A generator of C{(address, position)} tuples, where position
+        is a L{Location.LocationFix}, the exception raised by the call or
+        C{None} if the address was not found.
+        """
+        (name, geocoder) = self.__geocoder()
+        # the calls in flight, by address key
+        calls = {}
+        
+        def start(address):
+            key = self.__geocode_key(address)
+            fix = self.geocode_cache.get(key)
+            if fix is None:
+                fix = self.__local_position(address)
+                if fix is not None:
+                    self.geocode_cache.put(key, fix)
+            if fix is not None or geocoder is None:
+                return fix
+            pending = calls.get(key)
+            if pending is None:
+                pending = _metrics.track("AddressToPosition", name,
+                                         Async.call(geocoder.AddressToPosition,
+                                                    self.__geocode_request(address)))
+                calls[key] = pending
+            return pending
+        
+        def finish(address, pending):
+            key = self.__geocode_key(address)
+            if calls.get(key) is pending:
+                del calls[key]
+            if pending.error is not None:
+                return pending.error
+            fix = self.__geocode_reply(pending.result)
+            if fix is not None:
+                self.geocode_cache.put(key, fix)
+            return fix
+        
+        return Async.windowed(addresses, start, finish, window, ordered)
+    
+    def __offline_address(self, latitude, longitude):
+        if self.gazetteer is None:
             return None
+        return self.gazetteer.reverse(latitude, longitude)
+    
+    def set_gazetteer(self, gazetteer, offline_first=False):
+        """Sets the offline reverse geocoder.
+        
+        The gazetteer's names are also the first step of
+        L{address_to_position}.
+        
+        @param gazetteer: A L{Gazetteer.Gazetteer} instance or C{None} to
+        disable offline reverse geocoding.
+        @param offline_first: C{True} to use the gazetteer before the
+        reverse geocoding provider, ie. when the network is slow. By
+        default it is only used without a provider or when its call fails.
+        """
+        self.gazetteer = gazetteer
+        self.offline_first = offline_first
+    
+    def set_reverse_cache(self, cache):
+        """Sets the cache used by L{reverse_position}.
+        
+        @param cache: A L{Cache.ReverseGeocodeCache} instance or C{None} to
+        disable the cache.
+        """
+        self.reverse_cache = cache
+    
+    def position_stream(self, min_interval=0, min_distance=0, maxsize=1,
+                        policy=None):
+        """Returns a rate limited stream of the position updates.
+        
+        @see: L{Stream.PositionStream}, C{None} is its default policy.
+        @return: A L{Stream.PositionStream} attached to this object.
+        """
+        import Stream
+        if policy is None:
+            policy = Stream.POLICY_COALESCE
+        stream = Stream.PositionStream(min_interval, min_distance, maxsize, policy)
+        stream.attach(self)
+        return stream
     
     def connect(self, func):
         """Connects a given function to the signal.
         The signal action if any change to the info location dictionary.
         
         @param func: The function to connect to the signal.
+        @return: The connection id.
         """
-        self.signal.connect(func)
+        return self.signal.connect(func)
     
     def disconnect(self, func):
         """Disconnects a given function from the signal.
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Bulk jobs on a pool of processes.
+
+The points are copied once into shared memory buffers, which the worker
+processes inherit when they are started, so the tasks only carry a range
+of indexes. The distances and masks are written by the workers straight
+into shared output buffers, in place, so the results are in the input
+order without merging.
+
+The chunk size is tuned by timing a small first chunk of the first job of
+each kind in the calling process: the chunks are sized to take about
+L{TARGET_TASK_TIME}, with enough chunks for every worker. The measured rate
+is kept, so the next jobs of the same kind go straight to the pool.
+
+The worker processes are forked. Forking a process connected to D-Bus, or
+running the GLib main loop, gives the children copies of the connection's
+socket and of the loop's state, which they must not use. The workers never
+touch them, but to keep the children clean start the pool with
+L{BulkExecutor.start} before connecting to the bus, ie. before
+L{DiscoverLocation.init}.
+"""
+
+import time
+import array
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import Distance
+import Gazetteer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# the time a task should take, long enough to hide the pool overhead
+TARGET_TASK_TIME = 0.05
+
+# the chunk size bounds
+MIN_CHUNK = 1024
+
+# the maximum number of points timed in the calling process
+PROBE_CHUNK = 256
+
+# the minimum number of chunks per worker, for load balancing
+CHUNKS_PER_WORKER = 4
+
+def _views(buffers, count):
+    # latitudes, longitudes, distances and mask of the first count points
+    (lats, lons, dists, mask) = buffers
+    if numpy is not None:
+        return (numpy.frombuffer(lats, numpy.float64, count),
+                numpy.frombuffer(lons, numpy.float64, count),
+                numpy.frombuffer(dists, numpy.float64, count),
+                numpy.frombuffer(mask, numpy.int8, count))
+    return buffers
+
+def _run_proximity(buffers, start, stop, latitude, longitude, max_distance, method):
+    (lats, lons, dists, mask) = _views(buffers, stop)
+    (result, within) = Distance.proximity(latitude, longitude, lats[start:stop],
+                                          lons[start:stop], max_distance, method)
+    dists[start:stop] = result
+    mask[start:stop] = within
+
+def _run_reverse(buffers, gazetteers, path, start, stop, max_distance):
+    gazetteer = gazetteers.get(path)
+    if gazetteer is None:
+        gazetteer = gazetteers[path] = Gazetteer.Gazetteer(path)
+    (lats, lons, dists, mask) = _views(buffers, stop)
+    return [gazetteer.reverse(lats[i], lons[i], max_distance) for i in xrange(start, stop)]
+
+def _run_geocode(gazetteers, path, addresses):
+    gazetteer = gazetteers.get(path)
+    if gazetteer is None:
+        gazetteer = gazetteers[path] = Gazetteer.Gazetteer(path)
+    names = gazetteer.get_name_index()
+    return [names.find(address) for address in addresses]
+
+# the buffers and gazetteers of a worker process
+_buffers = None
+_gazetteers = {}
+
+def _init_worker(buffers):
+    global _buffers
+    _buffers = buffers
+
+def _proximity_task(args):
+    _run_proximity(_buffers, *args)
+
+def _reverse_task(args):
+    return _run_reverse(_buffers, _gazetteers, *args)
+
+def _geocode_task(args):
+    return _run_geocode(_gazetteers, *args)
+
+def _chunks(start, stop, size):
+    return [(i, min(i + size, stop)) for i in xrange(start, stop, size)]
+
+class BulkExecutor:
+    """Splits the bulk jobs over a pool of processes.
+
+    The pool is started by L{start} or on the first job big enough for it,
+    and kept for the next ones. It is started again, with bigger buffers,
+    when a job has more points than the buffers.
+    """
+
+    def __init__(self, processes=None, chunk_size=None):
+        """Construct a L{BulkExecutor} object.
+
+        @param processes: The number of worker processes, by default the
+        number of CPUs. With 1 the jobs run in the calling process.
+        @param chunk_size: The number of points per task, by default it is
+        tuned for every kind of job.
+        """
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = max(int(processes), 1)
+        self.chunk_size = chunk_size
+        self.capacity = 0
+        self.pool = None
+        self.__buffers = None
+        self.__gazetteers = {}
+        # the measured seconds per point of each kind of job
+        self.__rates = {}
+
+    def __reserve(self, count):
+        # the buffers outlive the pool using them, so they are only replaced
+        # together
+        if count <= self.capacity:
+            return
+        self.__stop_pool()
+        capacity = max(count, 2 * self.capacity)
+        self.__buffers = (RawArray('d', capacity), RawArray('d', capacity),
+                          RawArray('d', capacity), RawArray('b', capacity))
+        self.capacity = capacity
+
+    def __get_pool(self):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.processes, _init_worker, (self.__buffers,))
+        return self.pool
+
+    def __stop_pool(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __load(self, latitudes, longitudes):
+        lats = Distance.as_array(latitudes)
+        lons = Distance.as_array(longitudes)
+        if len(lats) != len(lons):
+            raise ValueError("latitudes and longitudes must have the same length")
+        count = len(lats)
+        self.__reserve(count)
+        (shared_lats, shared_lons, dists, mask) = _views(self.__buffers, count)
+        shared_lats[0:count] = lats
+        shared_lons[0:count] = lons
+        return count
+
+    def start(self, capacity=MIN_CHUNK):
+        """Starts the worker processes now.
+
+        Call it before connecting to the bus, the pool is only started
+        again for a job of more than C{capacity} points.
+
+        @param capacity: The number of points of the shared buffers.
+        """
+        self.__reserve(capacity)
+        self.__get_pool()
+
+    def __plan(self, key, count, probe):
+        """Runs the points that are not worth a task with C{probe(start,
+        stop)} and returns the ranges of the tasks.
+
+        Without a rate for this kind of job yet, the first points are timed
+        to get one, at most L{PROBE_CHUNK} and a fraction of a task per
+        worker, so the calling process does not hold the workers back.
+        """
+        if self.processes == 1 or count <= 2 * MIN_CHUNK:
+            probe(0, count)
+            return []
+        if self.chunk_size is not None:
+            return _chunks(0, count, self.chunk_size)
+        first = 0
+        rate = self.__rates.get(key)
+        if rate is None:
+            first = max(min(PROBE_CHUNK, count // (self.processes * CHUNKS_PER_WORKER)), 1)
+            started = time.time()
+            probe(0, first)
+            rate = self.__rates[key] = (time.time() - started) / first
+        size = int(TARGET_TASK_TIME / max(rate, 1e-9))
+        balanced = -(-(count - first) // (self.processes * CHUNKS_PER_WORKER))
+        size = max(min(size, balanced), MIN_CHUNK)
+        return _chunks(first, count, size)
+
+    def get_rates(self):
+        """Returns the measured seconds per point, keyed by kind of job."""
+        return dict(self.__rates)
+
+    def proximity(self, latitude, longitude, latitudes, longitudes, max_distance,
+                  method=Distance.METHOD_HAVERSINE):
+        """The bulk version of L{Distance.proximity}.
+
+        @return: A C{(distances, mask)} tuple, in the order of the points.
+        """
+        count = self.__load(latitudes, longitudes)
+        args = (latitude, longitude, max_distance, method)
+        def probe(start, stop):
+            _run_proximity(self.__buffers, start, stop, *args)
+        chunks = self.__plan(("proximity", method), count, probe)
+        if chunks:
+            self.__get_pool().map(_proximity_task, [chunk + args for chunk in chunks], 1)
+
+        (lats, lons, dists, mask) = _views(self.__buffers, count)
+        if numpy is not None:
+            return (dists.copy(), mask.astype(bool))
+        return (array.array('d', dists[0:count]), array.array('b', mask[0:count]))
+
+    def reverse(self, path, latitudes, longitudes, max_distance=None):
+        """Reverse geocodes many positions with a L{Gazetteer.Gazetteer}.
+
+        Every worker maps the gazetteer index file, the pages are shared
+        by the processes.
+
+        @param path: The path to the gazetteer index.
+        @return: A list of addresses, or C{None} for the positions without
+        a place close enough, in the order of the positions.
+        """
+        count = self.__load(latitudes, longitudes)
+        results = []
+        def probe(start, stop):
+            results.extend(_run_reverse(self.__buffers, self.__gazetteers, path,
+                                        start, stop, max_distance))
+        chunks = self.__plan(("reverse", path), count, probe)
+        if chunks:
+            tasks = [(path, start, stop, max_distance) for (start, stop) in chunks]
+            for chunk in self.__get_pool().imap(_reverse_task, tasks):
+                results.extend(chunk)
+        return results
+
+    def geocode(self, path, addresses):
+        """Geocodes many addresses with the L{Gazetteer.NameIndex} of a
+        gazetteer.
+
+        The addresses are sent to the workers with the tasks, every worker
+        builds the name index once.
+
+        @param path: The path to the gazetteer index.
+        @param addresses: A list of address dictionaries.
+        @return: A list of the C{(place, accuracy level)} tuples of
+        L{Gazetteer.NameIndex.find}, in the order of the addresses.
+        """
+        addresses = list(addresses)
+        results = []
+        def probe(start, stop):
+            results.extend(_run_geocode(self.__gazetteers, path, addresses[start:stop]))
+        chunks = self.__plan(("geocode", path), len(addresses), probe)
+        if chunks:
+            if self.pool is None:
+                self.__reserve(1)
+            tasks = [(path, addresses[start:stop]) for (start, stop) in chunks]
+            for chunk in self.__get_pool().imap(_geocode_task, tasks):
+                results.extend(chunk)
+        return results
+
+    def close(self):
+        """Stops the worker processes."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        for gazetteer in self.__gazetteers.values():
+            gazetteer.close()
+        self.__gazetteers = {}
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import json
+import sqlite3
+from collections import OrderedDict
+
+# the inserts after which the entries on disk are counted again, the other
+# processes sharing the database insert too
+RECOUNT_INTERVAL = 1024
+
+class LRUCache:
+    """A size and age limited in memory cache.
+
+    The least recently used entry is evicted when the cache is full and
+    entries older than C{ttl} seconds are treated as misses.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None):
+        """Construct a L{LRUCache} object.
+
+        @param max_entries: The maximum number of entries.
+        @param ttl: The time to live of an entry, in seconds, or C{None}
+        for entries that never expire.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return self.__entries.has_key(key)
+
+    def get(self, key, default=None):
+        """Returns the value stored for C{key} or C{default} on a miss."""
+        try:
+            stored, value = self.__entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if self.ttl is not None and time.time() - stored > self.ttl:
+            self.misses += 1
+            return default
+
+        # move it to the most recently used end
+        self.__entries[key] = (stored, value)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, stored=None):
+        """Stores C{value} for C{key}.
+
+        @param stored: The time the value was obtained, defaults to now.
+        """
+        if stored is None:
+            stored = time.time()
+        self.__entries.pop(key, None)
+        self.__entries[key] = (stored, value)
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
+
+    def remove(self, key):
+        """Removes the entry for C{key}, if any."""
+        self.__entries.pop(key, None)
+
+    def clear(self):
+        """Removes all the entries."""
+        self.__entries.clear()
+
+    def stats(self):
+        """Returns a dictionary with the cache counters."""
+        tmp = {}
+        tmp['entries'] = len(self.__entries)
+        tmp['hits'] = self.hits
+        tmp['misses'] = self.misses
+        tmp['evictions'] = self.evictions
+        return tmp
+
+class ReverseGeocodeCache:
+    """Cache for reverse geocoded addresses.
+
+    Addresses are keyed on the position, rounded to C{precision} decimal
+    places, and the accuracy level. The cache has an in memory LRU tier
+    and an optional sqlite tier on disk, which survives restarts and can
+    be shared by several processes.
+
+    The entries on disk are counted again when this process has seen
+    more than C{max_disk_entries} of them or has inserted
+    L{RECOUNT_INTERVAL} entries, so with several processes the database
+    can go over C{max_disk_entries} by that many entries per process
+    before the least recently used are evicted. The eviction leaves 1% of
+    free room.
+    """
+
+    def __init__(self, max_entries=4096, ttl=7 * 24 * 3600, path=None,
+                 max_disk_entries=1000000, precision=4):
+        """Construct a L{ReverseGeocodeCache} object.
+
+        @param max_entries: The maximum number of entries kept in memory.
+        @param ttl: The time to live of an address, in seconds, or C{None}.
+        @param path: The path to the sqlite database of the on disk tier.
+        The default is C{None}, no on disk tier.
+        @param max_disk_entries: The maximum number of entries on disk.
+        @param precision: The number of decimal places used for the
+        latitude and longitude. 4 places is about 11 meters.
+        """
+        self.ttl = ttl
+        self.precision = precision
+        self.max_disk_entries = max_disk_entries
+        self.memory = LRUCache(max_entries, ttl)
+        self.disk_hits = 0
+        self.disk_misses = 0
+
+        self.db = None
+        self.__inserted = 0
+        if path is not None:
+            self.db = sqlite3.connect(path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS reverse "
+                            "(key TEXT PRIMARY KEY, address TEXT, "
+                            "stored REAL, used REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS reverse_used "
+                            "ON reverse (used)")
+            self.db.commit()
+            self.disk_entries = self.db.execute(
+                "SELECT COUNT(*) FROM reverse").fetchone()[0]
+
+    def key(self, latitude, longitude, accuracy):
+        """Returns the cache key of a position."""
+        return "%.*f,%.*f,%d" % (self.precision, float(latitude),
+                                 self.precision, float(longitude), int(accuracy))
+
+    def __expired(self, stored):
+        return self.ttl is not None and time.time() - stored > self.ttl
+
+    def get(self, latitude, longitude, accuracy):
+        """Returns the cached address of a position.
+
+        @return: A copy of the address dictionary or C{None} on a miss.
+        """
+        key = self.key(latitude, longitude, accuracy)
+        address = self.memory.get(key)
+        if address is not None:
+            return dict(address)
+
+        if self.db is None:
+            return None
+
+        row = self.db.execute("SELECT address, stored FROM reverse WHERE key = ?",
+                              (key,)).fetchone()
+        if row is None or self.__expired(row[1]):
+            self.disk_misses += 1
+            return None
+
+        self.disk_hits += 1
+        self.db.execute("UPDATE reverse SET used = ? WHERE key = ?",
+                        (time.time(), key))
+        self.db.commit()
+        address = json.loads(row[0])
+        self.memory.put(key, address, row[1])
+        return dict(address)
+
+    def put(self, latitude, longitude, accuracy, address):
+        """Stores the address of a position in every tier."""
+        key = self.key(latitude, longitude, accuracy)
+        address = dict(address)
+        self.memory.put(key, address)
+        if self.db is not None:
+            self.__store(key, address)
+            self.db.commit()
+
+    def __store(self, key, address):
+        now = time.time()
+        inserted = self.db.execute("INSERT OR IGNORE INTO reverse VALUES (?, ?, ?, ?)",
+                                   (key, json.dumps(address), now, now)).rowcount
+        if not inserted:
+            self.db.execute("UPDATE reverse SET address = ?, stored = ?, used = ? "
+                            "WHERE key = ?", (json.dumps(address), now, now, key))
+            return
+
+        self.disk_entries += 1
+        self.__inserted += 1
+        if self.disk_entries <= self.max_disk_entries and self.__inserted < RECOUNT_INTERVAL:
+            return
+
+        self.__inserted = 0
+        self.disk_entries = self.db.execute("SELECT COUNT(*) FROM reverse").fetchone()[0]
+        if self.disk_entries > self.max_disk_entries:
+            excess = self.disk_entries - self.max_disk_entries + self.max_disk_entries // 100
+            self.db.execute("DELETE FROM reverse WHERE key IN "
+                            "(SELECT key FROM reverse ORDER BY used LIMIT ?)",
+                            (excess,))
+            self.disk_entries -= excess
+
+    def prewarm(self, entries=None, resolver=None):
+        """Fills the cache before the addresses are requested.
+
+        Without C{entries} the most recently used addresses on disk are
+        loaded in memory. Otherwise C{entries} is an iterable of
+        C{(latitude, longitude, accuracy, address)} tuples, or of
+        C{(latitude, longitude, accuracy)} tuples that are resolved with
+        C{resolver}, ie. L{DiscoverLocation.reverse_position}.
+
+        @return: The number of entries added.
+        """
+        added = 0
+        if entries is None:
+            if self.db is None:
+                return 0
+            rows = self.db.execute("SELECT key, address, stored FROM reverse "
+                                   "ORDER BY used DESC LIMIT ?",
+                                   (self.memory.max_entries,)).fetchall()
+            # oldest first, so the most recently used end up on top
+            for key, address, stored in reversed(rows):
+                if not self.__expired(stored):
+                    self.memory.put(key, json.loads(address), stored)
+                    added += 1
+            return added
+
+        for entry in entries:
+            if len(entry) > 3:
+                latitude, longitude, accuracy, address = entry[:4]
+            elif resolver is not None:
+                latitude, longitude, accuracy = entry
+                if self.get(latitude, longitude, accuracy) is not None:
+                    continue
+                address = resolver(latitude, longitude, accuracy)
+            else:
+                raise ValueError("prewarm needs the address or a resolver")
+
+            if address is None:
+                continue
+            key = self.key(latitude, longitude, accuracy)
+            self.memory.put(key, dict(address))
+            if self.db is not None:
+                self.__store(key, dict(address))
+            added += 1
+
+        if self.db is not None:
+            self.db.commit()
+        return added
+
+    def clear(self):
+        """Removes all the entries from every tier."""
+        self.memory.clear()
+        if self.db is not None:
+            self.db.execute("DELETE FROM reverse")
+            self.db.commit()
+            self.disk_entries = 0
+
+    def close(self):
+        """Closes the on disk tier."""
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def stats(self):
+        """Returns a dictionary with the cache counters.
+
+        The 'hits' are in memory, the 'disk_hits' on disk after a miss in
+        memory and the 'misses' in every tier.
+        """
+        tmp = self.memory.stats()
+        tmp['misses'] -= self.disk_hits
+        tmp['disk_hits'] = self.disk_hits
+        tmp['disk_misses'] = self.disk_misses
+        if self.db is not None:
+            tmp['disk_entries'] = self.disk_entries
+        return tmp
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import geoclue
+
+# every interface bit a provider can have
+INTERFACES_ALL = geoclue.INTERFACE_ADDRESS | geoclue.INTERFACE_POSITION | \
+    geoclue.INTERFACE_GEOCODE | geoclue.INTERFACE_REVERSE_GEOCODE
+
+class ProviderInfo(dict):
+    """A read only provider description, as in
+    L{DiscoverLocation.get_available_providers}."""
+
+    def __readonly(self, *args, **kwargs):
+        raise TypeError("ProviderInfo objects are read only")
+
+    __setitem__ = __delitem__ = __readonly
+    clear = pop = popitem = setdefault = update = __readonly
+
+class ProviderCatalog:
+    """Indexes of a list of providers, by name and by interfaces.
+
+    Everything is computed when the catalog is built, so the lookups are a
+    single dictionary access and return shared tuples, which must not be
+    changed. A catalog is immutable, L{Registry.ProviderRegistry.get_catalog}
+    builds a new one when the providers change.
+    """
+
+    def __init__(self, providers, generation=0):
+        """Construct a L{ProviderCatalog} object.
+
+        @param providers: A list of L{geoclue.GeoclueProvider} objects.
+        @param generation: The registry generation of the providers.
+        """
+        self.providers = tuple(providers)
+        self.generation = generation
+
+        # the first provider of a name wins, like the old list scans
+        self.__names = {}
+        for provider in self.providers:
+            self.__names.setdefault(provider.name.lower(), provider)
+
+        # every combination of interfaces to the providers having them all
+        self.__interfaces = {}
+        for mask in xrange(INTERFACES_ALL + 1):
+            self.__interfaces[mask] = tuple([provider for provider in self.providers
+                                             if provider.interfaces & mask == mask])
+
+        self.__info = tuple([self.__describe(provider) for provider in self.providers])
+
+    def __len__(self):
+        return len(self.providers)
+
+    def __iter__(self):
+        return iter(self.providers)
+
+    def __describe(self, provider):
+        tmp = {}
+        tmp['name'] = provider.name
+        tmp['address'] = provider.interfaces & geoclue.INTERFACE_ADDRESS != 0
+        tmp['position'] = provider.interfaces & geoclue.INTERFACE_POSITION != 0
+        tmp['geocoding'] = provider.interfaces & geoclue.INTERFACE_GEOCODE != 0
+        tmp['revgeocoding'] = provider.interfaces & geoclue.INTERFACE_REVERSE_GEOCODE != 0
+        tmp['object'] = provider
+        tmp['service'] = provider.service
+        tmp['path'] = provider.path
+        return ProviderInfo(tmp)
+
+    def find(self, name, interfaces=geoclue.INTERFACE_NONE):
+        """Returns a provider by name, ignoring the case.
+
+        @param name: The provider's name.
+        @param interfaces: The interface bits the provider must have.
+        @return: A L{geoclue.GeoclueProvider} or C{None}.
+        """
+        provider = self.__names.get(name.lower())
+        if provider is None or provider.interfaces & interfaces != interfaces:
+            return None
+        return provider
+
+    def with_interfaces(self, interfaces):
+        """Returns the providers that have every given interface.
+
+        @param interfaces: The interface bits, ie.
+        C{INTERFACE_REVERSE_GEOCODE | INTERFACE_POSITION}.
+        @return: A tuple of L{geoclue.GeoclueProvider} objects.
+        """
+        return self.__interfaces.get(interfaces, ())
+
+    def first(self, interfaces):
+        """Returns the first provider that has every given interface, or C{None}."""
+        providers = self.with_interfaces(interfaces)
+        if providers:
+            return providers[0]
+        return None
+
+    def get_info(self):
+        """Returns the description of every provider.
+
+        @return: A tuple of L{ProviderInfo} objects.
+        """
+        return self.__info
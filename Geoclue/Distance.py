@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Batch distance computations.
+
+All the functions take a single reference position and a sequence of
+latitudes and longitudes (in degrees) and compute every distance in one
+pass. When NumPy is available the computations are vectorized, otherwise
+C{array.array} is used as the storage and the math is done point by point.
+Distances are in kilometers, like the proximity factor of
+L{DiscoverLocation.compare_position}.
+"""
+
+import math
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+METHOD_HAVERSINE = "haversine"
+METHOD_VINCENTY = "vincenty"
+
+# mean earth radius (IUGG), in km
+EARTH_RADIUS = 6371.0088
+
+# WGS-84 ellipsoid, in km
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+VINCENTY_ITERATIONS = 200
+VINCENTY_TOLERANCE = 1e-12
+
+def as_array(values):
+    """Converts a sequence of numbers to the batch storage type.
+
+    @param values: A sequence of numbers.
+    @return: A float64 NumPy array or, without NumPy, an C{array.array('d')}.
+    """
+    if numpy is not None:
+        return numpy.asarray(values, dtype=numpy.float64)
+    if isinstance(values, array.array) and values.typecode == 'd':
+        return values
+    return array.array('d', values)
+
+def haversine(latitude, longitude, latitudes, longitudes):
+    """Great circle distances from one position to many positions.
+
+    @param latitude: The reference latitude.
+    @param longitude: The reference longitude.
+    @param latitudes: The latitudes of the positions.
+    @param longitudes: The longitudes of the positions.
+    @return: The distances, in km.
+    """
+    lats = as_array(latitudes)
+    lons = as_array(longitudes)
+    if len(lats) != len(lons):
+        raise ValueError("latitudes and longitudes must have the same length")
+
+    phi1 = math.radians(latitude)
+    cos_phi1 = math.cos(phi1)
+
+    if numpy is not None:
+        phi2 = numpy.radians(lats)
+        dphi = phi2 - phi1
+        dlam = numpy.radians(lons - longitude)
+        h = numpy.sin(dphi / 2) ** 2 + \
+            cos_phi1 * numpy.cos(phi2) * numpy.sin(dlam / 2) ** 2
+        return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(h, 1.0)))
+
+    result = array.array('d', [0.0]) * len(lats)
+    radians = math.radians
+    sin = math.sin
+    cos = math.cos
+    for i in xrange(len(lats)):
+        phi2 = radians(lats[i])
+        h = sin((phi2 - phi1) / 2) ** 2 + \
+            cos_phi1 * cos(phi2) * sin(radians(lons[i] - longitude) / 2) ** 2
+        result[i] = 2 * EARTH_RADIUS * math.asin(math.sqrt(min(h, 1.0)))
+    return result
+
+def distance(latitude1, longitude1, latitude2, longitude2):
+    """Great circle distance between two positions.
+
+    @return: The distance, in km.
+    """
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    h = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * \
+        math.sin(math.radians(longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(h, 1.0)))
+
+def _vincenty(latitude1, longitude1, latitude2, longitude2):
+    # inverse Vincenty formula for a single pair of positions, returns
+    # None when the iteration does not converge (nearly antipodal points)
+    U1 = math.atan((1 - WGS84_F) * math.tan(math.radians(latitude1)))
+    U2 = math.atan((1 - WGS84_F) * math.tan(math.radians(latitude2)))
+    sin_U1, cos_U1 = math.sin(U1), math.cos(U1)
+    sin_U2, cos_U2 = math.sin(U2), math.cos(U2)
+    L = math.radians(longitude2 - longitude1)
+    lam = L
+
+    for i in xrange(VINCENTY_ITERATIONS):
+        sin_lam, cos_lam = math.sin(lam), math.cos(lam)
+        sin_sigma = math.sqrt((cos_U2 * sin_lam) ** 2 +
+            (cos_U1 * sin_U2 - sin_U1 * cos_U2 * cos_lam) ** 2)
+        if sin_sigma == 0:
+            # coincident points
+            return 0.0
+        cos_sigma = sin_U1 * sin_U2 + cos_U1 * cos_U2 * cos_lam
+        sigma = math.atan2(sin_sigma, cos_sigma)
+        sin_alpha = cos_U1 * cos_U2 * sin_lam / sin_sigma
+        cos2_alpha = 1 - sin_alpha ** 2
+        if cos2_alpha != 0:
+            cos_2sm = cos_sigma - 2 * sin_U1 * sin_U2 / cos2_alpha
+        else:
+            # equatorial line
+            cos_2sm = 0.0
+        C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+        previous = lam
+        lam = L + (1 - C) * WGS84_F * sin_alpha * (sigma + C * sin_sigma *
+            (cos_2sm + C * cos_sigma * (-1 + 2 * cos_2sm ** 2)))
+        if abs(lam - previous) < VINCENTY_TOLERANCE:
+            break
+    else:
+        return None
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sm + B / 4 * (cos_sigma *
+        (-1 + 2 * cos_2sm ** 2) - B / 6 * cos_2sm * (-3 + 4 * sin_sigma ** 2) *
+        (-3 + 4 * cos_2sm ** 2)))
+    return WGS84_B * A * (sigma - delta_sigma)
+
+def vincenty(latitude, longitude, latitudes, longitudes):
+    """Ellipsoidal (WGS-84) distances from one position to many positions.
+
+    Pairs for which the Vincenty iteration does not converge (nearly
+    antipodal points) fall back to the haversine distance.
+
+    @param latitude: The reference latitude.
+    @param longitude: The reference longitude.
+    @param latitudes: The latitudes of the positions.
+    @param longitudes: The longitudes of the positions.
+    @return: The distances, in km.
+    """
+    lats = as_array(latitudes)
+    lons = as_array(longitudes)
+    if len(lats) != len(lons):
+        raise ValueError("latitudes and longitudes must have the same length")
+
+    if numpy is None:
+        result = array.array('d', [0.0]) * len(lats)
+        for i in xrange(len(lats)):
+            d = _vincenty(latitude, longitude, lats[i], lons[i])
+            if d is None:
+                d = haversine(latitude, longitude, lats[i:i + 1], lons[i:i + 1])[0]
+            result[i] = d
+        return result
+
+    U1 = math.atan((1 - WGS84_F) * math.tan(math.radians(latitude)))
+    sin_U1, cos_U1 = math.sin(U1), math.cos(U1)
+    U2 = numpy.arctan((1 - WGS84_F) * numpy.tan(numpy.radians(lats)))
+    sin_U2, cos_U2 = numpy.sin(U2), numpy.cos(U2)
+    L = numpy.radians(lons - longitude)
+    lam = L.copy()
+    converged = numpy.zeros(len(lats), dtype=bool)
+
+    for i in xrange(VINCENTY_ITERATIONS):
+        sin_lam, cos_lam = numpy.sin(lam), numpy.cos(lam)
+        sin_sigma = numpy.sqrt((cos_U2 * sin_lam) ** 2 +
+            (cos_U1 * sin_U2 - sin_U1 * cos_U2 * cos_lam) ** 2)
+        coincident = sin_sigma == 0
+        cos_sigma = sin_U1 * sin_U2 + cos_U1 * cos_U2 * cos_lam
+        sigma = numpy.arctan2(sin_sigma, cos_sigma)
+        sin_alpha = cos_U1 * cos_U2 * sin_lam / numpy.where(coincident, 1.0, sin_sigma)
+        cos2_alpha = 1 - sin_alpha ** 2
+        equatorial = cos2_alpha == 0
+        cos_2sm = numpy.where(equatorial, 0.0, cos_sigma - 2 * sin_U1 * sin_U2 /
+            numpy.where(equatorial, 1.0, cos2_alpha))
+        C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+        previous = lam
+        lam = L + (1 - C) * WGS84_F * sin_alpha * (sigma + C * sin_sigma *
+            (cos_2sm + C * cos_sigma * (-1 + 2 * cos_2sm ** 2)))
+        converged = numpy.abs(lam - previous) < VINCENTY_TOLERANCE
+        if converged.all():
+            break
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (cos_2sm + B / 4 * (cos_sigma *
+        (-1 + 2 * cos_2sm ** 2) - B / 6 * cos_2sm * (-3 + 4 * sin_sigma ** 2) *
+        (-3 + 4 * cos_2sm ** 2)))
+    result = WGS84_B * A * (sigma - delta_sigma)
+    result[coincident] = 0.0
+
+    if not converged.all():
+        diverged = ~converged & ~coincident
+        result[diverged] = haversine(latitude, longitude, lats[diverged], lons[diverged])
+    return result
+
+def distances(latitude, longitude, latitudes, longitudes, method=METHOD_HAVERSINE):
+    """Distances from one position to many positions.
+
+    @param latitude: The reference latitude.
+    @param longitude: The reference longitude.
+    @param latitudes: The latitudes of the positions.
+    @param longitudes: The longitudes of the positions.
+    @param method: L{METHOD_HAVERSINE} or L{METHOD_VINCENTY}.
+    @return: The distances, in km.
+    """
+    if method == METHOD_HAVERSINE:
+        return haversine(latitude, longitude, latitudes, longitudes)
+    elif method == METHOD_VINCENTY:
+        return vincenty(latitude, longitude, latitudes, longitudes)
+    raise ValueError("unknown distance method: %s" % method)
+
+def within(distances, max_distance):
+    """Builds the in-range mask for a set of distances.
+
+    @param distances: The distances, as returned by L{distances}.
+    @param max_distance: The maximum distance, in km.
+    @return: A boolean NumPy array or, without NumPy, an C{array.array('b')}.
+    """
+    if numpy is not None:
+        return numpy.asarray(distances) < max_distance
+    return array.array('b', [d < max_distance for d in distances])
+
+def proximity(latitude, longitude, latitudes, longitudes, max_distance,
+              method=METHOD_HAVERSINE):
+    """Distances and in-range mask from one position to many positions.
+
+    @param latitude: The reference latitude.
+    @param longitude: The reference longitude.
+    @param latitudes: The latitudes of the positions.
+    @param longitudes: The longitudes of the positions.
+    @param max_distance: The maximum distance, in km.
+    @param method: L{METHOD_HAVERSINE} or L{METHOD_VINCENTY}.
+    @return: A C{(distances, mask)} tuple.
+    """
+    result = distances(latitude, longitude, latitudes, longitudes, method)
+    return (result, within(result, max_distance))
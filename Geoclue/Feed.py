@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Publishes the location of a L{DiscoverLocation} to other processes.
+
+A single process talks to Geoclue and every other process of the host
+reads the updates from a Unix domain socket, with the C{geoclue_feed}
+module, which needs neither dbus nor this package. The daemon is started
+with:
+
+    python -m Geoclue.Feed [--socket PATH] [--accuracy LEVEL]
+"""
+
+import os
+import sys
+import stat
+import errno
+import socket
+import optparse
+
+import gobject
+
+import geoclue
+from Location import _accuracy
+from geoclue_feed import default_path, check_directory, encode
+
+ADDRESS_KEYS = ('street', 'area', 'locality', 'region', 'country', 'countrycode')
+
+class FeedServer:
+    """Sends the position and address updates to the connected clients.
+
+    The clients are written to without blocking, each one with its own
+    output buffer. A client that does not keep up, its buffer over
+    C{max_buffer} bytes, is disconnected.
+    """
+
+    def __init__(self, location, path=None, mode=0600, max_buffer=65536):
+        """Construct a L{FeedServer} object.
+
+        @param location: An initialized L{DiscoverLocation}.
+        @param path: The socket path, see C{geoclue_feed.default_path}. The
+        directory of the default path is created if needed and checked, see
+        C{geoclue_feed.check_directory}.
+        @param mode: The permissions of the socket file.
+        @param max_buffer: The maximum number of bytes waiting for a client.
+        """
+        # the directory of the default path is checked
+        self.private = path is None
+        if path is None:
+            path = default_path()
+        self.location = location
+        self.path = path
+        self.mode = mode
+        self.max_buffer = max_buffer
+        self.socket = None
+        self.clients = {}
+        self.sent = 0
+        self.dropped = 0
+        self.__source = None
+        self.__connection = None
+        self.__position = None
+        self.__address = None
+
+    def __remove_stale(self):
+        # only a socket nobody listens on is removed, not a running feed
+        try:
+            info = os.lstat(self.path)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        if not stat.S_ISSOCK(info.st_mode):
+            raise socket.error(errno.EADDRINUSE, "%s is not a socket" % self.path)
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            try:
+                probe.connect(self.path)
+            except socket.error, e:
+                if e.args[0] != errno.ECONNREFUSED:
+                    raise
+                os.unlink(self.path)
+                return
+        finally:
+            probe.close()
+        raise socket.error(errno.EADDRINUSE, "a feed is already running on %s" % self.path)
+
+    def start(self):
+        """Listens on the socket and follows the location's updates.
+
+        @raise socket.error: If another feed is running on the socket, or
+        the path is not a socket.
+        @raise OSError: If the directory of the default path is not
+        private.
+        """
+        self.stop()
+        if self.private:
+            check_directory(os.path.dirname(self.path), True)
+        self.__remove_stale()
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.path)
+        os.chmod(self.path, self.mode)
+        self.socket.listen(64)
+        self.socket.setblocking(False)
+        self.__source = gobject.io_add_watch(self.socket, gobject.IO_IN, self.__on_accept)
+        self.__connection = self.location.connect(self.__on_changed)
+        self.__update()
+
+    def stop(self):
+        """Disconnects every client and removes the socket."""
+        if self.__connection is not None:
+            self.location.signal.disconnect(self.__connection)
+            self.__connection = None
+        for client in self.clients.keys():
+            self.__drop(client)
+        if self.__source is not None:
+            gobject.source_remove(self.__source)
+            self.__source = None
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def __position_message(self):
+        fix = self.location.get_location_fix()
+        if fix is None:
+            return None
+        return {'type': 'position',
+                'timestamp': fix.timestamp,
+                'latitude': fix.latitude,
+                'longitude': fix.longitude,
+                'altitude': fix.altitude,
+                'fields': fix.fields,
+                'accuracy': list(_accuracy(fix.accuracy))}
+
+    def __address_message(self):
+        info = self.location.get_location_info()
+        if not info.has_key('address_timestamp'):
+            return None
+        address = {}
+        for key in ADDRESS_KEYS:
+            if info.has_key(key):
+                address[key] = info[key]
+        return {'type': 'address',
+                'timestamp': info['address_timestamp'],
+                'address': address}
+
+    def __update(self):
+        # the location only has one signal, see what changed
+        lines = []
+        position = self.__position_message()
+        if position is not None and position != self.__position:
+            self.__position = position
+            lines.append(encode(position))
+        address = self.__address_message()
+        if address is not None and address != self.__address:
+            self.__address = address
+            lines.append(encode(address))
+        return "".join(lines)
+
+    def __on_changed(self):
+        data = self.__update()
+        if data:
+            for client in self.clients.keys():
+                self.__send(client, data)
+
+    def __on_accept(self, source, condition):
+        try:
+            (client, address) = self.socket.accept()
+        except socket.error:
+            return True
+        client.setblocking(False)
+        self.clients[client] = [gobject.io_add_watch(client, gobject.IO_IN | gobject.IO_HUP |
+                                                     gobject.IO_ERR, self.__on_client_event),
+                                None, ""]
+        # the current state first
+        data = ""
+        if self.__position is not None:
+            data += encode(self.__position)
+        if self.__address is not None:
+            data += encode(self.__address)
+        if data:
+            self.__send(client, data)
+        return True
+
+    def __send(self, client, data):
+        state = self.clients.get(client)
+        if state is None:
+            return
+        state[2] += data
+        if len(state[2]) > self.max_buffer:
+            self.dropped += 1
+            self.__drop(client)
+            return
+        self.__flush(client)
+
+    def __flush(self, client):
+        state = self.clients[client]
+        try:
+            while state[2]:
+                sent = client.send(state[2])
+                self.sent += sent
+                state[2] = state[2][sent:]
+        except socket.error, e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                self.__drop(client)
+                return
+        if state[2] and state[1] is None:
+            state[1] = gobject.io_add_watch(client, gobject.IO_OUT, self.__on_writable)
+
+    def __on_writable(self, client, condition):
+        state = self.clients.get(client)
+        if state is None:
+            return False
+        # this watch ends here, the flush adds a new one if still needed
+        state[1] = None
+        self.__flush(client)
+        return False
+
+    def __on_client_event(self, client, condition):
+        # the clients do not send anything, readable means closed
+        try:
+            data = client.recv(4096)
+        except socket.error:
+            data = ""
+        if not data:
+            self.clients[client][0] = None
+            self.__drop(client)
+            return False
+        return True
+
+    def __drop(self, client):
+        state = self.clients.pop(client, None)
+        if state is None:
+            return
+        if state[0] is not None:
+            gobject.source_remove(state[0])
+        if state[1] is not None:
+            gobject.source_remove(state[1])
+        client.close()
+
+def main(argv=None):
+    """Runs a L{FeedServer} until interrupted."""
+    parser = optparse.OptionParser(prog="python -m Geoclue.Feed")
+    parser.add_option("--socket", default=None,
+                      help="socket path, default %s" % default_path())
+    parser.add_option("--accuracy", type="int", default=geoclue.ACCURACY_LEVEL_COUNTRY,
+                      help="desired accuracy level")
+    parser.add_option("--resource", type="int", default=geoclue.RESOURCE_NETWORK,
+                      help="resources to be used")
+    (options, args) = parser.parse_args(argv)
+
+    from Base import DiscoverLocation
+    location = DiscoverLocation()
+    if not location.init(options.accuracy, options.resource):
+        print "Error: could not initialize Geoclue"
+        return 1
+
+    server = FeedServer(location, options.socket)
+    server.start()
+    loop = gobject.MainLoop()
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
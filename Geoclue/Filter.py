@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Filters for the position updates.
+
+The filters of a L{DiscoverLocation} (see
+L{DiscoverLocation.add_position_filter}) see every fix before the location
+info is updated and the signals are emitted. A filter returns the fix to
+pass on, which may be a new one, or C{None} to drop it.
+"""
+
+import math
+
+import geoclue
+import Distance
+from Location import LocationFix, _accuracy
+
+# meters per degree of latitude
+METERS_PER_DEGREE = Distance.EARTH_RADIUS * 1000 * math.pi / 180
+
+# horizontal accuracy, in meters, assumed for the fixes that only report
+# an accuracy level
+LEVEL_ACCURACY = {
+    geoclue.ACCURACY_LEVEL_COUNTRY: 300000.0,
+    geoclue.ACCURACY_LEVEL_REGION: 50000.0,
+    geoclue.ACCURACY_LEVEL_LOCALITY: 5000.0,
+    geoclue.ACCURACY_LEVEL_POSTALCODE: 2000.0,
+    geoclue.ACCURACY_LEVEL_STREET: 500.0,
+    geoclue.ACCURACY_LEVEL_DETAILED: 50.0,
+}
+
+class PositionFilter:
+    """Base class of the position filters, passes every fix."""
+
+    def process(self, fix):
+        """Filters a fix.
+
+        @param fix: A L{Location.LocationFix}.
+        @return: The fix to pass on or C{None} to drop it.
+        """
+        return fix
+
+    def reset(self):
+        """Forgets every fix seen so far."""
+        pass
+
+class FieldsFilter(PositionFilter):
+    """Drops the fixes without a valid latitude and longitude."""
+
+    def process(self, fix):
+        if not fix.has_position():
+            return None
+        return fix
+
+class KalmanFilter(PositionFilter):
+    """Constant velocity Kalman filter.
+
+    The position is tracked in meters on a plane tangent to the first fix,
+    with a position and velocity state for the east and north axes. The
+    axes are independent, so the 4x4 filter splits in two 2x2 filters that
+    are solved in closed form. Each fix is weighted by its reported
+    horizontal accuracy, or by L{LEVEL_ACCURACY} when the provider only
+    reports an accuracy level, and fixes without a latitude and longitude
+    are dropped.
+
+    The velocity estimate allows cheap extrapolation with L{predict}.
+    """
+
+    def __init__(self, acceleration=1.0):
+        """Construct a L{KalmanFilter} object.
+
+        @param acceleration: The standard deviation of the unmodelled
+        acceleration, in m/s^2. Higher values follow turns faster, lower
+        values smooth more.
+        """
+        self.acceleration = acceleration
+        self.reset()
+
+    def reset(self):
+        self.origin = None
+        self.timestamp = None
+        # [east, north] position (m), velocity (m/s) and covariances
+        self.position = [0.0, 0.0]
+        self.velocity = [0.0, 0.0]
+        self.p00 = [0.0, 0.0]
+        self.p01 = [0.0, 0.0]
+        self.p11 = [0.0, 0.0]
+
+    def __to_plane(self, latitude, longitude):
+        (lat0, lon0, scale) = self.origin
+        # relative longitude, across the antimeridian
+        delta = (longitude - lon0 + 180) % 360 - 180
+        return (delta * scale, (latitude - lat0) * METERS_PER_DEGREE)
+
+    def __from_plane(self, east, north):
+        (lat0, lon0, scale) = self.origin
+        return (lat0 + north / METERS_PER_DEGREE, (lon0 + east / scale + 180) % 360 - 180)
+
+    def __variance(self, fix):
+        (level, horizontal, vertical) = _accuracy(fix.accuracy)
+        if horizontal <= 0:
+            horizontal = LEVEL_ACCURACY.get(level)
+        if horizontal is None:
+            return None
+        return horizontal * horizontal
+
+    def __predict(self, dt):
+        q = self.acceleration ** 2
+        for axis in (0, 1):
+            p01 = self.p01[axis]
+            p11 = self.p11[axis]
+            self.position[axis] += self.velocity[axis] * dt
+            self.p00[axis] += dt * (2 * p01 + dt * p11) + q * dt ** 4 / 4
+            self.p01[axis] = p01 + dt * p11 + q * dt ** 3 / 2
+            self.p11[axis] = p11 + q * dt ** 2
+
+    def process(self, fix):
+        if not fix.has_position():
+            return None
+        variance = self.__variance(fix)
+        if variance is None:
+            return None
+
+        if self.origin is None:
+            scale = METERS_PER_DEGREE * max(math.cos(math.radians(fix.latitude)), 1e-6)
+            self.origin = (fix.latitude, fix.longitude, scale)
+            self.timestamp = fix.timestamp
+            self.position = [0.0, 0.0]
+            self.velocity = [0.0, 0.0]
+            self.p00 = [variance, variance]
+            self.p01 = [0.0, 0.0]
+            # the velocity is unknown, allow about 50 m/s
+            self.p11 = [2500.0, 2500.0]
+            return fix
+
+        dt = fix.timestamp - self.timestamp
+        if dt > 0:
+            self.__predict(dt)
+            self.timestamp = fix.timestamp
+
+        measured = self.__to_plane(fix.latitude, fix.longitude)
+        for axis in (0, 1):
+            p00 = self.p00[axis]
+            p01 = self.p01[axis]
+            s = p00 + variance
+            k0 = p00 / s
+            k1 = p01 / s
+            innovation = measured[axis] - self.position[axis]
+            self.position[axis] += k0 * innovation
+            self.velocity[axis] += k1 * innovation
+            self.p00[axis] = (1 - k0) * p00
+            self.p01[axis] = (1 - k0) * p01
+            self.p11[axis] -= k1 * p01
+
+        (latitude, longitude) = self.__from_plane(self.position[0], self.position[1])
+        (level, horizontal, vertical) = _accuracy(fix.accuracy)
+        horizontal = math.sqrt(max(self.p00))
+        return LocationFix(fix.fields, fix.timestamp, latitude, longitude,
+                           fix.altitude, (level, horizontal, vertical))
+
+    def predict(self, timestamp):
+        """Extrapolates the position without any new fix.
+
+        @param timestamp: The time to predict the position for.
+        @return: A C{(latitude, longitude)} tuple or C{None} before the
+        first fix.
+        """
+        if self.origin is None:
+            return None
+        dt = timestamp - self.timestamp
+        return self.__from_plane(self.position[0] + self.velocity[0] * dt,
+                                 self.position[1] + self.velocity[1] * dt)
+
+    def get_velocity(self):
+        """Returns the estimated C{(east, north)} velocity, in m/s."""
+        return tuple(self.velocity)
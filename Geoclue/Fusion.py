@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import time
+
+import geoclue
+import Async
+import Metrics
+from Signal import Signal
+from Filter import LEVEL_ACCURACY
+from Location import LocationFix, _accuracy
+
+class PositionFusion:
+    """Fuses the positions of every position provider.
+
+    Every provider that has the position interface is asked for its
+    position and followed through its C{PositionChanged} signal, all at the
+    same time. Each new fix is fused with the latest fix of the other
+    providers, weighted by accuracy and age, and the result is emitted
+    right away, so the first fix comes from the fastest provider.
+
+    The signal is emitted with the fused L{Location.LocationFix}.
+    """
+
+    def __init__(self, providers, max_age=120, speed=10.0):
+        """Construct a L{PositionFusion} object.
+
+        @param providers: A list of L{geoclue.GeoclueProvider} objects, the
+        ones without the position interface are ignored.
+        @param max_age: Fixes older than this, in seconds, are not fused.
+        @param speed: The assumed speed, in m/s, used to lower the weight of
+        older fixes: a fix loses C{speed} meters of accuracy per second.
+        """
+        self.providers = [provider for provider in providers
+                          if provider.interfaces & geoclue.INTERFACE_POSITION]
+        self.max_age = max_age
+        self.speed = speed
+        self.signal = Signal()
+        self.fix = None
+        self.__latest = {}
+        self.__matches = []
+        # the providers that could not be followed, see L{start}
+        self.errors = {}
+        # optional L{Replay.SignalRecorder} of the providers' positions
+        self.recorder = None
+
+    def start(self):
+        """Subscribes to every provider and asks for their positions.
+
+        @return: A dictionary of the providers that could not be subscribed
+        to, their names to the D-Bus errors, also kept in C{errors}.
+        """
+        self.stop()
+        self.errors = {}
+        for provider in self.providers:
+            try:
+                position = provider.get_interface(geoclue.POSITION_IFACE)
+                match = position.connect_to_signal("PositionChanged",
+                                                   self.__on_position_changed(provider.name))
+                self.__matches.append(match)
+            except Exception, e:
+                self.errors[provider.name] = e
+                continue
+            pending = Metrics.get_metrics().track("GetPosition", provider.name,
+                                                  Async.call(position.GetPosition))
+            pending.add_callback(self.__on_position_reply(provider.name))
+        return self.errors
+
+    def stop(self):
+        """Unsubscribes from every provider."""
+        for match in self.__matches:
+            match.remove()
+        self.__matches = []
+
+    def __on_position_changed(self, name):
+        def callback(*args):
+            self.on_provider_position(name, *args)
+        return callback
+
+    def __on_position_reply(self, name):
+        def callback(pending):
+            if pending.error is None:
+                self.on_provider_position(name, *pending.result)
+            else:
+                self.errors[name] = pending.error
+        return callback
+
+    def on_provider_position(self, name, fields, timestamp, latitude, longitude,
+                             altitude, accuracy):
+        """Handles a position of a provider, as received.
+
+        It is recorded, if recording, and fused with L{add_fix}.
+
+        @param name: The provider's name.
+        """
+        if self.recorder is not None:
+            self.recorder.record("ProviderPositionChanged",
+                                 (name, fields, timestamp, latitude, longitude, altitude, accuracy))
+        self.add_fix(name, LocationFix(fields, timestamp, latitude, longitude,
+                                       altitude, accuracy))
+
+    def add_fix(self, name, fix):
+        """Fuses a new fix of a provider and emits the result.
+
+        @param name: The provider's name.
+        @param fix: The provider's L{Location.LocationFix}.
+        @return: The fused fix or C{None} if there is no usable fix.
+        """
+        if not fix.has_position():
+            return None
+        self.__latest[name] = (fix, time.time())
+        fused = self.fuse()
+        if fused is not None:
+            self.fix = fused
+            self.signal(fused)
+        return fused
+
+    def __sigma(self, fix, age):
+        (level, horizontal, vertical) = _accuracy(fix.accuracy)
+        if horizontal <= 0:
+            horizontal = LEVEL_ACCURACY.get(level)
+        if horizontal is None:
+            return None
+        return horizontal + self.speed * age
+
+    def fuse(self):
+        """Fuses the latest fix of every provider.
+
+        The positions are averaged with inverse variance weights. The
+        accuracy level of the result is the best of the fused fixes.
+
+        @return: The fused L{Location.LocationFix} or C{None}.
+        """
+        now = time.time()
+        total = 0.0
+        latitude = longitude = 0.0
+        altitude_total = altitude = 0.0
+        timestamp = 0
+        fields = geoclue.POSITION_FIELDS_LATITUDE | geoclue.POSITION_FIELDS_LONGITUDE
+        level = geoclue.ACCURACY_LEVEL_NONE
+        reference = None
+
+        for name, (fix, received) in self.__latest.items():
+            age = now - received
+            if age > self.max_age:
+                continue
+            sigma = self.__sigma(fix, age)
+            if sigma is None:
+                continue
+
+            weight = 1.0 / max(sigma, 1.0) ** 2
+            if reference is None:
+                reference = fix.longitude
+            # average longitudes around the first one, across the antimeridian
+            delta = (fix.longitude - reference + 180) % 360 - 180
+            total += weight
+            latitude += weight * fix.latitude
+            longitude += weight * delta
+            if fix.has_altitude():
+                altitude_total += weight
+                altitude += weight * fix.altitude
+            timestamp = max(timestamp, fix.timestamp)
+            level = max(level, _accuracy(fix.accuracy)[0])
+
+        if total == 0:
+            return None
+
+        longitude = (reference + longitude / total + 180) % 360 - 180
+        if altitude_total:
+            fields |= geoclue.POSITION_FIELDS_ALTITUDE
+            altitude = altitude / altitude_total
+        return LocationFix(fields, timestamp, latitude / total, longitude,
+                           altitude, (level, 1 / math.sqrt(total), 0.0))
+
+    def connect(self, func):
+        """Connects a given function to the signal.
+        The signal is emitted with the fused fix.
+
+        @param func: The function to connect to the signal.
+        """
+        return self.signal.connect(func)
@@ -0,0 +1,543 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Offline reverse and forward geocoding with a local gazetteer.
+
+A GeoNames dump (ie. C{cities1000.txt}) is converted once by
+L{build_index} into an index file, which L{Gazetteer} memory maps. The
+places are sorted by the Morton (Z-order) key of their position, so the
+places of a grid cell are a contiguous range found by binary search, and a
+lookup only reads the few cells around the position. The names are
+searched with a L{NameIndex}, built on the first forward lookup.
+"""
+
+import os
+import sys
+import mmap
+import math
+import array
+import bisect
+import struct
+import codecs
+import unicodedata
+
+import geoclue
+import Distance
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = "GCGAZT"
+VERSION = 2
+
+# magic, version, number of places, offset of the strings
+HEADER = struct.Struct("<6sHII")
+HEADER_SIZE = 64
+
+# the keys column, then the records: latitude, longitude, the string
+# offsets of the locality, region, country and country code, and the
+# population
+KEY = struct.Struct("<I")
+RECORD = struct.Struct("<ffIIIII")
+
+if numpy is not None:
+    RECORD_DTYPE = numpy.dtype([('latitude', '<f4'), ('longitude', '<f4'),
+                                ('name', '<u4'), ('region', '<u4'), ('country', '<u4'),
+                                ('countrycode', '<u4'), ('population', '<u4')])
+
+# bits of the quantized latitude and longitude, the key has twice as many
+BITS = 16
+
+# grid levels searched, from the finest cells (about 5 km) to the whole
+# world, in bits per axis
+LEVELS = (12, 10, 8, 6, 4, 2, 0)
+
+# the first level searched is the finest one where, if the places were
+# spread evenly, a cell would have this many places; real places are
+# clustered, so the populated cells have many more
+MIN_PLACES_PER_CELL = 1.0 / 16
+
+KM_PER_DEGREE = Distance.EARTH_RADIUS * math.pi / 180
+
+# the number of places of a name prefix that are looked at
+MAX_PREFIX_MATCHES = 256
+
+# spreads the 8 bits of a byte to the even bits of a 16 bits word
+_SPREAD = [0] * 256
+for _i in xrange(256):
+    for _bit in xrange(8):
+        if _i & (1 << _bit):
+            _SPREAD[_i] |= 1 << (2 * _bit)
+
+if numpy is not None:
+    _SPREAD_ARRAY = numpy.array(_SPREAD, dtype=numpy.uint64)
+
+def _interleave(y, x):
+    # Morton key of a cell, the latitude on the even bits
+    return (_SPREAD[y & 0xff] | _SPREAD[y >> 8] << 16) | \
+        (_SPREAD[x & 0xff] | _SPREAD[x >> 8] << 16) << 1
+
+def _quantize(latitude, longitude):
+    y = int((latitude + 90.0) / 180.0 * (1 << BITS))
+    x = int(((longitude + 180.0) % 360.0) / 360.0 * (1 << BITS))
+    return (min(max(y, 0), (1 << BITS) - 1), min(max(x, 0), (1 << BITS) - 1))
+
+def fold(name):
+    """Folds a name for matching: lower case, without accents or spaces around."""
+    name = unicodedata.normalize("NFKD", unicode(name))
+    return u"".join([c for c in name if not unicodedata.combining(c)]).lower().strip()
+
+def _read_names(path, key_column, name_column, comment="#"):
+    names = {}
+    if path is None:
+        return names
+    f = codecs.open(path, "r", "utf-8")
+    try:
+        for line in f:
+            if line.startswith(comment):
+                continue
+            columns = line.rstrip("\r\n").split("\t")
+            if len(columns) > max(key_column, name_column):
+                names[columns[key_column]] = columns[name_column]
+    finally:
+        f.close()
+    return names
+
+def build_index(source, path, admin1=None, countries=None,
+                feature_classes="P", min_population=0):
+    """Builds an index file from a GeoNames dump.
+
+    @param source: The path to a GeoNames places file, ie. C{allCountries.txt}
+    or C{cities1000.txt}.
+    @param path: The path to the index file to write.
+    @param admin1: The path to C{admin1CodesASCII.txt} for the region
+    names, without it the regions are empty.
+    @param countries: The path to C{countryInfo.txt} for the country names,
+    without it the countries are empty.
+    @param feature_classes: The GeoNames feature classes to keep, the
+    default keeps the populated places.
+    @param min_population: The places with fewer people are skipped.
+    @return: The number of places in the index.
+    """
+    regions = _read_names(admin1, 0, 1)
+    country_names = _read_names(countries, 0, 4)
+
+    strings = ["\0"]
+    offsets = {u"": 0}
+    size = [1]
+    def intern(value):
+        offset = offsets.get(value)
+        if offset is None:
+            encoded = value.encode("utf-8") + "\0"
+            offset = offsets[value] = size[0]
+            strings.append(encoded)
+            size[0] += len(encoded)
+        return offset
+
+    places = []
+    f = codecs.open(source, "r", "utf-8")
+    try:
+        for line in f:
+            columns = line.rstrip("\r\n").split("\t")
+            if len(columns) < 15 or columns[6] not in feature_classes:
+                continue
+            try:
+                population = int(columns[14] or 0)
+                latitude = float(columns[4])
+                longitude = float(columns[5])
+            except ValueError:
+                continue
+            if population < min_population:
+                continue
+            code = columns[8]
+            (y, x) = _quantize(latitude, longitude)
+            places.append((_interleave(y, x), latitude, longitude,
+                           intern(columns[1]),
+                           intern(regions.get("%s.%s" % (code, columns[10]), u"")),
+                           intern(country_names.get(code, u"")),
+                           intern(code), min(population, 0xffffffff)))
+    finally:
+        f.close()
+
+    places.sort()
+    strings_offset = HEADER_SIZE + len(places) * (KEY.size + RECORD.size)
+    tmp_path = path + ".tmp"
+    f = open(tmp_path, "wb")
+    try:
+        f.write(HEADER.pack(MAGIC, VERSION, len(places), strings_offset).ljust(HEADER_SIZE, "\0"))
+        f.write("".join([KEY.pack(place[0]) for place in places]))
+        f.write("".join([RECORD.pack(*place[1:]) for place in places]))
+        f.write("".join(strings))
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+    return len(places)
+
+class Gazetteer:
+    """A memory mapped index of places for offline reverse geocoding.
+
+    The nearest place is searched in the 3x3 grid cells around the position,
+    from the finest grid to the coarsest, until the nearest place found is
+    closer than any place outside those cells can be.
+    """
+
+    def __init__(self, path, max_distance=None):
+        """Construct a L{Gazetteer} object.
+
+        @param path: The path to an index file made by L{build_index}.
+        @param max_distance: The places farther than this, in km, are not
+        returned by L{reverse}, the default returns the nearest place
+        wherever it is.
+        """
+        self.path = path
+        self.max_distance = max_distance
+        self.names = None
+
+        self.__file = open(path, "rb")
+        header = self.__file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            self.__file.close()
+            raise ValueError("%s is not a gazetteer index" % path)
+        (magic, version, count, strings_offset) = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            self.__file.close()
+            raise ValueError("%s is not a gazetteer index" % path)
+
+        self.count = count
+        self.map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__records = HEADER_SIZE + count * KEY.size
+        self.__strings = strings_offset
+        # a sparse index starts with coarser cells, to skip the empty ones
+        self.__levels = [level for level in LEVELS
+                         if level == 0 or count >= 4 ** level * MIN_PLACES_PER_CELL]
+        # the keys are searched with a C bisect, as a NumPy view of the
+        # map or as a copy in an array of 4 bytes per place
+        if numpy is not None:
+            self.__keys = numpy.frombuffer(self.map, dtype="<u4", count=count,
+                                           offset=HEADER_SIZE)
+            # the candidates' distances are computed in one vectorized pass,
+            # over a copy of the positions that is quick to gather from
+            records = numpy.frombuffer(self.map, dtype=RECORD_DTYPE, count=count,
+                                       offset=self.__records)
+            self.__latitudes = records['latitude'].astype(numpy.float64)
+            self.__longitudes = records['longitude'].astype(numpy.float64)
+        else:
+            self.__keys = array.array('I')
+            self.__keys.fromstring(self.map[HEADER_SIZE:HEADER_SIZE + count * KEY.size])
+            if sys.byteorder == "big":
+                self.__keys.byteswap()
+
+    def __len__(self):
+        return self.count
+
+    def __bisect(self, key):
+        if numpy is not None:
+            # a Python integer key would make NumPy convert the whole column
+            if key > 0xffffffff:
+                return self.count
+            return int(self.__keys.searchsorted(numpy.uint32(key)))
+        return bisect.bisect_left(self.__keys, key)
+
+    def __string(self, offset):
+        start = self.__strings + offset
+        return self.map[start:self.map.find("\0", start)].decode("utf-8")
+
+    def __record(self, index):
+        return RECORD.unpack_from(self.map, self.__records + index * RECORD.size)
+
+    def __ranges(self, cells, shift, rows, columns):
+        # the index ranges of the places of every (row, column) cell
+        size = 1 << (2 * shift)
+        if numpy is not None:
+            (ys, xs) = numpy.meshgrid(numpy.array(rows, dtype=numpy.uint32),
+                                      numpy.array(columns, dtype=numpy.uint32))
+            keys = (_SPREAD_ARRAY[ys & 0xff] | _SPREAD_ARRAY[ys >> 8] << 16 |
+                    (_SPREAD_ARRAY[xs & 0xff] | _SPREAD_ARRAY[xs >> 8] << 16) << 1) << (2 * shift)
+            keys = keys.ravel()
+            # the last key of a cell, the first of the next may not fit
+            lows = self.__keys.searchsorted(keys.astype(numpy.uint32))
+            highs = self.__keys.searchsorted((keys + (size - 1)).astype(numpy.uint32), 'right')
+            return (lows, highs)
+        tmp = []
+        for cy in rows:
+            for cx in columns:
+                key = _interleave(cy, cx) << (2 * shift)
+                tmp.append((self.__bisect(key), self.__bisect(key + size)))
+        return tmp
+
+    def __closest(self, latitude, longitude, ranges, best):
+        # the nearest place of the index ranges, if closer than best
+        if numpy is not None:
+            (lows, highs) = ranges
+            sizes = highs - lows
+            total = int(sizes.sum())
+            if not total:
+                return best
+            if total == self.count:
+                indexes = numpy.arange(total)
+                distances = Distance.haversine(latitude, longitude, self.__latitudes,
+                                               self.__longitudes)
+            else:
+                offsets = numpy.cumsum(sizes) - sizes
+                indexes = numpy.repeat(lows - offsets, sizes) + numpy.arange(total)
+                distances = Distance.haversine(latitude, longitude, self.__latitudes[indexes],
+                                               self.__longitudes[indexes])
+            index = int(distances.argmin())
+            if best is None or distances[index] < best[0]:
+                return (float(distances[index]), int(indexes[index]))
+            return best
+        for (low, high) in ranges:
+            for index in xrange(low, high):
+                record = self.__record(index)
+                distance = Distance.distance(latitude, longitude, record[0], record[1])
+                if best is None or distance < best[0]:
+                    best = (distance, index)
+        return best
+
+    def nearest(self, latitude, longitude, max_distance=None):
+        """Finds the place nearest to a position.
+
+        @param max_distance: The places farther than this, in km, are not
+        searched for, which keeps the lookups far from every place short.
+        @return: A C{(distance, index)} tuple, the distance in km, or
+        C{None} if the index is empty or there is no place within
+        C{max_distance}.
+        """
+        (y, x) = _quantize(latitude, longitude)
+        cos_latitude = math.cos(math.radians(latitude))
+        shifted = (longitude + 180.0) % 360.0
+        best = None
+        for level in self.__levels:
+            shift = BITS - level
+            cells = 1 << level
+            (cell_y, cell_x) = (y >> shift, x >> shift)
+            height = 180.0 / cells
+            width = 360.0 / cells
+
+            # the meridians converge towards the poles, so more columns
+            # are needed to reach as far as the rows above and below
+            sine = math.sin(math.radians(height))
+            if sine >= cos_latitude:
+                span = cells
+            else:
+                span = int(math.ceil(math.degrees(math.asin(sine / cos_latitude)) / width))
+            if 2 * span + 1 >= cells:
+                columns = range(cells)
+            else:
+                # the longitude wraps around the antimeridian
+                columns = [(cell_x + offset) % cells for offset in xrange(-span, span + 1)]
+            rows = [cy for cy in (cell_y - 1, cell_y, cell_y + 1) if 0 <= cy < cells]
+            best = self.__closest(latitude, longitude,
+                                  self.__ranges(cells, shift, rows, columns), best)
+
+            # every place within reach is in the searched cells: the poles
+            # do not bound the rows, a meridian bounds the columns
+            reach = float("inf")
+            if cell_y - 1 > 0:
+                reach = latitude + 90.0 - (cell_y - 1) * height
+            if cell_y + 2 < cells:
+                reach = min(reach, (cell_y + 2) * height - 90.0 - latitude)
+            if len(columns) < cells:
+                offset = min(shifted - (cell_x - span) * width,
+                             (cell_x + span + 1) * width - shifted)
+                reach = min(reach, math.degrees(math.asin(
+                    cos_latitude * math.sin(math.radians(min(offset, 90.0))))))
+            reach = max(reach, 0.0) * KM_PER_DEGREE
+
+            if best is not None and best[0] <= reach:
+                break
+            if max_distance is not None and max_distance <= reach:
+                # every place close enough was in the cells
+                break
+        if best is not None and max_distance is not None and best[0] > max_distance:
+            return None
+        return best
+
+    def place(self, index):
+        """Returns a place of the index.
+
+        @return: A dictionary with the place's 'name', 'region', 'country',
+        'countrycode', 'latitude', 'longitude' and 'population'.
+        """
+        (latitude, longitude, name, region, country, code, population) = self.__record(index)
+        return {'name': self.__string(name),
+                'region': self.__string(region),
+                'country': self.__string(country),
+                'countrycode': self.__string(code),
+                'latitude': latitude,
+                'longitude': longitude,
+                'population': population}
+
+    def __iter__(self):
+        for index in xrange(self.count):
+            yield self.place(index)
+
+    def reverse(self, latitude, longitude, max_distance=None):
+        """Returns the address of the place nearest to a position.
+
+        @param max_distance: Overrides the gazetteer's maximum distance.
+        @return: An address dictionary with the keys of
+        L{DiscoverLocation.validate_address}, or C{None} if there is no
+        place close enough.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        found = self.nearest(latitude, longitude, max_distance)
+        if found is None:
+            return None
+        place = self.place(found[1])
+        return {'street': u"",
+                'area': u"",
+                'locality': place['name'],
+                'region': place['region'],
+                'country': place['country'],
+                'countrycode': place['countrycode']}
+
+    def get_name_index(self):
+        """Returns the L{NameIndex} of the places, built on the first call."""
+        if self.names is None:
+            self.names = NameIndex(self)
+        return self.names
+
+    def close(self):
+        """Closes the index file."""
+        if self.map is not None:
+            self.__keys = None
+            self.map.close()
+            self.map = None
+            self.__file.close()
+
+class NameIndex:
+    """A prefix index of the names of a L{Gazetteer}'s places.
+
+    The folded locality names (see L{fold}) are kept sorted, so the places
+    with a name, or a name prefix, are a range found by binary search, the
+    places of a name sorted by decreasing population. Regions and countries
+    are found by their exact folded name, or country code, and resolve to
+    their most populated place.
+    """
+
+    def __init__(self, gazetteer):
+        self.gazetteer = gazetteer
+        # (folded region, country code or None) and country name or code
+        # to (population, index, country code)
+        self.regions = {}
+        self.countries = {}
+
+        # the regions and countries repeat, fold them once
+        folded = {}
+        def fold_cached(name):
+            value = folded.get(name)
+            if value is None:
+                value = folded[name] = fold(name)
+            return value
+
+        localities = []
+        for index in xrange(len(gazetteer)):
+            place = gazetteer.place(index)
+            population = place['population']
+            code = place['countrycode'].lower()
+            value = (population, index, code)
+            localities.append((fold(place['name']).encode("utf-8"), -population, index))
+            region = fold_cached(place['region'])
+            if region:
+                self.__best(self.regions, (region, code), value)
+                self.__best(self.regions, (region, None), value)
+            if code:
+                self.__best(self.countries, code, value)
+            if place['country']:
+                self.__best(self.countries, fold_cached(place['country']), value)
+
+        localities.sort()
+        self.keys = [locality[0] for locality in localities]
+        self.indexes = array.array('I', [locality[2] for locality in localities])
+
+    def __best(self, table, key, value):
+        if table.get(key, (-1,))[0] < value[0]:
+            table[key] = value
+
+    def __range(self, name, prefix=False):
+        key = fold(name).encode("utf-8")
+        first = bisect.bisect_left(self.keys, key)
+        if prefix:
+            # 0xff is not valid UTF-8, so it sorts after every name
+            stop = bisect.bisect_left(self.keys, key + "\xff", first)
+            stop = min(stop, first + MAX_PREFIX_MATCHES)
+        else:
+            stop = bisect.bisect_right(self.keys, key, first)
+        return self.indexes[first:stop]
+
+    def __country_code(self, address):
+        for key in ('countrycode', 'country'):
+            value = fold(address.get(key) or u"")
+            if value and self.countries.has_key(value):
+                return self.countries[value][2]
+        return None
+
+    def complete(self, prefix, limit=10):
+        """Returns the most populated places whose name starts with a prefix.
+
+        @param prefix: The beginning of the name.
+        @param limit: The maximum number of places.
+        @return: A list of place dictionaries, see L{Gazetteer.place}.
+        """
+        if not fold(prefix):
+            return []
+        places = [self.gazetteer.place(index) for index in self.__range(prefix, True)]
+        places.sort(key=lambda place: -place['population'])
+        return places[:limit]
+
+    def find(self, address):
+        """Finds the place of an address.
+
+        The locality is searched first, as an exact name and then as a name
+        prefix, restricted to the address's country, if known, and
+        preferably in its region. Without a locality the region and then the
+        country are searched.
+
+        @param address: An address dictionary, see
+        L{DiscoverLocation.validate_address}.
+        @return: A C{(place, accuracy level)} tuple, the place as returned by
+        L{Gazetteer.place}, or C{None}.
+        """
+        code = self.__country_code(address)
+        region = fold(address.get('region') or u"")
+        locality = address.get('locality') or u""
+
+        if fold(locality):
+            for prefix in (False, True):
+                found = None
+                for index in self.__range(locality, prefix):
+                    place = self.gazetteer.place(index)
+                    if code is not None and place['countrycode'].lower() != code:
+                        continue
+                    if not region or fold(place['region']) == region:
+                        return (place, geoclue.ACCURACY_LEVEL_LOCALITY)
+                    if found is None:
+                        found = place
+                if found is not None:
+                    return (found, geoclue.ACCURACY_LEVEL_LOCALITY)
+
+        if region and self.regions.has_key((region, code)):
+            index = self.regions[(region, code)][1]
+            return (self.gazetteer.place(index), geoclue.ACCURACY_LEVEL_REGION)
+
+        if code is not None:
+            index = self.countries[code][1]
+            return (self.gazetteer.place(index), geoclue.ACCURACY_LEVEL_COUNTRY)
+        return None
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+
+import Distance
+from Signal import Signal
+
+# km per degree of latitude
+KM_PER_DEGREE = Distance.EARTH_RADIUS * math.pi / 180
+
+class Geofence:
+    """A circular region around a position."""
+
+    def __init__(self, name, latitude, longitude, radius):
+        """Construct a L{Geofence} object.
+
+        @param name: The name of the fence.
+        @param latitude: The latitude of the center.
+        @param longitude: The longitude of the center.
+        @param radius: The radius, in km.
+        """
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+
+    def contains(self, latitude, longitude):
+        """Checks if a position is inside the fence.
+
+        @return: C{True} if the position is inside the fence.
+        """
+        return Distance.distance(self.latitude, self.longitude,
+                                 latitude, longitude) <= self.radius
+
+class GeofenceRegistry:
+    """Tracks which geofences contain the current position.
+
+    The fences are kept in a latitude/longitude grid, each fence is stored
+    in every cell it overlaps, so a position update only checks the fences
+    of the cell the position falls in, no matter how many fences exist.
+
+    Every time the set of fences that contain the position changes the
+    registry's signal is emitted with the sets of entered and exited fence
+    names.
+    """
+
+    def __init__(self, cell_size=0.1):
+        """Construct a L{GeofenceRegistry} object.
+
+        @param cell_size: The size of the grid cells, in degrees. It should
+        be about the size of the fences' diameter. It is rounded to the
+        closest divisor of 360, so the columns wrap around the
+        antimeridian, ie. 0.7 is 360 / 514.
+        """
+        if cell_size <= 0:
+            raise ValueError("the cell size must be positive")
+        self.__columns = max(int(round(360 / float(cell_size))), 1)
+        self.cell_size = 360.0 / self.__columns
+        self.signal = Signal()
+
+        self.__fences = {}
+        self.__fence_cells = {}
+        self.__cells = {}
+        self.__inside = set()
+
+    def __len__(self):
+        return len(self.__fences)
+
+    def __cell(self, latitude, longitude):
+        row = int(math.floor(latitude / self.cell_size))
+        column = int(math.floor((longitude + 180) / self.cell_size)) % self.__columns
+        return (row, column)
+
+    def __covered_cells(self, fence):
+        # every cell overlapped by the bounding box of the fence
+        span = fence.radius / KM_PER_DEGREE
+        south = max(fence.latitude - span, -90.0)
+        north = min(fence.latitude + span, 90.0)
+        first_row = int(math.floor(south / self.cell_size))
+        last_row = int(math.floor(north / self.cell_size))
+
+        cos_lat = math.cos(math.radians(max(abs(south), abs(north))))
+        if cos_lat < 1e-9 or span / cos_lat >= 180:
+            columns = xrange(self.__columns)
+        else:
+            lon_span = span / cos_lat
+            first = int(math.floor((fence.longitude - lon_span + 180) / self.cell_size))
+            last = int(math.floor((fence.longitude + lon_span + 180) / self.cell_size))
+            columns = set([column % self.__columns for column in xrange(first, last + 1)])
+
+        cells = []
+        for row in xrange(first_row, last_row + 1):
+            for column in columns:
+                cells.append((row, column))
+        return cells
+
+    def add(self, name, latitude, longitude, radius=0.5):
+        """Adds a fence, replacing any fence with the same name.
+
+        @param name: The name of the fence.
+        @param latitude: The latitude of the center.
+        @param longitude: The longitude of the center.
+        @param radius: The radius, in km. The default is 500 meters.
+        @return: The new L{Geofence}.
+        """
+        if self.__fences.has_key(name):
+            self.remove(name)
+
+        fence = Geofence(name, latitude, longitude, radius)
+        cells = self.__covered_cells(fence)
+        for cell in cells:
+            self.__cells.setdefault(cell, set()).add(name)
+        self.__fences[name] = fence
+        self.__fence_cells[name] = cells
+        return fence
+
+    def remove(self, name):
+        """Removes a fence.
+
+        The fence is dropped without emitting an exit.
+
+        @param name: The name of the fence.
+        @return: C{True} if the fence existed or C{False} otherwise.
+        """
+        if not self.__fences.has_key(name):
+            return False
+
+        for cell in self.__fence_cells.pop(name):
+            names = self.__cells[cell]
+            names.discard(name)
+            if not names:
+                del self.__cells[cell]
+        del self.__fences[name]
+        self.__inside.discard(name)
+        return True
+
+    def get_fence(self, name):
+        """Returns the L{Geofence} with the given C{name} or C{None}."""
+        return self.__fences.get(name)
+
+    def get_fences(self):
+        """Returns a list with all the fences."""
+        return self.__fences.values()
+
+    def get_inside(self):
+        """Returns the names of the fences that contain the current position."""
+        return frozenset(self.__inside)
+
+    def find(self, latitude, longitude):
+        """Returns the names of the fences that contain a position.
+
+        @param latitude: The latitude of the position.
+        @param longitude: The longitude of the position.
+        """
+        candidates = self.__cells.get(self.__cell(latitude, longitude), ())
+        fences = self.__fences
+        return set([name for name in candidates
+                    if fences[name].contains(latitude, longitude)])
+
+    def update(self, latitude, longitude):
+        """Moves the current position.
+
+        @param latitude: The new latitude.
+        @param longitude: The new longitude.
+        @return: A C{(entered, exited)} tuple with the sets of fence names.
+        """
+        inside = self.find(latitude, longitude)
+        entered = inside - self.__inside
+        exited = self.__inside - inside
+        self.__inside = inside
+
+        if entered or exited:
+            self.signal(entered, exited)
+        return (entered, exited)
+
+    def attach(self, location):
+        """Follows the position of a L{DiscoverLocation}.
+
+        @param location: The L{DiscoverLocation} instance.
+        @return: The connection id of the location's signal.
+        """
+        def on_location_changed():
+            info = location.get_location_info()
+            if info.has_key('latitude') and info.has_key('longitude'):
+                self.update(info['latitude'], info['longitude'])
+        return location.connect(on_location_changed)
+
+    def connect(self, func):
+        """Connects a given function to the signal.
+        The signal is emitted with the C{(entered, exited)} sets of fence names.
+
+        @param func: The function to connect to the signal.
+        """
+        return self.signal.connect(func)
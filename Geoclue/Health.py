@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+import gobject
+
+import geoclue
+import Async
+import Metrics
+
+class ProviderHealth:
+    """The last known status of a provider and its polling statistics."""
+
+    def __init__(self, name):
+        self.name = name
+        self.status = None
+        self.updated = None
+        self.polls = 0
+        self.errors = 0
+        self.last_error = None
+        self.latency_last = None
+        self.latency_min = None
+        self.latency_max = None
+        self.latency_total = 0.0
+
+    def add_latency(self, latency):
+        self.polls += 1
+        self.latency_last = latency
+        self.latency_total += latency
+        if self.latency_min is None or latency < self.latency_min:
+            self.latency_min = latency
+        if self.latency_max is None or latency > self.latency_max:
+            self.latency_max = latency
+
+    def to_dict(self):
+        """Returns the health as a dictionary, latencies are in seconds."""
+        tmp = {}
+        tmp['name'] = self.name
+        tmp['status'] = self.status
+        tmp['updated'] = self.updated
+        tmp['polls'] = self.polls
+        tmp['errors'] = self.errors
+        tmp['last_error'] = self.last_error
+        tmp['latency_last'] = self.latency_last
+        tmp['latency_min'] = self.latency_min
+        tmp['latency_max'] = self.latency_max
+        if self.polls:
+            tmp['latency_mean'] = self.latency_total / self.polls
+        else:
+            tmp['latency_mean'] = None
+        return tmp
+
+class ProviderHealthMonitor:
+    """Polls the status of every provider concurrently.
+
+    All the C{GetStatus} calls of a round are sent at once and their
+    replies are collected by the main loop. The C{StatusChanged} signals
+    of the providers also update the table between rounds, so reading the
+    status of a provider never makes a D-Bus call.
+    """
+
+    def __init__(self, providers, interval=30):
+        """Construct a L{ProviderHealthMonitor} object.
+
+        @param providers: A list of L{geoclue.GeoclueProvider} objects.
+        @param interval: The time between polling rounds, in seconds.
+        """
+        self.providers = list(providers)
+        self.interval = interval
+        self.__table = {}
+        self.__in_flight = {}
+        self.__matches = []
+        self.__source = None
+
+        for provider in self.providers:
+            self.__table[provider.name] = ProviderHealth(provider.name)
+
+    def start(self):
+        """Polls the providers now and then every C{interval} seconds."""
+        if self.__source is not None:
+            return
+        self.__subscribe()
+        self.poll()
+        self.__source = gobject.timeout_add(int(self.interval * 1000), self.__on_timeout)
+
+    def stop(self):
+        """Stops polling and listening to the status signals."""
+        if self.__source is not None:
+            gobject.source_remove(self.__source)
+            self.__source = None
+        for match in self.__matches:
+            match.remove()
+        self.__matches = []
+
+    def __on_timeout(self):
+        self.poll()
+        return True
+
+    def __subscribe(self):
+        for provider in self.providers:
+            try:
+                obj = provider.get_interface(geoclue.GEOCLUE_IFACE, introspect=False)
+                match = obj.connect_to_signal("StatusChanged",
+                                              self.__on_status_changed(provider.name))
+                self.__matches.append(match)
+            except Exception, e:
+                # not every provider is running, the polls will report it
+                self.__table[provider.name].last_error = str(e)
+
+    def __on_status_changed(self, name):
+        def callback(status):
+            health = self.__table[name]
+            health.status = geoclue.STATUS_NAMES.get(status, "error")
+            health.updated = time.time()
+        return callback
+
+    def poll(self):
+        """Sends a C{GetStatus} call to every provider without waiting.
+
+        Providers whose previous call did not return yet are skipped.
+
+        @return: A L{Async.Pending} object that finishes when every reply
+        of this round arrived.
+        """
+        pendings = []
+        for provider in self.providers:
+            if self.__in_flight.has_key(provider.name):
+                continue
+            try:
+                obj = provider.get_interface(geoclue.GEOCLUE_IFACE, introspect=False)
+            except Exception, e:
+                health = self.__table[provider.name]
+                health.errors += 1
+                health.status = "error"
+                health.last_error = str(e)
+                continue
+            pending = Metrics.get_metrics().track("GetStatus", provider.name,
+                                                  Async.call(obj.GetStatus))
+            self.__in_flight[provider.name] = pending
+            pending.add_callback(self.__on_reply(provider.name, time.time()))
+            pendings.append(pending)
+
+        # the round is done when every call finished, failed or not
+        done = Async.Pending()
+        remaining = [len(pendings)]
+        def on_done(pending):
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set_result()
+        if not pendings:
+            done.set_result()
+        for pending in pendings:
+            pending.add_callback(on_done)
+        return done
+
+    def __on_reply(self, name, sent):
+        def callback(pending):
+            self.__in_flight.pop(name, None)
+            health = self.__table[name]
+            health.add_latency(time.time() - sent)
+            health.updated = time.time()
+            if pending.error is not None:
+                health.errors += 1
+                health.status = "error"
+                health.last_error = str(pending.error)
+            else:
+                health.status = geoclue.STATUS_NAMES.get(pending.result, "error")
+        return callback
+
+    def get_status(self, name):
+        """Returns the last known status name of a provider, or C{None}."""
+        health = self.__table.get(name)
+        if health is None:
+            return None
+        return health.status
+
+    def get_health(self, name):
+        """Returns the health dictionary of a provider, or C{None}."""
+        health = self.__table.get(name)
+        if health is None:
+            return None
+        return health.to_dict()
+
+    def get_table(self):
+        """Returns a dictionary with the health of every provider."""
+        tmp = {}
+        for name, health in self.__table.items():
+            tmp[name] = health.to_dict()
+        return tmp
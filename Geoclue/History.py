@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import mmap
+import struct
+
+from Location import LocationFix, _accuracy
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = "GCHIST"
+VERSION = 1
+
+# magic, version, record size, number of slots, number of fixes ever written
+HEADER = struct.Struct("<6sHIQQ")
+HEADER_SIZE = 64
+
+# timestamp, latitude, longitude, altitude, horizontal and vertical
+# accuracy, fields, accuracy level
+RECORD = struct.Struct("<ddddddii")
+
+if numpy is not None:
+    RECORD_DTYPE = numpy.dtype([('timestamp', '<f8'), ('latitude', '<f8'),
+                                ('longitude', '<f8'), ('altitude', '<f8'),
+                                ('horizontal_accuracy', '<f8'),
+                                ('vertical_accuracy', '<f8'),
+                                ('fields', '<i4'), ('accuracy_level', '<i4')])
+
+class HistoryRecorder:
+    """A fixed size, memory mapped ring buffer of position fixes.
+
+    The fixes are kept in a binary file, so the history survives restarts
+    of the process. When the buffer is full the oldest fix is overwritten.
+    The file has a slot more than the fixes it keeps, the next fix is
+    written to that spare slot, which is never one of the fixes, and the
+    counter written after it adds the new fix and drops the oldest one.
+    The fixes are expected in timestamp order, which is what makes the
+    time range queries a binary search.
+
+    A recorder has the same C{append} method as L{Location.FixHistory},
+    so it can be given to L{DiscoverLocation.record_history}.
+    """
+
+    def __init__(self, path, capacity=86400):
+        """Construct a L{HistoryRecorder} object.
+
+        @param path: The path to the history file, it is created if it does
+        not exist.
+        @param capacity: The maximum number of fixes of a new file. An
+        existing file keeps its own capacity.
+        """
+        self.path = path
+
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            if capacity < 1:
+                raise ValueError("the capacity must be at least 1")
+            f = open(path, "wb")
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, capacity + 1, 0).ljust(HEADER_SIZE, "\0"))
+            f.truncate(HEADER_SIZE + (capacity + 1) * RECORD.size)
+            f.close()
+
+        self.__file = open(path, "r+b")
+        header = self.__file.read(HEADER.size)
+        (magic, version, record_size, slots, total) = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size or slots < 2:
+            self.__file.close()
+            raise ValueError("%s is not a position history file" % path)
+        if os.path.getsize(path) < HEADER_SIZE + slots * record_size:
+            self.__file.close()
+            raise ValueError("%s is truncated" % path)
+
+        self.slots = slots
+        self.capacity = slots - 1
+        self.total = total
+        self.map = mmap.mmap(self.__file.fileno(), HEADER_SIZE + slots * RECORD.size)
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def __offset(self, index):
+        # file offset of the fix at a logical index, 0 is the oldest fix
+        length = len(self)
+        if index < 0:
+            index += length
+        if index < 0 or index >= length:
+            raise IndexError("fix index out of range")
+        slot = (self.total - length + index) % self.slots
+        return HEADER_SIZE + slot * RECORD.size
+
+    def __getitem__(self, index):
+        (timestamp, latitude, longitude, altitude, horizontal, vertical,
+         fields, level) = RECORD.unpack_from(self.map, self.__offset(index))
+        return LocationFix(fields, timestamp, latitude, longitude, altitude,
+                           (level, horizontal, vertical))
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+    def timestamp(self, index):
+        """Returns the timestamp of the fix at a logical index."""
+        return struct.unpack_from("<d", self.map, self.__offset(index))[0]
+
+    def append(self, fix):
+        """Adds a L{Location.LocationFix}, overwriting the oldest one if full."""
+        (level, horizontal, vertical) = _accuracy(fix.accuracy)
+        # the spare slot, the fix before the oldest one
+        slot = self.total % self.slots
+        RECORD.pack_into(self.map, HEADER_SIZE + slot * RECORD.size,
+                         float(fix.timestamp), float(fix.latitude),
+                         float(fix.longitude), float(fix.altitude),
+                         horizontal, vertical, int(fix.fields), level)
+        # the counter is written after the record, a crash in between
+        # loses the fix instead of exposing a partial one, the other fixes
+        # are untouched
+        self.total += 1
+        struct.pack_into("<Q", self.map, HEADER.size - 8, self.total)
+
+    def __bisect(self, timestamp, right):
+        low = 0
+        high = len(self)
+        while low < high:
+            middle = (low + high) // 2
+            value = self.timestamp(middle)
+            if value < timestamp or (right and value == timestamp):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find_range(self, start=None, end=None):
+        """Returns the logical indexes of the fixes in a time range.
+
+        @param start: The first timestamp, or C{None} for the oldest fix.
+        @param end: The last timestamp (included), or C{None} for the newest.
+        @return: A C{(first, stop)} tuple, the fixes are C{first <= i < stop}.
+        """
+        if start is None:
+            first = 0
+        else:
+            first = self.__bisect(start, False)
+        if end is None:
+            stop = len(self)
+        else:
+            stop = self.__bisect(end, True)
+        return (first, max(first, stop))
+
+    def range(self, start=None, end=None):
+        """Returns the fixes in a time range.
+
+        @see: L{find_range}
+        @return: A list of L{Location.LocationFix} objects.
+        """
+        (first, stop) = self.find_range(start, end)
+        return [self[index] for index in xrange(first, stop)]
+
+    def as_numpy(self, start=None, end=None):
+        """Returns the fixes in a time range as NumPy record arrays.
+
+        The arrays are views of the memory mapped file, nothing is copied.
+        Since the fixes of a range may wrap around the end of the ring
+        buffer there can be two arrays, the concatenation of the list is
+        the range in chronological order.
+
+        @see: L{find_range}
+        @return: A list with zero, one or two arrays.
+        """
+        if numpy is None:
+            raise ImportError("as_numpy needs NumPy")
+        (first, stop) = self.find_range(start, end)
+        if first == stop:
+            return []
+
+        base = self.total - len(self)
+        first_slot = (base + first) % self.slots
+        count = stop - first
+        segments = []
+        while count > 0:
+            length = min(count, self.slots - first_slot)
+            segments.append(numpy.frombuffer(self.map, dtype=RECORD_DTYPE, count=length,
+                                             offset=HEADER_SIZE + first_slot * RECORD.size))
+            count -= length
+            first_slot = 0
+        return segments
+
+    def clear(self):
+        """Removes every fix."""
+        self.total = 0
+        struct.pack_into("<Q", self.map, HEADER.size - 8, self.total)
+
+    def flush(self):
+        """Writes the changes to the disk."""
+        self.map.flush()
+
+    def close(self):
+        """Flushes and closes the history file."""
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+            self.__file.close()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import array
+from collections import namedtuple
+
+import geoclue
+
+class LocationFix(namedtuple('LocationFix',
+                  'fields timestamp latitude longitude altitude accuracy')):
+    """An immutable position fix.
+
+    The fields are the arguments of the C{PositionChanged} signal, the
+    accuracy is the C{(level, horizontal, vertical)} tuple.
+    """
+    __slots__ = ()
+
+    def has_position(self):
+        """Returns C{True} if the latitude and longitude are valid."""
+        return (self.fields & geoclue.POSITION_FIELDS_LATITUDE) != 0 and \
+               (self.fields & geoclue.POSITION_FIELDS_LONGITUDE) != 0
+
+    def has_altitude(self):
+        """Returns C{True} if the altitude is valid."""
+        return (self.fields & geoclue.POSITION_FIELDS_ALTITUDE) != 0
+
+    def to_dict(self):
+        """Returns the fix with the keys used by the location info dictionary."""
+        tmp = {}
+        tmp['position_timestamp'] = self.timestamp
+        tmp['latitude'] = self.latitude
+        tmp['longitude'] = self.longitude
+        tmp['altitude'] = self.altitude
+        return tmp
+
+def _accuracy(accuracy):
+    # (level, horizontal, vertical), missing parts are 0
+    if accuracy is None:
+        return (0, 0.0, 0.0)
+    accuracy = tuple(accuracy) + (0, 0.0, 0.0)[len(accuracy):]
+    return (int(accuracy[0]), float(accuracy[1]), float(accuracy[2]))
+
+class FixHistory:
+    """A columnar, append only history of position fixes.
+
+    Every field is kept in its own C{array.array}, 56 bytes per fix, two
+    32 bit integers and six doubles, instead of a dictionary per fix.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        return self.snapshot()[index]
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def clear(self):
+        """Removes all the fixes.
+
+        Existing snapshots keep the fixes they had.
+        """
+        self.fields = array.array('i')
+        self.timestamps = array.array('d')
+        self.latitudes = array.array('d')
+        self.longitudes = array.array('d')
+        self.altitudes = array.array('d')
+        self.accuracy_levels = array.array('i')
+        self.horizontal_accuracies = array.array('d')
+        self.vertical_accuracies = array.array('d')
+
+    def append(self, fix):
+        """Adds a L{LocationFix} to the history."""
+        (level, horizontal, vertical) = _accuracy(fix.accuracy)
+        self.fields.append(int(fix.fields))
+        self.timestamps.append(float(fix.timestamp))
+        self.latitudes.append(float(fix.latitude))
+        self.longitudes.append(float(fix.longitude))
+        self.altitudes.append(float(fix.altitude))
+        self.accuracy_levels.append(level)
+        self.horizontal_accuracies.append(horizontal)
+        self.vertical_accuracies.append(vertical)
+
+    def snapshot(self):
+        """Returns a read only view of the current fixes.
+
+        The view shares the columns of the history, nothing is copied.
+        Fixes appended later are not part of the view.
+
+        @return: A L{FixHistoryView} object.
+        """
+        return FixHistoryView(self, len(self))
+
+class FixHistoryView:
+    """A read only view of the first fixes of a L{FixHistory}."""
+
+    def __init__(self, history, length):
+        self.length = length
+        self.fields = history.fields
+        self.timestamps = history.timestamps
+        self.latitudes = history.latitudes
+        self.longitudes = history.longitudes
+        self.altitudes = history.altitudes
+        self.accuracy_levels = history.accuracy_levels
+        self.horizontal_accuracies = history.horizontal_accuracies
+        self.vertical_accuracies = history.vertical_accuracies
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError("fix index out of range")
+        return LocationFix(self.fields[index], self.timestamps[index],
+                           self.latitudes[index], self.longitudes[index],
+                           self.altitudes[index],
+                           (self.accuracy_levels[index],
+                            self.horizontal_accuracies[index],
+                            self.vertical_accuracies[index]))
+
+    def __iter__(self):
+        for index in xrange(self.length):
+            yield self[index]
+
+    def as_numpy(self):
+        """Returns copies of the columns as NumPy arrays.
+
+        The columns are copied since appending to the history may move
+        them in memory, one copy per column.
+
+        @return: A dictionary of arrays, keyed by column name.
+        """
+        # NumPy is only imported when needed, it is slow to import
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("as_numpy needs NumPy")
+        tmp = {}
+        for name, dtype in (('fields', numpy.int32),
+                            ('timestamps', numpy.float64),
+                            ('latitudes', numpy.float64),
+                            ('longitudes', numpy.float64),
+                            ('altitudes', numpy.float64),
+                            ('accuracy_levels', numpy.int32),
+                            ('horizontal_accuracies', numpy.float64),
+                            ('vertical_accuracies', numpy.float64)):
+            column = getattr(self, name)
+            # copied before anything can be appended to the column
+            tmp[name] = numpy.frombuffer(column, dtype=dtype, count=self.length).copy()
+        return tmp
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Latency and error metrics of the D-Bus calls and signals.
+
+The signal metrics are the time the handlers take, from the start of the
+handler to the end of the callbacks it runs. dbus-python does not tell when
+a signal arrived, so the time it waited in the main loop is not included.
+
+The metrics are disabled by default, then instrumented calls cost a single
+attribute check. Enable them with C{get_metrics().enabled = True} and
+export them with an exporter, ie. L{PrometheusExporter} or
+L{StatsdExporter}.
+"""
+
+import os
+import time
+import socket
+import bisect
+
+# upper bounds of the latency buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """A latency histogram with fixed buckets."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # the last count is for the values above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Returns the C{(upper bound, count)} pairs, the last bound is C{None}."""
+        tmp = []
+        total = 0
+        for i in xrange(len(self.counts)):
+            total += self.counts[i]
+            if i < len(self.buckets):
+                tmp.append((self.buckets[i], total))
+            else:
+                tmp.append((None, total))
+        return tmp
+
+class MetricsRegistry:
+    """Collects the call latencies, call and error counts and signal handler
+    times."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.enabled = False
+        self.buckets = buckets
+        self.exporters = []
+        self.reset()
+
+    def reset(self):
+        """Forgets every collected metric."""
+        self.calls = {}
+        self.errors = {}
+        self.handlers = {}
+
+    def call(self, method, provider, func, *args, **kwargs):
+        """Calls C{func} and records its latency and errors.
+
+        @param method: The D-Bus method name.
+        @param provider: The provider name.
+        @param func: The function to call.
+        @return: The result of C{func}, exceptions are recorded and raised.
+        """
+        if not self.enabled:
+            return func(*args, **kwargs)
+
+        start = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.observe_call(method, provider, time.time() - start, True)
+            raise
+        self.observe_call(method, provider, time.time() - start)
+        return result
+
+    def observe_call(self, method, provider, seconds, error=False):
+        """Records a finished call."""
+        key = (method, provider)
+        histogram = self.calls.get(key)
+        if histogram is None:
+            histogram = self.calls[key] = Histogram(self.buckets)
+        histogram.observe(seconds)
+        if error:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def count_error(self, method, provider):
+        """Counts an error that is not the failure of a timed call, ie. a
+        proxy that could not be created."""
+        if self.enabled:
+            key = (method, provider)
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def track(self, method, provider, pending):
+        """Records the latency and errors of an asynchronous call.
+
+        @param pending: The L{Async.Pending} object of the call.
+        @return: C{pending}.
+        """
+        if not self.enabled:
+            return pending
+
+        start = time.time()
+        def on_done(pending):
+            self.observe_call(method, provider, time.time() - start,
+                              pending.error is not None)
+        pending.add_callback(on_done)
+        return pending
+
+    def observe_handler(self, signal, seconds):
+        """Records the time the handler of a signal took, with the callbacks
+        it ran."""
+        histogram = self.handlers.get(signal)
+        if histogram is None:
+            histogram = self.handlers[signal] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def add_exporter(self, exporter):
+        """Adds an exporter, see L{flush}."""
+        self.exporters.append(exporter)
+
+    def remove_exporter(self, exporter):
+        if exporter in self.exporters:
+            self.exporters.remove(exporter)
+
+    def flush(self):
+        """Sends the current metrics to every exporter."""
+        for exporter in self.exporters:
+            exporter.export(self)
+
+def _labels(**labels):
+    items = []
+    for key in sorted(labels.keys()):
+        value = unicode(labels[key]).replace('\\', '\\\\').replace('"', '\\"')
+        items.append('%s="%s"' % (key, value))
+    return "{" + ",".join(items) + "}"
+
+def _bound(bound):
+    if bound is None:
+        return "+Inf"
+    return repr(bound)
+
+def to_prometheus(metrics, prefix="geoclue"):
+    """Formats the metrics in the Prometheus text exposition format.
+
+    @param metrics: A L{MetricsRegistry} object.
+    @return: The text.
+    """
+    lines = []
+    lines.append("# TYPE %s_call_seconds histogram" % prefix)
+    for (method, provider), histogram in sorted(metrics.calls.items()):
+        for bound, count in histogram.cumulative():
+            lines.append("%s_call_seconds_bucket%s %d" % (prefix,
+                _labels(method=method, provider=provider, le=_bound(bound)), count))
+        labels = _labels(method=method, provider=provider)
+        lines.append("%s_call_seconds_sum%s %r" % (prefix, labels, histogram.sum))
+        lines.append("%s_call_seconds_count%s %d" % (prefix, labels, histogram.count))
+
+    lines.append("# TYPE %s_call_errors_total counter" % prefix)
+    for (method, provider), count in sorted(metrics.errors.items()):
+        lines.append("%s_call_errors_total%s %d" % (prefix,
+            _labels(method=method, provider=provider), count))
+
+    lines.append("# TYPE %s_handler_seconds histogram" % prefix)
+    for signal, histogram in sorted(metrics.handlers.items()):
+        for bound, count in histogram.cumulative():
+            lines.append("%s_handler_seconds_bucket%s %d" % (prefix,
+                _labels(signal=signal, le=_bound(bound)), count))
+        labels = _labels(signal=signal)
+        lines.append("%s_handler_seconds_sum%s %r" % (prefix, labels, histogram.sum))
+        lines.append("%s_handler_seconds_count%s %d" % (prefix, labels, histogram.count))
+    return "\n".join(lines) + "\n"
+
+class PrometheusExporter:
+    """Writes the metrics to a file in the Prometheus text format.
+
+    The file is replaced atomically, as expected by the node exporter's
+    textfile collector.
+    """
+
+    def __init__(self, path, prefix="geoclue"):
+        self.path = path
+        self.prefix = prefix
+
+    def export(self, metrics):
+        tmp_path = self.path + ".tmp"
+        f = open(tmp_path, "w")
+        try:
+            f.write(to_prometheus(metrics, self.prefix).encode("utf-8"))
+        finally:
+            f.close()
+        os.rename(tmp_path, self.path)
+
+class StatsdExporter:
+    """Sends the metrics to a statsd server over UDP.
+
+    Counters and timers are sent as the change since the previous export,
+    the timers as the mean latency of the new calls, in milliseconds.
+    """
+
+    def __init__(self, host="localhost", port=8125, prefix="geoclue"):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__sent = {}
+
+    def __name(self, *parts):
+        return ".".join([self.prefix] + [str(part).replace(".", "_").replace(" ", "_")
+                                         for part in parts])
+
+    def lines(self, metrics):
+        """Returns the statsd lines with the changes since the last call."""
+        lines = []
+        for (method, provider), histogram in sorted(metrics.calls.items()):
+            self.__delta(lines, histogram, "call", method, provider)
+        for (method, provider), count in sorted(metrics.errors.items()):
+            key = ("error", method, provider)
+            delta = count - self.__sent.get(key, 0)
+            self.__sent[key] = count
+            if delta:
+                lines.append("%s:%d|c" % (self.__name("errors", provider, method), delta))
+        for signal, histogram in sorted(metrics.handlers.items()):
+            self.__delta(lines, histogram, "handler", signal)
+        return lines
+
+    def __delta(self, lines, histogram, kind, *names):
+        key = (kind,) + names
+        (count, total) = self.__sent.get(key, (0, 0.0))
+        self.__sent[key] = (histogram.count, histogram.sum)
+        if histogram.count > count:
+            name = self.__name(kind, *reversed(names))
+            mean = (histogram.sum - total) / (histogram.count - count)
+            lines.append("%s:%d|c" % (name + ".count", histogram.count - count))
+            lines.append("%s:%.3f|ms" % (name, mean * 1000))
+
+    def export(self, metrics):
+        for line in self.lines(metrics):
+            try:
+                self.socket.sendto(line, self.address)
+            except socket.error:
+                pass
+
+_metrics = MetricsRegistry()
+
+def get_metrics():
+    """Returns the process wide L{MetricsRegistry}."""
+    return _metrics
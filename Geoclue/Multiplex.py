@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Sharing of the Geoclue Master clients.
+
+Every Master client costs the Geoclue daemon its own providers setup and
+its own signals. The L{ClientMultiplexer} creates a single client per
+requirement set and hands out L{ClientHandle} objects, the updates of the
+shared client are fanned out to every handle in the process.
+"""
+
+import geoclue
+import Async
+import Metrics
+from Signal import Signal
+
+_metrics = Metrics.get_metrics()
+
+class ClientHandle:
+    """A subscriber of a shared Master client.
+
+    The handle's signals are emitted with the arguments of the D-Bus
+    signals, C{address_signal} as C{(timestamp, address, accuracy)} and
+    C{position_signal} as C{(fields, timestamp, latitude, longitude,
+    altitude, accuracy)}.
+    """
+
+    def __init__(self, shared):
+        self.shared = shared
+        self.address_signal = Signal()
+        self.position_signal = Signal()
+        self.closed = False
+
+    def get_ready(self):
+        """Returns the L{Async.Pending} of the shared client's setup.
+
+        It finishes when the client was created and both its address and
+        position reads finished, its result is C{True} if at least one of
+        them succeeded. It fails when the client could not be created or
+        started, or when both reads failed; a client that was created stays
+        shared, its signals may still come.
+        """
+        return self.shared.ready
+
+    def get_address(self):
+        """Returns the last C{(timestamp, address, accuracy)} or C{None}."""
+        return self.shared.address
+
+    def get_position(self):
+        """Returns the last position tuple or C{None}."""
+        return self.shared.position
+
+    def get_requirements(self):
+        """Returns the C{(accuracy, time, require_updates, resource)} tuple."""
+        return self.shared.requirements
+
+    def close(self):
+        """Unsubscribes, the shared client is dropped with its last handle."""
+        if not self.closed:
+            self.closed = True
+            self.shared.multiplexer.release(self)
+
+class SharedClient:
+    """A Master client and the handles sharing it."""
+
+    def __init__(self, multiplexer, requirements):
+        self.multiplexer = multiplexer
+        self.requirements = requirements
+        self.handles = []
+        self.client = None
+        self.address = None
+        self.position = None
+        self.ready = Async.Pending()
+        self.__matches = []
+        self.__closed = False
+
+    def start(self, bus):
+        """Creates the client, the replies are handled by the main loop."""
+        try:
+            master = bus.get_object(geoclue.MASTER_IFACE, geoclue.MASTER_PATH)
+        except Exception, e:
+            self.ready.set_error(e)
+            return
+        Async.call(master.Create, dbus_interface=geoclue.MASTER_IFACE).add_callback(
+            lambda pending: self.__on_created(bus, pending))
+
+    def __on_created(self, bus, pending):
+        if self.__closed:
+            return
+        if pending.error is not None:
+            self.ready.set_error(pending.error)
+            return
+
+        try:
+            self.client = bus.get_object(geoclue.MASTER_IFACE, pending.result, introspect=False)
+            self.__matches.append(self.client.connect_to_signal(
+                "AddressChanged", self.__on_address_changed, dbus_interface=geoclue.ADDRESS_IFACE))
+            self.__matches.append(self.client.connect_to_signal(
+                "PositionChanged", self.__on_position_changed, dbus_interface=geoclue.POSITION_IFACE))
+        except Exception, e:
+            self.ready.set_error(e)
+            return
+
+        (accuracy, time, require_updates, resource) = self.requirements
+        Async.gather([
+            Async.call(self.client.AddressStart, dbus_interface=geoclue.MASTER_CLIENT_IFACE),
+            Async.call(self.client.PositionStart, dbus_interface=geoclue.MASTER_CLIENT_IFACE),
+            Async.call(self.client.SetRequirements, accuracy, time, require_updates, resource,
+                       dbus_interface=geoclue.MASTER_CLIENT_IFACE),
+        ]).add_callback(self.__on_started)
+
+        reads = [
+            _metrics.track("GetAddress", "master",
+                           Async.call(self.client.GetAddress, dbus_interface=geoclue.ADDRESS_IFACE)),
+            _metrics.track("GetPosition", "master",
+                           Async.call(self.client.GetPosition, dbus_interface=geoclue.POSITION_IFACE)),
+        ]
+        # like in DiscoverLocation.init_async, a failed read, ie. without
+        # an address provider, does not fail the client while the other
+        # one may succeed
+        remaining = [len(reads)]
+        errors = []
+        def on_read(pending):
+            remaining[0] -= 1
+            if pending.error is not None:
+                errors.append(pending.error)
+            elif pending is reads[0]:
+                self.__on_address_changed(*pending.result)
+            else:
+                self.__on_position_changed(*pending.result)
+            if remaining[0] > 0 or self.__closed:
+                return
+            if len(errors) == len(reads):
+                self.ready.set_error(errors[0])
+            else:
+                self.ready.set_result(True)
+        for read in reads:
+            read.add_callback(on_read)
+
+    def __on_started(self, pending):
+        if pending.error is not None:
+            self.ready.set_error(pending.error)
+
+    def __on_address_changed(self, *args):
+        self.address = args
+        for handle in tuple(self.handles):
+            handle.address_signal(*args)
+
+    def __on_position_changed(self, *args):
+        self.position = args
+        for handle in tuple(self.handles):
+            handle.position_signal(*args)
+
+    def close(self):
+        """Stops listening to the client's signals and releases the client.
+
+        The daemon is told to drop the client, without waiting for the
+        reply.
+        """
+        self.__closed = True
+        for match in self.__matches:
+            match.remove()
+        self.__matches = []
+        if self.client is not None:
+            _metrics.track("RemoveReference", "master",
+                           Async.call(self.client.RemoveReference,
+                                      dbus_interface=geoclue.GEOCLUE_IFACE))
+            self.client = None
+
+class ClientMultiplexer:
+    """Shares one Master client per requirement set.
+
+    The clients are reference counted by their handles, a client is
+    dropped when its last handle is closed.
+    """
+
+    def __init__(self, bus=None):
+        """Construct a L{ClientMultiplexer} object.
+
+        @param bus: The D-Bus connection, by default the session bus of
+        L{geoclue.get_pool}.
+        """
+        self.bus = bus
+        self.clients = {}
+
+    def acquire(self, accuracy=geoclue.ACCURACY_LEVEL_COUNTRY,
+                resource=geoclue.RESOURCE_NETWORK, time=0, require_updates=True):
+        """Returns a handle of the client for a requirement set.
+
+        The client is created by the first handle, the next ones share it
+        and get its last address and position right away.
+
+        @param accuracy: The desired accuracy.
+        @param resource: The resources to be used.
+        @param time: The minimum time between updates, in seconds.
+        @param require_updates: C{True} to get the update signals.
+        @return: A L{ClientHandle}.
+        """
+        requirements = (int(accuracy), int(time), bool(require_updates), int(resource))
+        shared = self.clients.get(requirements)
+        if shared is not None:
+            handle = ClientHandle(shared)
+            shared.handles.append(handle)
+            return handle
+
+        if self.bus is None:
+            self.bus = geoclue.get_pool().get_bus()
+        shared = SharedClient(self, requirements)
+        self.clients[requirements] = shared
+        handle = ClientHandle(shared)
+        shared.handles.append(handle)
+
+        # a client that could not be created is not shared, the next
+        # acquire tries again, a created one is kept while it has handles
+        def on_ready(pending):
+            if pending.error is not None and shared.client is None and \
+                    self.clients.get(requirements) is shared:
+                del self.clients[requirements]
+        shared.ready.add_callback(on_ready)
+        shared.start(self.bus)
+        return handle
+
+    def release(self, handle):
+        """Removes a handle, the same as L{ClientHandle.close}."""
+        shared = handle.shared
+        handle.closed = True
+        if handle in shared.handles:
+            shared.handles.remove(handle)
+        if not shared.handles:
+            shared.close()
+            if self.clients.get(shared.requirements) is shared:
+                del self.clients[shared.requirements]
+
+    def stats(self):
+        """Returns a dictionary with the number of 'clients' and 'handles'."""
+        tmp = {}
+        tmp['clients'] = len(self.clients)
+        tmp['handles'] = sum([len(shared.handles) for shared in self.clients.values()])
+        return tmp
+
+_multiplexer = None
+
+def get_multiplexer():
+    """Returns the process wide L{ClientMultiplexer}."""
+    global _multiplexer
+    if _multiplexer is None:
+        _multiplexer = ClientMultiplexer()
+    return _multiplexer
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import geoclue
+import Catalog
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+DEFAULT_PROVIDERS_PATH = "/usr/share/geoclue-providers"
+
+class ProviderRegistry:
+    """The providers found in a directory of .provider files.
+
+    Nothing is read until the providers are requested. After that only the
+    files whose modification time changed are parsed again, and with
+    C{pyinotify} installed, see L{watch}, the directory is not even
+    scanned until a change is notified.
+    """
+
+    def __init__(self, providers_path=DEFAULT_PROVIDERS_PATH):
+        """Construct a L{ProviderRegistry} object.
+
+        @param providers_path: The path to the providers.
+        """
+        self.providers_path = providers_path
+        # incremented every time the list of providers changes
+        self.generation = 0
+
+        self.__files = {}
+        self.__providers = None
+        self.__catalog = None
+        self.__dirty = True
+        self.__notifier = None
+
+    def __on_event(self, event):
+        self.__dirty = True
+
+    def watch(self):
+        """Watches the directory for changes with inotify.
+
+        @return: C{True} if the directory is being watched or C{False} if
+        C{pyinotify} is not available.
+        """
+        if self.__notifier is not None:
+            return True
+        if pyinotify is None:
+            return False
+
+        manager = pyinotify.WatchManager()
+        mask = pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_MODIFY | \
+            pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO
+        self.__notifier = pyinotify.Notifier(manager, self.__on_event, timeout=0)
+        manager.add_watch(self.providers_path, mask)
+        self.__dirty = True
+        return True
+
+    def __changed(self):
+        if self.__notifier is None:
+            return True
+        if self.__notifier.check_events(0):
+            self.__notifier.read_events()
+            self.__notifier.process_events()
+        return self.__dirty
+
+    def rescan(self):
+        """Looks for new, changed and removed .provider files.
+
+        @return: C{True} if the list of providers changed.
+        """
+        self.__dirty = False
+        files = {}
+        changed = False
+
+        for filename in sorted(os.listdir(self.providers_path)):
+            (name, ext) = os.path.splitext(filename)
+            if ext != ".provider":
+                continue
+
+            complete = os.path.join(self.providers_path, filename)
+            try:
+                mtime = os.stat(complete).st_mtime
+            except OSError:
+                continue
+
+            cached = self.__files.get(filename)
+            if cached is not None and cached[0] == mtime:
+                files[filename] = cached
+            else:
+                files[filename] = (mtime, geoclue.GeoclueProvider(complete))
+                changed = True
+
+        if changed or self.__providers is None or len(files) != len(self.__files):
+            self.__files = files
+            self.__providers = [files[filename][1] for filename in sorted(files.keys())]
+            self.generation += 1
+            return True
+        return False
+
+    def get_providers(self):
+        """Returns the list of L{geoclue.GeoclueProvider} objects.
+
+        The list is shared, it must not be modified.
+        """
+        if self.__providers is None or self.__changed():
+            self.rescan()
+        return self.__providers
+
+    def get_catalog(self):
+        """Returns the L{Catalog.ProviderCatalog} of the providers.
+
+        The catalog is only built again when the providers change.
+        """
+        providers = self.get_providers()
+        if self.__catalog is None or self.__catalog.generation != self.generation:
+            self.__catalog = Catalog.ProviderCatalog(providers, self.generation)
+        return self.__catalog
+
+_registries = {}
+
+def get_registry(providers_path=DEFAULT_PROVIDERS_PATH):
+    """Returns the process wide L{ProviderRegistry} of a directory.
+
+    @param providers_path: The path to the providers.
+    """
+    path = os.path.abspath(providers_path)
+    registry = _registries.get(path)
+    if registry is None:
+        registry = ProviderRegistry(path)
+        _registries[path] = registry
+    return registry
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Recording and replay of the Geoclue signals.
+
+A L{SignalRecorder} given to L{DiscoverLocation.record_signals} appends
+every incoming signal to a file, a L{Replayer} feeds the file back to the
+handlers of a L{DiscoverLocation}, so the consumers of its signals can be
+load tested without a Geoclue daemon:
+
+    python -m Geoclue.Replay record signals.rec
+    python -m Geoclue.Replay replay signals.rec --speed 10
+"""
+
+import os
+import sys
+import time
+import struct
+import marshal
+import optparse
+
+import gobject
+
+import geoclue
+
+MAGIC = "GCSIGS"
+VERSION = 1
+
+# magic, version
+HEADER = struct.Struct("<6sH")
+
+MARSHAL_VERSION = 2
+
+# the name of the record written when a recorder opens the file, its
+# argument is the wall clock time
+SESSION = ""
+
+# the signals of the Master client and the L{DiscoverLocation} methods
+# handling them
+HANDLERS = {
+    "AddressChanged": "on_address_changed",
+    "PositionChanged": "on_master_position_changed",
+}
+
+# the positions of every provider while fusing, handled by the location's
+# L{Fusion.PositionFusion}, their arguments are the provider's name and the
+# position
+PROVIDER_POSITION = "ProviderPositionChanged"
+
+# the start of the fusion, its argument is the maximum age, and its end
+ENABLE_FUSION = "EnableFusion"
+DISABLE_FUSION = "DisableFusion"
+
+def _monotonic_clock():
+    # clock_gettime(CLOCK_MONOTONIC), time.time where it is not available
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        librt = ctypes.CDLL(ctypes.util.find_library("rt") or "librt.so.1")
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        value = timespec()
+        pointer = ctypes.pointer(value)
+        if clock_gettime(1, pointer) != 0:
+            return time.time
+    except (ImportError, OSError, AttributeError):
+        return time.time
+
+    def monotonic():
+        clock_gettime(1, pointer)
+        return value.tv_sec + value.tv_nsec * 1e-9
+    return monotonic
+
+monotonic = _monotonic_clock()
+
+def _plain(value):
+    # the dbus types are subclasses, marshal only takes the exact types
+    if isinstance(value, dict):
+        return dict([(_plain(key), _plain(item)) for key, item in value.iteritems()])
+    if isinstance(value, (tuple, list)):
+        return tuple([_plain(item) for item in value])
+    if isinstance(value, unicode):
+        return unicode(value)
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, float):
+        return float(value)
+    if isinstance(value, (int, long)):
+        return int(value)
+    return value
+
+class SignalRecorder:
+    """Appends signals to a file.
+
+    Each record is the marshalled C{(timestamp, name, arguments)} tuple,
+    the timestamp is from a monotonic clock, in seconds. The file is only
+    appended to, a new recorder adds a L{SESSION} record and its signals
+    after the previous ones.
+    """
+
+    def __init__(self, path):
+        """Construct a L{SignalRecorder} object.
+
+        @param path: The path to the file, it is created if it does not
+        exist.
+        """
+        self.path = path
+        self.count = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            f = open(path, "rb")
+            try:
+                _check_header(f, path)
+            finally:
+                f.close()
+            self.__file = open(path, "ab")
+        else:
+            self.__file = open(path, "ab")
+            self.__file.write(HEADER.pack(MAGIC, VERSION))
+        self.__write(SESSION, (time.time(),))
+
+    def __write(self, name, args):
+        self.__file.write(marshal.dumps((monotonic(), name, args), MARSHAL_VERSION))
+
+    def record(self, name, args):
+        """Appends a signal.
+
+        @param name: The signal name, ie. C{"PositionChanged"}.
+        @param args: The tuple of the signal's arguments.
+        """
+        self.__write(name, _plain(args))
+        self.count += 1
+
+    def flush(self):
+        """Writes the buffered records to the file."""
+        self.__file.flush()
+
+    def close(self):
+        """Flushes and closes the file."""
+        if not self.__file.closed:
+            self.__file.close()
+
+def _check_header(f, path):
+    header = f.read(HEADER.size)
+    if len(header) != HEADER.size or HEADER.unpack(header) != (MAGIC, VERSION):
+        raise ValueError("%s is not a signal recording" % path)
+
+def read_records(path):
+    """Yields the C{(timestamp, name, arguments)} records of a file.
+
+    A record cut short, ie. by a crash while recording, ends the file.
+    """
+    f = open(path, "rb")
+    try:
+        _check_header(f, path)
+        while True:
+            try:
+                record = marshal.load(f)
+            except (EOFError, ValueError, TypeError):
+                return
+            yield record
+    finally:
+        f.close()
+
+def percentiles(values, points=(50, 90, 99)):
+    """Returns the nearest rank percentiles of some values.
+
+    @param values: A list of numbers.
+    @param points: The percentiles to compute.
+    @return: A dictionary keyed by C{'p50'}, ..., and C{'max'}, empty
+    without values.
+    """
+    tmp = {}
+    if not values:
+        return tmp
+    values = sorted(values)
+    for point in points:
+        rank = max(int(-(-point * len(values) // 100)) - 1, 0)
+        tmp['p%d' % point] = values[rank]
+    tmp['max'] = values[-1]
+    return tmp
+
+class Replayer:
+    """Feeds a recording to the handlers of a L{DiscoverLocation}."""
+
+    def __init__(self, location, path):
+        """Construct a L{Replayer} object.
+
+        @param location: The L{DiscoverLocation}, it does not need to be
+        initialized.
+        @param path: The path to the recording.
+        """
+        self.location = location
+        self.path = path
+
+    def __wait(self, deadline, iterate):
+        # the main loop keeps running while waiting, ie. for the consumers'
+        # timeouts
+        context = iterate and gobject.main_context_default()
+        while True:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return
+            if context and context.pending():
+                context.iteration(False)
+            else:
+                time.sleep(min(remaining, 0.001))
+
+    def __handler(self, name):
+        if name == PROVIDER_POSITION:
+            # the providers are only followed while fusing
+            fusion = self.location.fusion
+            return fusion is not None and fusion.on_provider_position or None
+        method = HANDLERS.get(name)
+        return method is not None and getattr(self.location, method) or None
+
+    def run(self, speed=1.0, iterate=True):
+        """Replays the recording and measures the handlers.
+
+        The signals are handled one after the other, the latency of a
+        signal is the time its handler took, including the callbacks of
+        the location's signals. The lag is how late a signal was handled,
+        compared to the recording. The fusion is enabled and disabled as
+        it was while recording, without following the providers, so the
+        Master positions are ignored in between and the recorded provider
+        positions are fused.
+
+        @param speed: The replay speed, 1.0 is the recorded pace, 10.0 is
+        ten times faster, C{None} or 0 handles the signals without waiting.
+        @param iterate: C{True} to run the main loop between the signals.
+        @return: A dictionary with the number of 'signals' and 'errors',
+        the 'elapsed' seconds, the 'throughput' in signals per second and
+        the 'latency' and 'lag' L{percentiles}.
+        """
+        latencies = []
+        lags = []
+        errors = 0
+        base = None
+        started = monotonic()
+        for (timestamp, name, args) in read_records(self.path):
+            if name == SESSION:
+                # the clock of another session, the time in between is skipped
+                base = None
+                continue
+            if name == ENABLE_FUSION:
+                self.location.enable_fusion(args[0], False)
+                continue
+            if name == DISABLE_FUSION:
+                self.location.disable_fusion()
+                continue
+            handler = self.__handler(name)
+            if handler is None:
+                continue
+            if speed:
+                if base is None:
+                    base = (timestamp, monotonic())
+                due = base[1] + (timestamp - base[0]) / speed
+                self.__wait(due, iterate)
+                lags.append(monotonic() - due)
+
+            start = monotonic()
+            try:
+                handler(*args)
+            except Exception:
+                errors += 1
+            latencies.append(monotonic() - start)
+        elapsed = monotonic() - started
+
+        tmp = {}
+        tmp['signals'] = len(latencies)
+        tmp['errors'] = errors
+        tmp['elapsed'] = elapsed
+        tmp['throughput'] = elapsed > 0 and len(latencies) / elapsed or 0.0
+        tmp['latency'] = percentiles(latencies)
+        tmp['lag'] = percentiles(lags)
+        return tmp
+
+def main(argv=None):
+    """Records the signals until interrupted, or replays a recording."""
+    parser = optparse.OptionParser(prog="python -m Geoclue.Replay",
+                                   usage="%prog record|replay FILE [options]")
+    parser.add_option("--accuracy", type="int", default=geoclue.ACCURACY_LEVEL_COUNTRY,
+                      help="desired accuracy level, when recording")
+    parser.add_option("--resource", type="int", default=geoclue.RESOURCE_NETWORK,
+                      help="resources to be used, when recording")
+    parser.add_option("--speed", type="float", default=1.0,
+                      help="replay speed, 0 for as fast as possible")
+    (options, args) = parser.parse_args(argv)
+    if len(args) != 2 or args[0] not in ("record", "replay"):
+        parser.error("expected record or replay and a file")
+    (command, path) = args
+
+    from Base import DiscoverLocation
+    location = DiscoverLocation()
+    if command == "replay":
+        report = Replayer(location, path).run(options.speed)
+        print "%d signals, %d errors, %.3f s, %.1f signals/s" % (
+            report['signals'], report['errors'], report['elapsed'], report['throughput'])
+        for key in ('latency', 'lag'):
+            values = report[key]
+            if values:
+                print "%-8s %s" % (key, "  ".join(["%s %.3f ms" % (point, values[point] * 1000)
+                                                   for point in ('p50', 'p90', 'p99', 'max')]))
+        return 0
+
+    recorder = SignalRecorder(path)
+    location.record_signals(recorder)
+    if not location.init(options.accuracy, options.resource):
+        print "Error: could not initialize Geoclue"
+        return 1
+    loop = gobject.MainLoop()
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        pass
+    location.stop_recording()
+    recorder.close()
+    print "%d signals recorded" % recorder.count
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,9 +14,19 @@
 # You should have received a copy of the GNU General Public License along with
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import random
+import weakref
+import itertools
+from collections import OrderedDict
 
 class Signal:
+    """A signal that calls the connected functions (slots) when emitted.
+
+    Connections are identified by increasing ids and kept in an ordered
+    table, so connecting and disconnecting are O(1). Emission iterates an
+    immutable snapshot of the slots, which is only rebuilt after the slots
+    change, so slots may connect or disconnect during an emission.
+    """
+
     class Slot:
         def __init__(self, func):
             self.__func = func
@@ -24,55 +34,133 @@ class Signal:
         def __call__(self, accum, *args, **kwargs):
             result = self.__func(*args, **kwargs)
             return accum(result)
-            
+
+    class WeakSlot:
+        # holds a bound method without keeping its object alive
+        def __init__(self, method, on_dead):
+            self.__func = method.im_func
+            self.__ref = weakref.ref(method.im_self, on_dead)
+
+        def __call__(self, accum, *args, **kwargs):
+            obj = self.__ref()
+            if obj is None:
+                return True
+            result = self.__func(obj, *args, **kwargs)
+            return accum(result)
+
     class Accumulator:
         def __call__(self, *args, **kwargs):
             return True
-            
+
         def finalize(self):
             return None
 
     def __init__(self):
-        self.__slots = []
-        
+        self.__slots = OrderedDict()
+        self.__keys = {}
+        self.__conn_keys = {}
+        self.__snapshot = ()
+        self.__ids = itertools.count(1)
+
+        # the default accumulator has no state, it can be shared by every emission
+        if self.Accumulator is Signal.Accumulator and \
+           self.create_accumulator.im_func is Signal.create_accumulator.im_func:
+            self.__accumulator = self.Accumulator()
+        else:
+            self.__accumulator = None
+
+    def __len__(self):
+        return len(self.__slots)
+
+    def __contains__(self, conn):
+        return self.__slots.has_key(conn)
+
     def create_accumulator(self):
         return self.Accumulator()
 
     # execute the slots
     def __call__(self, *args, **kwargs):
-        accum = self.create_accumulator()
-        for conn in xrange(len(self.__slots)):
-            if not self.__slots[conn][1](accum, *args, **kwargs):
+        accum = self.__accumulator
+        if accum is None:
+            accum = self.create_accumulator()
+        snapshot = self.__snapshot
+        if snapshot is None:
+            snapshot = self.__snapshot = tuple(self.__slots.values())
+        for slot in snapshot:
+            if not slot(accum, *args, **kwargs):
                 break
         return accum.finalize()
-    
+
+    def __changed(self):
+        # copy on write, emissions in progress keep the old snapshot and
+        # the next emission takes a new one
+        self.__snapshot = None
+
+    def __key(self, func):
+        if getattr(func, 'im_self', None) is not None:
+            return (id(func.im_self), func.im_func)
+        return func
+
     def find(self, conn):
-        for i in xrange(len(self.__slots)):
-            if self.__slots[i][0] == conn:
-                return i
-                
-        return -1
-    
+        """Returns the position of a connection or -1 if it does not exist."""
+        if not self.__slots.has_key(conn):
+            return -1
+        return self.__slots.keys().index(conn)
+
     # create the connection name
     def new_connection(self):
-        value = 0
-        while self.find(value) >= 0:
-            value = random.randint(1, 100000000)
-        return value
-    
-    def connect(self, func):
+        return self.__ids.next()
+
+    def connect(self, func, weak=False):
+        """Connects a function to the signal.
+
+        @param func: The function to call when the signal is emitted.
+        @param weak: C{True} to only keep a weak reference to the object
+        of a bound method, the slot is disconnected when the object dies.
+        @return: The connection id.
+        """
         conn = self.new_connection()
-        self.__slots.append([conn, Signal.Slot(func)])
+        if weak and getattr(func, 'im_self', None) is not None:
+            owner = weakref.ref(self)
+            def on_dead(ref):
+                signal = owner()
+                if signal is not None:
+                    signal.disconnect(conn)
+            slot = Signal.WeakSlot(func, on_dead)
+        else:
+            slot = Signal.Slot(func)
+
+        key = self.__key(func)
+        self.__slots[conn] = slot
+        self.__keys.setdefault(key, []).append(conn)
+        self.__conn_keys[conn] = key
+        self.__changed()
         return conn
-        
+
     # disconnect a slot
     def disconnect(self, conn):
-        result = self.Find(conn)
-        if result >= 0:
-            del self.__slots[result]
-            
+        """Disconnects a slot.
+
+        @param conn: The connection id, or the connected function to
+        disconnect every connection of that function.
+        """
+        if not isinstance(conn, (int, long)):
+            for value in list(self.__keys.get(self.__key(conn), ())):
+                self.disconnect(value)
+            return
+
+        if self.__slots.pop(conn, None) is None:
+            return
+        key = self.__conn_keys.pop(conn)
+        conns = self.__keys[key]
+        conns.remove(conn)
+        if not conns:
+            del self.__keys[key]
+        self.__changed()
+
     # disconnect all slots
     def disconnect_all(self):
-        self.__slots = []
-        
-    
\ No newline at end of file
+        self.__slots = OrderedDict()
+        self.__keys = {}
+        self.__conn_keys = {}
+        self.__changed()
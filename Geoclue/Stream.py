@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import collections
+
+import gobject
+
+import Async
+import Distance
+
+# what to do with an update when the queue is full
+POLICY_COALESCE = "coalesce"        # replace the newest queued update
+POLICY_DROP_OLDEST = "drop-oldest"  # drop the oldest queued update
+POLICY_DROP_NEWEST = "drop-newest"  # drop the incoming update
+
+class PositionStream:
+    """A rate limited, bounded stream of position updates.
+
+    Updates closer than C{min_interval} seconds to the previous one are
+    held back and coalesced, only the latest one is delivered when the
+    interval expires. Updates that moved less than C{min_distance} km are
+    skipped. The delivered updates wait in a queue of C{maxsize} entries,
+    and C{policy} says what happens when the consumer is too slow and
+    the queue is full.
+
+    The stream is an iterator, every item is a C{(fields, timestamp,
+    latitude, longitude, altitude, accuracy)} tuple. Waiting for an item
+    iterates the main loop.
+    """
+
+    def __init__(self, min_interval=0, min_distance=0, maxsize=1, policy=POLICY_COALESCE):
+        """Construct a L{PositionStream} object.
+
+        @param min_interval: The minimum time between updates, in seconds.
+        @param min_distance: The minimum distance between updates, in km.
+        @param maxsize: The maximum number of queued updates.
+        @param policy: L{POLICY_COALESCE}, L{POLICY_DROP_OLDEST} or
+        L{POLICY_DROP_NEWEST}.
+        """
+        if policy not in (POLICY_COALESCE, POLICY_DROP_OLDEST, POLICY_DROP_NEWEST):
+            raise ValueError("unknown backpressure policy: %s" % policy)
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+
+        self.min_interval = min_interval
+        self.min_distance = min_distance
+        self.maxsize = maxsize
+        self.policy = policy
+
+        self.received = 0
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.skipped = 0
+
+        self.__queue = collections.deque()
+        self.__held = None
+        self.__timer = None
+        self.__last_time = None
+        self.__last_position = None
+        self.__waiter = None
+        self.__location = None
+        self.__connection = None
+
+    def __len__(self):
+        return len(self.__queue)
+
+    def attach(self, location):
+        """Receives the position updates of a L{DiscoverLocation}."""
+        self.detach()
+        self.__location = location
+        self.__connection = location.position_signal.connect(self.push)
+
+    def detach(self):
+        """Stops receiving position updates."""
+        if self.__location is not None:
+            self.__location.position_signal.disconnect(self.__connection)
+            self.__location = None
+            self.__connection = None
+        if self.__timer is not None:
+            gobject.source_remove(self.__timer)
+            self.__timer = None
+
+    def push(self, fields, timestamp, latitude, longitude, altitude, accuracy):
+        """Adds a position update to the stream."""
+        self.received += 1
+        update = (fields, timestamp, latitude, longitude, altitude, accuracy)
+
+        if self.min_distance and self.__last_position is not None:
+            moved = Distance.distance(self.__last_position[0], self.__last_position[1],
+                                      latitude, longitude)
+            if moved < self.min_distance:
+                self.skipped += 1
+                return
+
+        now = time.time()
+        if self.min_interval and self.__last_time is not None:
+            wait = self.__last_time + self.min_interval - now
+            if wait > 0:
+                if self.__held is not None:
+                    self.coalesced += 1
+                self.__held = update
+                if self.__timer is None:
+                    self.__timer = gobject.timeout_add(int(wait * 1000) + 1, self.__on_timer)
+                return
+
+        if self.__held is not None:
+            # a newer update replaces the one held back
+            self.coalesced += 1
+            self.__held = None
+        self.__deliver(update, now)
+
+    def __on_timer(self):
+        self.__timer = None
+        if self.__held is not None:
+            update = self.__held
+            self.__held = None
+            self.__deliver(update, time.time())
+        return False
+
+    def __deliver(self, update, now):
+        self.__last_time = now
+        self.__last_position = (update[2], update[3])
+
+        if len(self.__queue) >= self.maxsize:
+            if self.policy == POLICY_COALESCE:
+                self.__queue.pop()
+                self.coalesced += 1
+            elif self.policy == POLICY_DROP_OLDEST:
+                self.__queue.popleft()
+                self.dropped += 1
+            else:
+                self.dropped += 1
+                return
+
+        self.__queue.append(update)
+        self.delivered += 1
+        if self.__waiter is not None:
+            self.__waiter.set_result()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.get()
+
+    def get(self, timeout=None):
+        """Returns the oldest queued update, waiting for one if needed.
+
+        @param timeout: The maximum time to wait, in seconds, or C{None}.
+        @raise Async.Timeout: If no update arrived in time.
+        """
+        if not self.__queue:
+            self.__waiter = Async.Pending()
+            try:
+                self.__waiter.wait(timeout)
+            finally:
+                self.__waiter = None
+        return self.__queue.popleft()
+
+    def stats(self):
+        """Returns a dictionary with the stream counters."""
+        tmp = {}
+        tmp['received'] = self.received
+        tmp['delivered'] = self.delivered
+        tmp['coalesced'] = self.coalesced
+        tmp['dropped'] = self.dropped
+        tmp['skipped'] = self.skipped
+        tmp['queued'] = len(self.__queue)
+        return tmp
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Analysis of a sequence of fixes.
+
+A L{Trajectory} holds the timestamps, latitudes, longitudes and altitudes
+of the fixes as NumPy arrays, and every analysis works on the whole arrays
+at once, so a day of 1 Hz fixes takes milliseconds. Distances are in km,
+like in L{Distance}, and speeds in m/s.
+"""
+
+import math
+from collections import namedtuple
+
+import Distance
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# a dwell: the indexes of its first and last fix, the arrival and
+# departure timestamps and the mean position
+Stop = namedtuple('Stop', 'start end arrival departure latitude longitude')
+
+class Trajectory:
+    """A time ordered sequence of positions."""
+
+    def __init__(self, timestamps, latitudes, longitudes, altitudes=None):
+        """Construct a L{Trajectory} object.
+
+        @param timestamps: The timestamps, in seconds, in increasing order.
+        @param latitudes: The latitudes, in degrees.
+        @param longitudes: The longitudes, in degrees.
+        @param altitudes: The altitudes, in meters, or C{None}.
+        """
+        if numpy is None:
+            raise ImportError("Trajectory needs NumPy")
+        self.timestamps = numpy.asarray(timestamps, dtype=numpy.float64)
+        self.latitudes = numpy.asarray(latitudes, dtype=numpy.float64)
+        self.longitudes = numpy.asarray(longitudes, dtype=numpy.float64)
+        if altitudes is None:
+            altitudes = numpy.zeros(len(self.timestamps))
+        self.altitudes = numpy.asarray(altitudes, dtype=numpy.float64)
+        if not (len(self.timestamps) == len(self.latitudes) ==
+                len(self.longitudes) == len(self.altitudes)):
+            raise ValueError("the columns must have the same length")
+        self.__steps = None
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __pairwise(self, first, second):
+        # great circle distances between the points of two index arrays, in km
+        phi1 = numpy.radians(self.latitudes[first])
+        phi2 = numpy.radians(self.latitudes[second])
+        dlam = numpy.radians(self.longitudes[second] - self.longitudes[first])
+        h = numpy.sin((phi2 - phi1) / 2) ** 2 + \
+            numpy.cos(phi1) * numpy.cos(phi2) * numpy.sin(dlam / 2) ** 2
+        return 2 * Distance.EARTH_RADIUS * numpy.arcsin(numpy.sqrt(numpy.minimum(h, 1.0)))
+
+    def step_distances(self):
+        """Returns the distance between each fix and the next, in km.
+
+        @return: An array of C{len(self) - 1} distances.
+        """
+        if self.__steps is None:
+            indexes = numpy.arange(len(self))
+            self.__steps = self.__pairwise(indexes[:-1], indexes[1:])
+        return self.__steps
+
+    def cumulative_distance(self):
+        """Returns the distance travelled up to each fix, in km.
+
+        @return: An array of C{len(self)} distances, the first is 0.
+        """
+        total = numpy.zeros(len(self))
+        if len(self) > 1:
+            numpy.cumsum(self.step_distances(), out=total[1:])
+        return total
+
+    def speeds(self):
+        """Returns the speed between each fix and the next, in m/s.
+
+        @return: An array of C{len(self) - 1} speeds, NaN where the
+        timestamps do not increase.
+        """
+        elapsed = numpy.diff(self.timestamps)
+        speeds = numpy.empty(len(elapsed))
+        speeds.fill(numpy.nan)
+        moving = elapsed > 0
+        speeds[moving] = self.step_distances()[moving] * 1000 / elapsed[moving]
+        return speeds
+
+    def headings(self):
+        """Returns the initial bearing from each fix to the next.
+
+        @return: An array of C{len(self) - 1} headings, in degrees clockwise
+        from north, NaN where the position does not change.
+        """
+        phi1 = numpy.radians(self.latitudes[:-1])
+        phi2 = numpy.radians(self.latitudes[1:])
+        dlam = numpy.radians(numpy.diff(self.longitudes))
+        y = numpy.sin(dlam) * numpy.cos(phi2)
+        x = numpy.cos(phi1) * numpy.sin(phi2) - numpy.sin(phi1) * numpy.cos(phi2) * numpy.cos(dlam)
+        headings = numpy.degrees(numpy.arctan2(y, x)) % 360
+        headings[self.step_distances() == 0] = numpy.nan
+        return headings
+
+    def stops(self, radius=0.05, min_duration=300):
+        """Finds the places where the trajectory dwells.
+
+        A stop starts at a fix when every fix of the next C{min_duration}
+        seconds is within C{radius} of it, and it lasts until a fix leaves
+        that radius. Only the fixes whose fix C{min_duration} later is
+        within the radius are tried, each one with a single vectorized
+        distance computation.
+
+        @param radius: The maximum distance of a fix to the first fix of
+        its stop, in km.
+        @param min_duration: The minimum duration of a stop, in seconds.
+        @return: A list of L{Stop} tuples.
+        """
+        count = len(self)
+        if count < 2:
+            return []
+        indexes = numpy.arange(count)
+        ends = numpy.searchsorted(self.timestamps, self.timestamps + min_duration)
+        ends = numpy.minimum(ends, count - 1)
+        candidates = numpy.flatnonzero(
+            (self.timestamps[ends] - self.timestamps >= min_duration) &
+            (self.__pairwise(indexes, ends) <= radius))
+
+        tmp = []
+        position = 0
+        while position < len(candidates):
+            anchor = int(candidates[position])
+            position += 1
+            window = indexes[anchor + 1:ends[anchor] + 1]
+            if (self.__pairwise(anchor, window) > radius).any():
+                continue
+
+            # the stop goes on until a fix leaves the radius
+            last = int(ends[anchor])
+            step = max(last - anchor, 1)
+            while last + 1 < count:
+                following = indexes[last + 1:last + 1 + step]
+                away = numpy.flatnonzero(self.__pairwise(anchor, following) > radius)
+                if len(away):
+                    last += int(away[0])
+                    break
+                last = int(following[-1])
+                step *= 2
+
+            tmp.append(Stop(anchor, last,
+                            float(self.timestamps[anchor]), float(self.timestamps[last]),
+                            float(self.latitudes[anchor:last + 1].mean()),
+                            float(self.longitudes[anchor:last + 1].mean())))
+            # the next stop starts after this one
+            position = int(numpy.searchsorted(candidates, last + 1))
+        return tmp
+
+    def __project(self):
+        # equirectangular projection around the mean position, in km
+        latitude = math.radians(self.latitudes.mean())
+        longitude = self.longitudes[0]
+        # relative longitudes, across the antimeridian
+        delta = (self.longitudes - longitude + 180) % 360 - 180
+        scale = Distance.EARTH_RADIUS * math.pi / 180
+        return (delta * scale * math.cos(latitude), self.latitudes * scale)
+
+    def simplify(self, tolerance=0.01):
+        """Simplifies the trajectory with the Douglas-Peucker algorithm.
+
+        The recursion is run breadth first: every segment still to split
+        is handled by the same array operations, on a local plane
+        projection, which is accurate for trajectories up to a few hundred
+        km.
+
+        @param tolerance: The maximum distance of a removed fix to the
+        simplified trajectory, in km.
+        @return: The sorted array of the indexes of the kept fixes.
+        """
+        count = len(self)
+        if count < 3:
+            return numpy.arange(count)
+        (x, y) = self.__project()
+        keep = numpy.zeros(count, dtype=bool)
+        keep[0] = keep[-1] = True
+
+        firsts = numpy.array([0])
+        lasts = numpy.array([count - 1])
+        while len(firsts):
+            # the inner fixes of every segment, one after the other
+            sizes = lasts - firsts - 1
+            offsets = numpy.cumsum(sizes) - sizes
+            segment = numpy.repeat(numpy.arange(len(sizes)), sizes)
+            points = firsts[segment] + 1 + numpy.arange(len(segment)) - offsets[segment]
+
+            x0 = x[firsts][segment]
+            y0 = y[firsts][segment]
+            dx = x[lasts][segment] - x0
+            dy = y[lasts][segment] - y0
+            px = x[points] - x0
+            py = y[points] - y0
+            # distance to the chord as a segment, not as a line
+            length = dx * dx + dy * dy
+            t = numpy.zeros(len(points))
+            numpy.divide(px * dx + py * dy, length, out=t, where=length > 0)
+            numpy.clip(t, 0.0, 1.0, out=t)
+            distances = numpy.hypot(px - t * dx, py - t * dy)
+
+            # the first farthest fix of each segment
+            farthest = numpy.maximum.reduceat(distances, offsets)
+            candidates = numpy.flatnonzero(distances == farthest[segment])
+            (split, first_candidate) = numpy.unique(segment[candidates], return_index=True)
+            middles = points[candidates[first_candidate]]
+            split_mask = farthest[split] > tolerance
+            split = split[split_mask]
+            middles = middles[split_mask]
+            keep[middles] = True
+
+            firsts = numpy.concatenate((firsts[split], middles))
+            lasts = numpy.concatenate((middles, lasts[split]))
+            open_mask = lasts - firsts >= 2
+            firsts = firsts[open_mask]
+            lasts = lasts[open_mask]
+        return numpy.flatnonzero(keep)
+
+    def take(self, indexes):
+        """Returns a new L{Trajectory} with some of the fixes, ie. the
+        result of L{simplify}."""
+        return Trajectory(self.timestamps[indexes], self.latitudes[indexes],
+                          self.longitudes[indexes], self.altitudes[indexes])
+
+def from_fixes(fixes):
+    """Builds a L{Trajectory} from a sequence of L{Location.LocationFix}."""
+    fixes = list(fixes)
+    return Trajectory([fix.timestamp for fix in fixes],
+                      [fix.latitude for fix in fixes],
+                      [fix.longitude for fix in fixes],
+                      [fix.altitude for fix in fixes])
+
+def from_history(history, start=None, end=None):
+    """Builds a L{Trajectory} from a position history without copying fix
+    by fix.
+
+    @param history: A L{Location.FixHistory}, a L{Location.FixHistoryView}
+    or a L{History.HistoryRecorder}.
+    @param start: The first timestamp, for a L{History.HistoryRecorder}.
+    @param end: The last timestamp, for a L{History.HistoryRecorder}.
+    """
+    if numpy is None:
+        raise ImportError("Trajectory needs NumPy")
+    if hasattr(history, 'find_range'):
+        segments = history.as_numpy(start, end)
+        if not segments:
+            return Trajectory([], [], [])
+        records = numpy.concatenate(segments)
+        return Trajectory(records['timestamp'], records['latitude'],
+                          records['longitude'], records['altitude'])
+    if hasattr(history, 'snapshot'):
+        history = history.snapshot()
+    columns = history.as_numpy()
+    return Trajectory(columns['timestamps'], columns['latitudes'],
+                      columns['longitudes'], columns['altitudes'])
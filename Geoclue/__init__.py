@@ -15,5 +15,6 @@
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from Base import *
+from AsyncLocation import AsyncDiscoverLocation
 
 VERSION = "0.1"
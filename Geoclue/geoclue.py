@@ -55,9 +55,17 @@ STATUS_UNAVAILABLE = 1
 STATUS_ACQUIRING = 2
 STATUS_AVAILABLE = 3
 
+STATUS_NAMES = {
+    STATUS_ERROR: "error",
+    STATUS_UNAVAILABLE: "unavailable",
+    STATUS_ACQUIRING: "acquiring",
+    STATUS_AVAILABLE: "available",
+}
+
 ### PROVIDERS - Added, pcabido
 MASTER_IFACE = "org.freedesktop.Geoclue.Master"
 MASTER_PATH = "/org/freedesktop/Geoclue/Master"
+MASTER_CLIENT_IFACE = "org.freedesktop.Geoclue.MasterClient"
 
 ADDRESS_IFACE = "org.freedesktop.Geoclue.Address"
 ADDRESS_PATH = "/org/freedesktop/Geoclue/Address"
@@ -73,8 +81,100 @@ GEONAMES_PATH = "/org/freedesktop/Geoclue/Providers/Geonames"
 
 REVERSE_IFACE = "org.freedesktop.Geoclue.ReverseGeocode"
 REVERSE_PATH = "/org/freedesktop/Geoclue/ReverseGeocode"
+
+GEOCODE_IFACE = "org.freedesktop.Geoclue.Geocode"
+GEOCODE_PATH = "/org/freedesktop/Geoclue/Geocode"
 ###
 
+DBUS_SERVICE = "org.freedesktop.DBus"
+DBUS_IFACE = "org.freedesktop.DBus"
+DBUS_PATH = "/org/freedesktop/DBus"
+
+class ProxyPool():
+    """Shares the session bus connection, proxies and interfaces.
+
+    Proxies are bound to the owner of a service name when they are
+    created, so every proxy of a service is dropped when the name changes
+    owner (ie. the provider was restarted).
+    """
+
+    def __init__(self, bus=None):
+        """Construct a L{ProxyPool} object.
+
+        @param bus: The bus to use, by default the session bus is opened
+        when it is first needed.
+        """
+        self.__bus = bus
+        self.__watching = False
+        self.__proxies = {}
+        self.__interfaces = {}
+
+    def get_bus(self):
+        """Returns the shared bus connection."""
+        if self.__bus is None:
+            self.__bus = dbus.SessionBus()
+        if not self.__watching:
+            self.__bus.add_signal_receiver(self.on_name_owner_changed,
+                                           signal_name="NameOwnerChanged",
+                                           dbus_interface=DBUS_IFACE,
+                                           bus_name=DBUS_SERVICE,
+                                           path=DBUS_PATH)
+            self.__watching = True
+        return self.__bus
+
+    def get_proxy(self, service, path, introspect=True):
+        """Returns the shared proxy of an object.
+
+        @param service: The service name.
+        @param path: The object path.
+        @param introspect: C{False} to skip the introspection of the
+        object. Without introspection the arguments of the calls are not
+        converted to the signature of the method, so only disable it for
+        proxies whose methods take no arguments.
+        """
+        key = (service, path, introspect)
+        proxy = self.__proxies.get(key)
+        if proxy is None:
+            proxy = self.get_bus().get_object(service, path, introspect=introspect)
+            self.__proxies[key] = proxy
+        return proxy
+
+    def get_interface(self, service, path, interface, introspect=True):
+        """Returns the shared C{dbus.Interface} of an object.
+
+        @param interface: The interface name.
+        @see: L{get_proxy}
+        """
+        key = (service, path, interface, introspect)
+        obj = self.__interfaces.get(key)
+        if obj is None:
+            obj = dbus.Interface(self.get_proxy(service, path, introspect),
+                                 dbus_interface=interface)
+            self.__interfaces[key] = obj
+        return obj
+
+    def invalidate(self, service=None):
+        """Drops the proxies and interfaces of a service, or all of them.
+
+        @param service: The service name or C{None} for every service.
+        """
+        for cache in (self.__proxies, self.__interfaces):
+            for key in cache.keys():
+                if service is None or key[0] == service:
+                    del cache[key]
+
+    def on_name_owner_changed(self, name, old_owner, new_owner):
+        self.invalidate(name)
+
+_pool = None
+
+def get_pool():
+    """Returns the process wide L{ProxyPool}."""
+    global _pool
+    if _pool is None:
+        _pool = ProxyPool()
+    return _pool
+
 class GeoclueProvider():
     pass
 
@@ -102,6 +202,12 @@ class GeoclueProvider():
             elif interface == "org.freedesktop.Geoclue.ReverseGeocode":
                self.interfaces += INTERFACE_REVERSE_GEOCODE
                
-    def get_proxy (self):
-        self.bus = dbus.SessionBus()
-        return self.bus.get_object(self.service, self.path)
+    def get_proxy (self, introspect=True):
+        pool = get_pool()
+        self.bus = pool.get_bus()
+        return pool.get_proxy(self.service, self.path, introspect)
+
+    def get_interface (self, interface, introspect=True):
+        pool = get_pool()
+        self.bus = pool.get_bus()
+        return pool.get_interface(self.service, self.path, interface, introspect)
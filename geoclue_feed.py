@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Client of the location feed published by C{Geoclue.Feed}.
+
+The feed is read from a Unix domain socket, one JSON object per line:
+
+    {"type":"position","timestamp":...,"latitude":...,"longitude":...,
+     "altitude":...,"fields":...,"accuracy":[level,horizontal,vertical]}
+    {"type":"address","timestamp":...,"address":{"locality":...,...}}
+
+The current position and address are sent right after connecting. This
+module only uses the standard library, it does not import dbus, gobject
+or the C{Geoclue} package.
+"""
+
+import os
+import stat
+import errno
+import socket
+import select
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+# the directory of the socket without $XDG_RUNTIME_DIR, with the user id
+FALLBACK_DIRECTORY = "/tmp/geoclue-feed-%d"
+
+def default_path():
+    """Returns the default socket path of the feed.
+
+    It is in C{$XDG_RUNTIME_DIR} when set, otherwise in the user's private
+    directory L{FALLBACK_DIRECTORY}, see L{check_directory}.
+    """
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, "geoclue-feed.sock")
+    return os.path.join(FALLBACK_DIRECTORY % os.getuid(), "feed.sock")
+
+def check_directory(path, create=False):
+    """Checks that a directory belongs to the user and is private.
+
+    Another user could otherwise have created it, or a symbolic link in
+    its place, to take the socket's place.
+
+    @param path: The directory path.
+    @param create: C{True} to create the directory, with mode 0700, if it
+    does not exist.
+    @raise OSError: If the directory does not exist, is not a directory,
+    is owned by another user or is open to the group or the others.
+    """
+    if create:
+        try:
+            os.mkdir(path, 0700)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+            stat.S_IMODE(info.st_mode) & 077:
+        raise OSError(errno.EPERM, "%s is not a private directory of the user" % path)
+
+def encode(message):
+    """Returns the line of a feed message."""
+    return json.dumps(message, separators=(",", ":")) + "\n"
+
+class FeedClient:
+    """Reads the location feed.
+
+    The last position and address are kept in C{position} and C{address},
+    they are updated by every message read with L{read} or L{poll}.
+    """
+
+    def __init__(self, path=None, timeout=None):
+        """Construct a L{FeedClient} object and connect to the feed.
+
+        @param path: The socket path, see L{default_path}.
+        @param timeout: The connection timeout, in seconds, or C{None}.
+        @raise socket.error: If the feed is not running.
+        @raise OSError: If the directory of the default path is not
+        private, see L{check_directory}.
+        """
+        if path is None:
+            path = default_path()
+            check_directory(os.path.dirname(path))
+        self.path = path
+        self.position = None
+        self.address = None
+        self.__buffer = ""
+        self.__lines = []
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(path)
+        self.socket.setblocking(False)
+
+    def fileno(self):
+        """Returns the socket's file descriptor, ie. for C{select}."""
+        return self.socket.fileno()
+
+    def __receive(self):
+        # reads what is available, returns False when the feed closed
+        try:
+            data = self.socket.recv(65536)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return True
+            raise
+        if not data:
+            return False
+        lines = (self.__buffer + data).split("\n")
+        self.__buffer = lines.pop()
+        self.__lines.extend(lines)
+        return True
+
+    def __next_message(self):
+        while self.__lines:
+            line = self.__lines.pop(0)
+            if not line:
+                continue
+            message = json.loads(line)
+            if message.get("type") == "position":
+                self.position = message
+            elif message.get("type") == "address":
+                self.address = message
+            return message
+        return None
+
+    def read(self, timeout=None):
+        """Returns the next message, waiting for it if needed.
+
+        @param timeout: The maximum time to wait, in seconds, or C{None}.
+        @return: The message dictionary or C{None} on timeout.
+        @raise EOFError: If the feed closed the connection.
+        """
+        while True:
+            message = self.__next_message()
+            if message is not None:
+                return message
+            (readable, writable, errors) = select.select([self.socket], [], [], timeout)
+            if not readable:
+                return None
+            if not self.__receive():
+                raise EOFError("the location feed closed the connection")
+
+    def poll(self):
+        """Returns the messages that arrived, without waiting.
+
+        @return: A list of message dictionaries.
+        @raise EOFError: If the feed closed the connection.
+        """
+        if not self.__receive():
+            raise EOFError("the location feed closed the connection")
+        messages = []
+        message = self.__next_message()
+        while message is not None:
+            messages.append(message)
+            message = self.__next_message()
+        return messages
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.read()
+            except EOFError:
+                return
+
+    def close(self):
+        """Disconnects from the feed."""
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+def get_position(path=None, timeout=1.0):
+    """Returns the current position of the feed, connecting only for it.
+
+    @return: The position message or C{None} if there is none yet.
+    """
+    client = FeedClient(path, timeout)
+    try:
+        while client.position is None:
+            if client.read(timeout) is None:
+                break
+        return client.position
+    finally:
+        client.close()
@@ -22,6 +22,7 @@ setup(name='python-geoclue',
         It uses the Geoclue D-Bus API in order to facilitate Geoclue's use.
         """,
         packages=['Geoclue'],
+        py_modules=['geoclue_feed'],
         classifiers=[
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',
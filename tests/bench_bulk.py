@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Scaling of the bulk proximity jobs from 1 to N processes.
+#
+# usage: python bench_bulk.py [number of points] [max processes]
+
+import sys ; sys.path.insert(0, '..')
+
+import random
+import time
+import multiprocessing
+
+from Geoclue import Bulk
+from Geoclue import Distance
+
+def bench(executor, method, repeat=3):
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        executor.proximity(latitude, longitude, lats, lons, 0.5, method)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+if len(sys.argv) > 1:
+    count = int(sys.argv[1])
+else:
+    count = 2000000
+if len(sys.argv) > 2:
+    processes = int(sys.argv[2])
+else:
+    processes = multiprocessing.cpu_count()
+
+random.seed(0)
+latitude, longitude = 38.5833333, -7.8333333
+lats = Distance.as_array([latitude + random.uniform(-1, 1) for i in xrange(count)])
+lons = Distance.as_array([longitude + random.uniform(-1, 1) for i in xrange(count)])
+
+print "%d points, %d CPUs, numpy: %s" % (count, multiprocessing.cpu_count(),
+                                         Distance.numpy is not None)
+for method in (Distance.METHOD_HAVERSINE, Distance.METHOD_VINCENTY):
+    reference = None
+    for n in xrange(1, processes + 1):
+        executor = Bulk.BulkExecutor(n)
+        elapsed = bench(executor, method)
+        executor.close()
+        if reference is None:
+            reference = elapsed
+        print "%-10s %2d processes %10.2f ms %8.2fx" % (method, n, elapsed * 1000,
+                                                        reference / elapsed)
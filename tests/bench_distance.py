@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compares DiscoverLocation.compare_position, called once per point, with
+# the batch distance API.
+#
+# usage: python bench_distance.py [number of points]
+
+import sys ; sys.path.insert(0, '..')
+
+import random
+import time
+
+import Geoclue as geoclue
+from Geoclue import Distance
+
+class FakeLocation:
+    # only the location_info is needed by compare_position
+    def __init__(self, latitude, longitude):
+        self.location_info = {'latitude': latitude, 'longitude': longitude}
+
+def bench(name, func, repeat=3):
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print "%-30s %10.2f ms" % (name, best * 1000)
+    return best
+
+if len(sys.argv) > 1:
+    count = int(sys.argv[1])
+else:
+    count = 50000
+
+random.seed(0)
+latitude, longitude = 38.5833333, -7.8333333
+lats = [latitude + random.uniform(-0.1, 0.1) for i in xrange(count)]
+lons = [longitude + random.uniform(-0.1, 0.1) for i in xrange(count)]
+
+location = FakeLocation(latitude, longitude)
+compare_position = geoclue.DiscoverLocation.compare_position.im_func
+
+def per_point():
+    for i in xrange(count):
+        compare_position(location, lats[i], lons[i], 0.5)
+
+batch_lats = Distance.as_array(lats)
+batch_lons = Distance.as_array(lons)
+
+def batch(method):
+    def run():
+        Distance.proximity(latitude, longitude, batch_lats, batch_lons, 0.5, method)
+    return run
+
+print "%d points, numpy: %s" % (count, Distance.numpy is not None)
+reference = bench("compare_position (loop)", per_point)
+for method in (Distance.METHOD_HAVERSINE, Distance.METHOD_VINCENTY):
+    elapsed = bench("proximity (%s)" % method, batch(method))
+    print "%-30s %10.1fx" % ("", reference / elapsed)
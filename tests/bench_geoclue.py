@@ -0,0 +1,268 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmark of DiscoverLocation against the mock Geoclue daemon.
+#
+# A private session bus is started with mock_geoclue.py on it, so nothing
+# of the system's Geoclue is used. It measures the init latency, the
+# position signal throughput, the reverse geocoding throughput and the
+# memory per fix, and compares them with a baseline:
+#
+#   python bench_geoclue.py --save-baseline      # once, on a known good tree
+#   python bench_geoclue.py                      # exits 1 on a regression
+#
+# The results and the baseline only hold for the machine they were measured
+# on, so they are kept in build/bench/, which is not versioned. Save the
+# baseline again after a change of machine or Python, and after a change
+# that is meant to move the numbers.
+#
+# usage: python bench_geoclue.py [--latency MS] [--signals N] [--reverse N]
+#        [--inits N] [--output FILE] [--baseline FILE] [--tolerance T]
+#        [--save-baseline]
+
+import sys ; sys.path.insert(0, '..')
+
+import os
+import gc
+import time
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import mock_geoclue
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# the directory of the results and of the baseline
+RESULTS_DIR = os.path.join(os.path.dirname(HERE), "build", "bench")
+
+# the direction of every result, for the regression check
+HIGHER_IS_BETTER = {
+    'signals_per_second': True,
+    'reverse_serial_per_second': True,
+    'reverse_concurrent_per_second': True,
+    'init_seconds': False,
+    'init_async_seconds': False,
+    'history_bytes_per_fix': False,
+    'fix_bytes_per_fix': False,
+    'dict_bytes_per_fix': False,
+}
+
+def start_bus():
+    daemon = subprocess.Popen(["dbus-daemon", "--session", "--nofork", "--print-address=1"],
+                              stdout=subprocess.PIPE)
+    address = daemon.stdout.readline().strip()
+    if not address:
+        daemon.wait()
+        raise RuntimeError("dbus-daemon did not start")
+    return (daemon, address)
+
+def start_mock(address, latency):
+    env = dict(os.environ)
+    env['DBUS_SESSION_BUS_ADDRESS'] = address
+    mock = subprocess.Popen([sys.executable, os.path.join(HERE, "mock_geoclue.py"),
+                             "--latency", str(latency)],
+                            stdout=subprocess.PIPE, env=env)
+    if mock.stdout.readline().strip() != "ready":
+        mock.wait()
+        raise RuntimeError("mock_geoclue.py did not start")
+    return mock
+
+def stop(process):
+    if process is not None and process.poll() is None:
+        process.terminate()
+        process.wait()
+
+def deep_size(obj):
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_size(key) + deep_size(value)
+    elif isinstance(obj, (tuple, list)):
+        for value in obj:
+            size += deep_size(value)
+    return size
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def bench_signals(Geoclue, Async, providers_path, count, results):
+    location = Geoclue.DiscoverLocation(providers_path)
+    if not location.init():
+        raise RuntimeError("init failed")
+    history = location.record_history()
+    fixes = []
+    location.position_signal.connect(lambda *fix: fixes.append(location.get_location_fix()))
+
+    mock = location.bus.get_object(mock_geoclue.MASTER_SERVICE, mock_geoclue.MASTER_PATH)
+    start = time.time()
+    mock.EmitPositions(count, dbus_interface=mock_geoclue.MOCK_IFACE)
+    deadline = start + 60
+    while len(fixes) < count and time.time() < deadline:
+        Async.iterate(True)
+    elapsed = time.time() - start
+    if len(fixes) < count:
+        print "only %d of %d signals received" % (len(fixes), count)
+    results['signals_per_second'] = len(fixes) / elapsed
+
+    columns = (history.fields, history.timestamps, history.latitudes,
+               history.longitudes, history.altitudes, history.accuracy_levels,
+               history.horizontal_accuracies, history.vertical_accuracies)
+    history_bytes = sum([column.itemsize * len(column) for column in columns])
+    results['history_bytes_per_fix'] = float(history_bytes) / max(len(history), 1)
+    results['fix_bytes_per_fix'] = float(sum([deep_size(fix) for fix in fixes])) / max(len(fixes), 1)
+    results['dict_bytes_per_fix'] = float(deep_size(fixes[-1].to_dict()))
+
+def bench_reverse(Geoclue, providers_path, count, results):
+    location = Geoclue.DiscoverLocation(providers_path)
+    positions = [(38.0 + i * 0.001, -8.0 - i * 0.001) for i in xrange(count)]
+
+    start = time.time()
+    for latitude, longitude in positions:
+        if location.reverse_position(latitude, longitude, 3) is None:
+            raise RuntimeError("reverse geocoding failed")
+    results['reverse_serial_per_second'] = count / (time.time() - start)
+
+    start = time.time()
+    for position, address in location.reverse_positions(positions, 3):
+        if not isinstance(address, dict):
+            raise RuntimeError("reverse geocoding failed: %s" % address)
+    results['reverse_concurrent_per_second'] = count / (time.time() - start)
+
+def bench_init(Geoclue, providers_path, count, results):
+    timings = []
+    for i in xrange(count):
+        location = Geoclue.DiscoverLocation(providers_path)
+        start = time.time()
+        if not location.init():
+            raise RuntimeError("init failed")
+        timings.append(time.time() - start)
+    results['init_seconds'] = median(timings)
+
+    timings = []
+    for i in xrange(count):
+        location = Geoclue.DiscoverLocation(providers_path)
+        start = time.time()
+        location.init_async().wait(30)
+        timings.append(time.time() - start)
+    results['init_async_seconds'] = median(timings)
+
+def compare(results, baseline, tolerance):
+    """Prints the change of every result, returns the regressed ones."""
+    regressions = []
+    for name in sorted(results.keys()):
+        value = results[name]
+        if not baseline.has_key(name) or not baseline[name]:
+            print "%-32s %14.6g" % (name, value)
+            continue
+        change = (value - baseline[name]) / baseline[name]
+        if HIGHER_IS_BETTER[name]:
+            regressed = change < -tolerance
+        else:
+            regressed = change > tolerance
+        if regressed:
+            regressions.append(name)
+        print "%-32s %14.6g %+8.1f%% %s" % (name, value, change * 100,
+                                            regressed and "REGRESSION" or "")
+    return regressions
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--latency", type="float", default=1.0,
+                      help="reply latency of the mock, in milliseconds")
+    parser.add_option("--signals", type="int", default=5000,
+                      help="number of position signals")
+    parser.add_option("--reverse", type="int", default=500,
+                      help="number of positions to reverse geocode")
+    parser.add_option("--inits", type="int", default=20,
+                      help="number of inits")
+    parser.add_option("--output", default=os.path.join(RESULTS_DIR, "bench_geoclue.json"),
+                      help="file to store the results in")
+    parser.add_option("--baseline", default=os.path.join(RESULTS_DIR, "bench_geoclue.baseline.json"),
+                      help="file with the baseline results")
+    parser.add_option("--tolerance", type="float", default=0.2,
+                      help="relative change considered a regression")
+    parser.add_option("--save-baseline", action="store_true", default=False,
+                      help="store the results as the new baseline")
+    (options, args) = parser.parse_args()
+
+    daemon = mock = None
+    providers_path = tempfile.mkdtemp(prefix="geoclue-providers-")
+    try:
+        (daemon, address) = start_bus()
+        # before the first connection to the session bus
+        os.environ['DBUS_SESSION_BUS_ADDRESS'] = address
+        mock = start_mock(address, options.latency)
+        mock_geoclue.write_provider_files(providers_path)
+
+        import Geoclue
+        from Geoclue import Async
+
+        results = {}
+        gc.collect()
+        # the signals go to every client of the mock, so this runs first
+        bench_signals(Geoclue, Async, providers_path, options.signals, results)
+        bench_reverse(Geoclue, providers_path, options.reverse, results)
+        bench_init(Geoclue, providers_path, options.inits, results)
+    finally:
+        stop(mock)
+        stop(daemon)
+        shutil.rmtree(providers_path, True)
+
+    record = {
+        'time': time.time(),
+        'python': sys.version.split()[0],
+        'options': {'latency': options.latency, 'signals': options.signals,
+                    'reverse': options.reverse, 'inits': options.inits},
+        'results': results,
+    }
+    for path in (options.output, options.baseline):
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    f = open(options.output, "w")
+    json.dump(record, f, indent=2, sort_keys=True)
+    f.close()
+
+    if options.save_baseline:
+        f = open(options.baseline, "w")
+        json.dump(record, f, indent=2, sort_keys=True)
+        f.close()
+        compare(results, {}, options.tolerance)
+        print "baseline saved to %s" % options.baseline
+        return 0
+
+    baseline = {}
+    if os.path.exists(options.baseline):
+        f = open(options.baseline)
+        baseline = json.load(f)['results']
+        f.close()
+    regressions = compare(results, baseline, options.tolerance)
+    if regressions:
+        print "regressions: %s" % ", ".join(regressions)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Micro-benchmark of the Signal emit, connect and disconnect throughput.
+#
+# usage: python bench_signal.py [number of slots]
+
+import sys ; sys.path.insert(0, '..')
+
+import time
+
+from Geoclue.Signal import Signal
+
+class Listener:
+    def __init__(self):
+        self.count = 0
+
+    def on_signal(self, *args):
+        self.count += 1
+
+def rate(name, count, func):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print "%-40s %12.0f /s" % (name, count / elapsed)
+
+if len(sys.argv) > 1:
+    slots = int(sys.argv[1])
+else:
+    slots = 1000
+
+listeners = [Listener() for i in xrange(slots)]
+signal = Signal()
+conns = []
+
+def connect():
+    for listener in listeners:
+        conns.append(signal.connect(listener.on_signal))
+
+def emit(count):
+    def run():
+        for i in xrange(count):
+            signal(i)
+    return run
+
+def disconnect():
+    for conn in conns:
+        signal.disconnect(conn)
+
+emits = max(1, 1000000 / slots)
+rate("connect (%d slots)" % slots, slots, connect)
+rate("emit (%d slots), slot calls" % slots, emits * slots, emit(emits))
+rate("disconnect (%d slots)" % slots, slots, disconnect)
+
+weak = Signal()
+for listener in listeners:
+    weak.connect(listener.on_signal, weak=True)
+signal = weak
+rate("emit (%d weak slots), slot calls" % slots, emits * slots, emit(emits))
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Times the trajectory analyses on a synthetic day of 1 Hz fixes: walks
+# with a random heading, separated by stops of a few minutes.
+#
+# usage: python bench_trajectory.py [number of fixes]
+
+import sys ; sys.path.insert(0, '..')
+
+import math
+import random
+import time
+
+from Geoclue import Trajectory
+
+def bench(name, func, repeat=3):
+    best = None
+    for i in xrange(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    print "%-30s %10.2f ms" % (name, best * 1000)
+    return result
+
+if len(sys.argv) > 1:
+    count = int(sys.argv[1])
+else:
+    count = 86400
+
+random.seed(0)
+latitude, longitude = 38.5833333, -7.8333333
+lats = []
+lons = []
+while len(lats) < count:
+    # a stop, with some noise
+    for i in xrange(random.randint(300, 900)):
+        lats.append(latitude + random.gauss(0, 0.00005))
+        lons.append(longitude + random.gauss(0, 0.00005))
+    # a walk at about 1.4 m/s
+    heading = random.uniform(0, 2 * math.pi)
+    for i in xrange(random.randint(600, 3600)):
+        heading += random.gauss(0, 0.05)
+        latitude += 0.0000126 * math.cos(heading)
+        longitude += 0.0000126 * math.sin(heading) / math.cos(math.radians(latitude))
+        lats.append(latitude)
+        lons.append(longitude)
+del lats[count:], lons[count:]
+
+trajectory = Trajectory.Trajectory(range(count), lats, lons)
+print "%d fixes" % count
+total = bench("cumulative_distance", lambda: trajectory.cumulative_distance())
+print "%-30s %10.1f km" % ("", total[-1])
+bench("speeds", trajectory.speeds)
+bench("headings", trajectory.headings)
+stops = bench("stops", trajectory.stops)
+print "%-30s %10d stops" % ("", len(stops))
+kept = bench("simplify (5 m)", lambda: trajectory.simplify(0.005))
+print "%-30s %10d fixes" % ("", len(kept))
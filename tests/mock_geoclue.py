@@ -0,0 +1,264 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A mock Geoclue daemon for the tests and benchmarks.
+#
+# It owns the Master service and a Geonames provider on the session bus,
+# with configurable reply latency and position update rate:
+#
+#   python mock_geoclue.py [--latency MS] [--update-rate HZ]
+#
+# The Mock interface of the Master object controls it at runtime.
+
+import sys
+import time
+import optparse
+
+import dbus
+import dbus.service
+from dbus.mainloop.glib import DBusGMainLoop
+import gobject
+
+MASTER_SERVICE = "org.freedesktop.Geoclue.Master"
+MASTER_PATH = "/org/freedesktop/Geoclue/Master"
+CLIENT_PATH = "/org/freedesktop/Geoclue/Master/client%d"
+GEONAMES_SERVICE = "org.freedesktop.Geoclue.Providers.Geonames"
+GEONAMES_PATH = "/org/freedesktop/Geoclue/Providers/Geonames"
+
+GEOCLUE_IFACE = "org.freedesktop.Geoclue"
+MASTER_IFACE = "org.freedesktop.Geoclue.Master"
+CLIENT_IFACE = "org.freedesktop.Geoclue.MasterClient"
+ADDRESS_IFACE = "org.freedesktop.Geoclue.Address"
+POSITION_IFACE = "org.freedesktop.Geoclue.Position"
+REVERSE_IFACE = "org.freedesktop.Geoclue.ReverseGeocode"
+MOCK_IFACE = "org.freedesktop.Geoclue.Mock"
+
+STATUS_AVAILABLE = 3
+ACCURACY = dbus.Struct((dbus.Int32(3), dbus.Double(0), dbus.Double(0)), signature="idd")
+
+ADDRESS = {
+    'street': 'Praca do Giraldo',
+    'area': 'Centro Historico',
+    'locality': 'Evora',
+    'region': 'Evora',
+    'country': 'Portugal',
+    'countrycode': 'PT',
+}
+
+class Settings:
+    latency = 0.0
+    update_rate = 0.0
+    latitude = 38.5714
+    longitude = -7.9135
+
+def reply_later(reply, *args):
+    # replies after the configured latency without blocking other calls
+    if Settings.latency > 0:
+        def on_timeout():
+            reply(*args)
+            return False
+        gobject.timeout_add(int(Settings.latency * 1000), on_timeout)
+    else:
+        reply(*args)
+
+class Client(dbus.service.Object):
+
+    def __init__(self, bus, path):
+        dbus.service.Object.__init__(self, bus, path)
+        self.started = False
+        self.updates = 0
+        self.source = None
+        self.released = False
+
+    def position(self):
+        # moves north by about a meter per update
+        latitude = Settings.latitude + self.updates * 0.00001
+        return (dbus.Int32(3), dbus.Int32(int(time.time())), dbus.Double(latitude),
+                dbus.Double(Settings.longitude), dbus.Double(0), ACCURACY)
+
+    @dbus.service.method(CLIENT_IFACE, in_signature="iibi", out_signature="",
+                         async_callbacks=("reply", "error"))
+    def SetRequirements(self, accuracy, time, require_updates, resources, reply, error):
+        reply_later(reply)
+
+    @dbus.service.method(CLIENT_IFACE, in_signature="", out_signature="",
+                         async_callbacks=("reply", "error"))
+    def AddressStart(self, reply, error):
+        reply_later(reply)
+
+    @dbus.service.method(CLIENT_IFACE, in_signature="", out_signature="",
+                         async_callbacks=("reply", "error"))
+    def PositionStart(self, reply, error):
+        self.start_updates(Settings.update_rate)
+        reply_later(reply)
+
+    @dbus.service.method(CLIENT_IFACE, in_signature="", out_signature="ssss")
+    def GetAddressProvider(self):
+        return ("Mock", "Mock provider", MASTER_SERVICE, MASTER_PATH)
+
+    @dbus.service.method(CLIENT_IFACE, in_signature="", out_signature="ssss")
+    def GetPositionProvider(self):
+        return ("Mock", "Mock provider", MASTER_SERVICE, MASTER_PATH)
+
+    @dbus.service.signal(CLIENT_IFACE, signature="ssss")
+    def AddressProviderChanged(self, name, description, service, path):
+        pass
+
+    @dbus.service.signal(CLIENT_IFACE, signature="ssss")
+    def PositionProviderChanged(self, name, description, service, path):
+        pass
+
+    @dbus.service.method(ADDRESS_IFACE, in_signature="", out_signature="ia{ss}(idd)",
+                         async_callbacks=("reply", "error"))
+    def GetAddress(self, reply, error):
+        reply_later(reply, int(time.time()), ADDRESS, ACCURACY)
+
+    @dbus.service.signal(ADDRESS_IFACE, signature="ia{ss}(idd)")
+    def AddressChanged(self, timestamp, address, accuracy):
+        pass
+
+    @dbus.service.method(POSITION_IFACE, in_signature="", out_signature="iiddd(idd)",
+                         async_callbacks=("reply", "error"))
+    def GetPosition(self, reply, error):
+        reply_later(reply, *self.position())
+
+    @dbus.service.signal(POSITION_IFACE, signature="iiddd(idd)")
+    def PositionChanged(self, fields, timestamp, latitude, longitude, altitude, accuracy):
+        pass
+
+    @dbus.service.method(GEOCLUE_IFACE, in_signature="", out_signature="")
+    def RemoveReference(self):
+        # the last reference, the client goes away
+        self.start_updates(0)
+        self.released = True
+        self.remove_from_connection()
+
+    def emit_position(self):
+        self.updates += 1
+        self.PositionChanged(*self.position())
+        return True
+
+    def start_updates(self, rate):
+        if self.source is not None:
+            gobject.source_remove(self.source)
+            self.source = None
+        if rate > 0:
+            self.source = gobject.timeout_add(max(1, int(1000 / rate)), self.emit_position)
+
+class Master(dbus.service.Object):
+
+    def __init__(self, bus):
+        dbus.service.Object.__init__(self, bus, MASTER_PATH)
+        self.bus = bus
+        self.clients = []
+
+    @dbus.service.method(MASTER_IFACE, in_signature="", out_signature="o",
+                         async_callbacks=("reply", "error"))
+    def Create(self, reply, error):
+        path = CLIENT_PATH % len(self.clients)
+        self.clients.append(Client(self.bus, path))
+        reply_later(reply, dbus.ObjectPath(path))
+
+    def live_clients(self):
+        return [client for client in self.clients if not client.released]
+
+    @dbus.service.method(MOCK_IFACE, in_signature="d", out_signature="")
+    def SetLatency(self, latency):
+        # in milliseconds, like --latency
+        Settings.latency = latency / 1000.0
+
+    @dbus.service.method(MOCK_IFACE, in_signature="d", out_signature="")
+    def SetUpdateRate(self, rate):
+        Settings.update_rate = rate
+        for client in self.live_clients():
+            if client.source is not None or rate > 0:
+                client.start_updates(rate)
+
+    @dbus.service.method(MOCK_IFACE, in_signature="i", out_signature="")
+    def EmitPositions(self, count):
+        # emits a burst of position updates on every client, from the main loop
+        remaining = [count]
+        def emit():
+            for client in self.live_clients():
+                client.emit_position()
+            remaining[0] -= 1
+            return remaining[0] > 0
+        if count > 0:
+            gobject.idle_add(emit)
+
+class Geonames(dbus.service.Object):
+
+    def __init__(self, bus):
+        dbus.service.Object.__init__(self, bus, GEONAMES_PATH)
+
+    @dbus.service.method(GEOCLUE_IFACE, in_signature="", out_signature="i",
+                         async_callbacks=("reply", "error"))
+    def GetStatus(self, reply, error):
+        reply_later(reply, STATUS_AVAILABLE)
+
+    @dbus.service.method(GEOCLUE_IFACE, in_signature="", out_signature="ss")
+    def GetProviderInfo(self):
+        return ("Geonames", "Mock Geonames provider")
+
+    @dbus.service.signal(GEOCLUE_IFACE, signature="i")
+    def StatusChanged(self, status):
+        pass
+
+    @dbus.service.method(REVERSE_IFACE, in_signature="dd(idd)", out_signature="a{ss}(idd)",
+                         async_callbacks=("reply", "error"))
+    def PositionToAddress(self, latitude, longitude, accuracy, reply, error):
+        address = dict(ADDRESS)
+        address['street'] = "%.4f %.4f" % (latitude, longitude)
+        reply_later(reply, address, ACCURACY)
+
+PROVIDER_FILE = """[Geoclue Provider]
+Name=Geonames Provider
+Service=%s
+Path=%s
+Interfaces=org.freedesktop.Geoclue.ReverseGeocode
+""" % (GEONAMES_SERVICE, GEONAMES_PATH)
+
+def write_provider_files(path):
+    """Writes the .provider files of the mock providers to a directory."""
+    f = open("%s/geonames.provider" % path, "w")
+    f.write(PROVIDER_FILE)
+    f.close()
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("--latency", type="float", default=0.0,
+                      help="reply latency, in milliseconds")
+    parser.add_option("--update-rate", type="float", default=0.0,
+                      help="position updates per second")
+    (options, args) = parser.parse_args()
+    Settings.latency = options.latency / 1000.0
+    Settings.update_rate = options.update_rate
+
+    DBusGMainLoop(set_as_default=True)
+    bus = dbus.SessionBus()
+    master = Master(bus)
+    geonames = Geonames(bus)
+    # the names are requested last, so the objects exist once they are seen
+    master_name = dbus.service.BusName(MASTER_SERVICE, bus)
+    geonames_name = dbus.service.BusName(GEONAMES_SERVICE, bus)
+
+    print "ready"
+    sys.stdout.flush()
+    gobject.MainLoop().run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys ; sys.path.insert(0, '..')
+
+import unittest
+
+from Geoclue import Geofence
+
+class AntimeridianTest(unittest.TestCase):
+
+    def check(self, cell_size):
+        registry = Geofence.GeofenceRegistry(cell_size)
+        registry.add("east", 10.0, 179.99, 5.0)
+        registry.add("west", 10.0, -179.99, 5.0)
+        # about 2.2 km apart, across the antimeridian
+        self.assertEqual(registry.find(10.0, -179.99), set(["east", "west"]))
+        self.assertEqual(registry.find(10.0, 179.99), set(["east", "west"]))
+        self.assertEqual(registry.find(10.0, 180.0), set(["east", "west"]))
+        self.assertEqual(registry.find(10.0, 179.95), set(["east"]))
+
+    def test_divisor(self):
+        self.check(0.1)
+
+    def test_not_divisor(self):
+        self.check(0.7)
+
+    def test_rounded(self):
+        registry = Geofence.GeofenceRegistry(0.7)
+        self.assertAlmostEqual(360 / registry.cell_size, 514)
+
+if __name__ == "__main__":
+    unittest.main()
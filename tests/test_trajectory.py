@@ -0,0 +1,58 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2009 - Paulo Cabido <paulo.cabido@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys ; sys.path.insert(0, '..')
+
+import unittest
+
+from Geoclue import Trajectory
+
+# about 1.1 m of latitude
+STEP = 0.00001
+
+class StopsTest(unittest.TestCase):
+
+    def trajectory(self, offsets):
+        # 1 Hz fixes along a meridian, the offsets are in steps
+        return Trajectory.Trajectory(range(len(offsets)),
+                                     [38.5 + offset * STEP for offset in offsets],
+                                     [-7.8] * len(offsets))
+
+    def test_still(self):
+        stops = self.trajectory([0] * 600).stops(0.05, 300)
+        self.assertEqual([(stop.start, stop.end) for stop in stops], [(0, 599)])
+
+    def test_excursion(self):
+        # a 1.1 km out and back trip in 300 s between two dwells at the same
+        # place: the fix 300 s after a fix of the first dwell is back within
+        # the radius, but the trip in between is not
+        trip = range(0, 1050, 7)
+        offsets = [0] * 400 + trip + trip[::-1] + [0] * 400
+        stops = self.trajectory(offsets).stops(0.05, 300)
+        self.assertEqual(len(stops), 2)
+        # the first 7 fixes of the trip, up to 46 m, are still within 50 m
+        self.assertEqual((stops[0].start, stops[0].end), (0, 406))
+        self.assertEqual((stops[1].start, stops[1].end), (400 + 2 * len(trip) - 7, len(offsets) - 1))
+        for stop in stops:
+            self.assertTrue(max(offsets[stop.start:stop.end + 1]) * STEP * 111.2 < 0.05)
+            self.assertTrue(stop.departure - stop.arrival >= 300)
+
+    def test_short(self):
+        self.assertEqual(self.trajectory([0] * 200).stops(0.05, 300), [])
+
+if __name__ == "__main__":
+    unittest.main()